@@ -0,0 +1 @@
+"""Load tests for the chat API against a stand-in LLM (see run_benchmark.py)."""
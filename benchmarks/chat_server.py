@@ -0,0 +1,95 @@
+"""
+The /api/chat routes on a bare FastAPI app, pointed at an upstream such as the mock
+server. This is what the benchmarks load: the same `register_chat_routes` and
+`LLMClientManager` as run_server.py, without the WebSocket server, TTS and ASR.
+
+    python -m benchmarks.chat_server --port 18101 --upstream http://127.0.0.1:18100/v1
+
+With --workers N it runs N processes like `run_server.py --workers`, sharing the
+response cache and rate-limit pauses through sqlite files in the temp directory.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import uvicorn
+from fastapi import FastAPI
+from loguru import logger
+
+from src.open_llm_vtuber.chat_api import register_chat_routes
+from src.open_llm_vtuber.llm_config_manager import (
+    LLMSchedulerConfig,
+    OpenAICompatibleConfig,
+    ResponseCacheConfig,
+    initialize_global_llm_manager,
+)
+
+# create_app() arguments, passed to the worker processes
+_OPTIONS_ENV = "BENCHMARK_CHAT_SERVER_OPTIONS"
+
+
+def create_app(upstream: str, model: str = "mock", response_cache: bool = False,
+               coalesce_requests: bool = True, max_concurrency: int = 16, max_queue: int = 64,
+               workers: int = 1) -> FastAPI:
+    app = FastAPI()
+    shared_dir = tempfile.gettempdir()
+    manager = initialize_global_llm_manager(
+        config=OpenAICompatibleConfig(base_url=upstream, llm_api_key="benchmark", model=model),
+        cache_config=ResponseCacheConfig(
+            enabled=response_cache, backend="sqlite" if workers > 1 else "memory",
+            sqlite_path=os.path.join(shared_dir, "benchmark_response_cache.sqlite3"),
+        ),
+        coalesce_requests=coalesce_requests,
+        scheduler_config=LLMSchedulerConfig(
+            max_concurrency=max_concurrency, max_queue=max_queue,
+            shared_state_path=os.path.join(shared_dir, "benchmark_rate_limits.sqlite3"),
+        ),
+        workers=workers,
+    )
+    register_chat_routes(app, manager)
+
+    @app.on_event("shutdown")
+    async def close_llm_clients():
+        await manager.close()
+
+    return app
+
+
+def _quiet_logger() -> None:
+    logger.remove()
+    logger.add(lambda message: None, level="WARNING")
+
+
+def create_worker_app() -> FastAPI:
+    """uvicorn app factory for --workers."""
+    _quiet_logger()
+    return create_app(**json.loads(os.environ[_OPTIONS_ENV]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat API server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18101)
+    parser.add_argument("--upstream", default="http://127.0.0.1:18100/v1")
+    parser.add_argument("--model", default="mock")
+    parser.add_argument("--response-cache", action="store_true")
+    parser.add_argument("--no-coalesce", action="store_true")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    _quiet_logger()
+    options = dict(upstream=args.upstream, model=args.model, response_cache=args.response_cache,
+                   coalesce_requests=not args.no_coalesce, max_concurrency=args.max_concurrency,
+                   max_queue=args.max_queue, workers=args.workers)
+    if args.workers > 1:
+        os.environ[_OPTIONS_ENV] = json.dumps(options)
+        uvicorn.run("benchmarks.chat_server:create_worker_app", factory=True, workers=args.workers,
+                    host=args.host, port=args.port, log_level="warning")
+    else:
+        uvicorn.run(create_app(**options), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
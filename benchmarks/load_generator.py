@@ -0,0 +1,143 @@
+"""
+Load generator for /api/chat and /api/chat/stream.
+
+Either closed-loop (`concurrency` clients, each sending its next request as soon as
+the previous one finished) or open-loop (requests started at a fixed `rate` per
+second regardless of how fast they complete, with at most `concurrency` in flight).
+"""
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+
+# /api/chat answers upstream failures with a 200 and an apology instead of a reply
+_ERROR_REPLY_PREFIX = "Sorry, I encountered an error"
+
+
+@dataclass
+class RequestSample:
+    start: float  # seconds since the load started
+    latency: float
+    status: str  # "ok", "error", "busy" (429) or "failed" (no HTTP response)
+    ttft: Optional[float] = None  # streaming only: until the first delta/sentence frame
+    events: int = 0
+
+
+@dataclass
+class LoadResult:
+    samples: List[RequestSample] = field(default_factory=list)
+    duration: float = 0.0
+
+
+def _prompt(index: int, distinct_prompts: int) -> str:
+    # A small pool of prompts exercises the response cache and request coalescing
+    if distinct_prompts > 0:
+        index %= distinct_prompts
+    return f"Benchmark message {index}: tell me something about the weather."
+
+
+async def _chat(client: httpx.AsyncClient, payload: Dict) -> RequestSample:
+    start = time.perf_counter()
+    response = await client.post("/api/chat", json=payload)
+    latency = time.perf_counter() - start
+    if response.status_code == 429:
+        return RequestSample(0.0, latency, "busy")
+    if response.status_code != 200:
+        return RequestSample(0.0, latency, "error")
+    reply = response.json().get("response", "")
+    status = "error" if not reply or reply.startswith(_ERROR_REPLY_PREFIX) else "ok"
+    return RequestSample(0.0, latency, status)
+
+
+async def _chat_stream(client: httpx.AsyncClient, payload: Dict) -> RequestSample:
+    start = time.perf_counter()
+    ttft = None
+    events = 0
+    status = "error"
+    async with client.stream("POST", "/api/chat/stream", json=payload) as response:
+        if response.status_code != 200:
+            await response.aread()
+            status = "busy" if response.status_code == 429 else "error"
+            return RequestSample(0.0, time.perf_counter() - start, status)
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            events += 1
+            if event["type"] in ("delta", "sentence") and ttft is None:
+                ttft = time.perf_counter() - start
+            elif event["type"] == "done":
+                status = "ok"
+            elif event["type"] == "error":
+                status = "error"
+    return RequestSample(0.0, time.perf_counter() - start, status, ttft, events)
+
+
+async def run_load(base_url: str, *, concurrency: int = 8, rate: Optional[float] = None,
+                   requests: Optional[int] = 200, duration: Optional[float] = None,
+                   stream: bool = False, segment_sentences: bool = False,
+                   distinct_prompts: int = 0, timeout: float = 60.0) -> LoadResult:
+    """
+    Sends requests until `requests` have been sent or `duration` seconds have passed
+    (whichever is set; both may be).
+    """
+    if requests is None and duration is None:
+        raise ValueError("Set requests, duration or both")
+    result = LoadResult()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    sent = 0
+    load_start = time.perf_counter()
+
+    def next_index() -> Optional[int]:
+        nonlocal sent
+        if requests is not None and sent >= requests:
+            return None
+        if duration is not None and time.perf_counter() - load_start >= duration:
+            return None
+        sent += 1
+        return sent - 1
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def one(index: int) -> None:
+            payload = {"message": _prompt(index, distinct_prompts)}
+            if segment_sentences:
+                payload["segment_sentences"] = True
+            started = time.perf_counter() - load_start
+            try:
+                sample = await (_chat_stream(client, payload) if stream else _chat(client, payload))
+            except httpx.HTTPError:
+                sample = RequestSample(0.0, time.perf_counter() - load_start - started, "failed")
+            sample.start = started
+            result.samples.append(sample)
+
+        if rate is None:
+            async def worker() -> None:
+                while (index := next_index()) is not None:
+                    await one(index)
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        else:
+            in_flight = asyncio.Semaphore(concurrency)
+            tasks = []
+
+            async def limited(index: int) -> None:
+                try:
+                    await one(index)
+                finally:
+                    in_flight.release()
+
+            while True:
+                scheduled = load_start + sent / rate
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                index = next_index()
+                if index is None:
+                    break
+                await in_flight.acquire()
+                tasks.append(asyncio.create_task(limited(index)))
+            await asyncio.gather(*tasks)
+
+    result.duration = time.perf_counter() - load_start
+    return result
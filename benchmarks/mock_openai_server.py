@@ -0,0 +1,143 @@
+"""
+Stand-in OpenAI-compatible server for benchmarks.
+
+Serves /v1/chat/completions (plain and streaming) with configurable base latency,
+time to first token, token rate, reply length and error injection, so the chat
+path can be load-tested without a real model.
+
+    python -m benchmarks.mock_openai_server --port 18100 --ttft 0.2 --tokens-per-sec 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import asdict, dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class MockSettings:
+    latency: float = 0.0  # seconds before anything is sent (network + queueing)
+    ttft: float = 0.1  # seconds until the first token
+    tokens_per_sec: float = 100.0
+    reply_tokens: int = 40
+    prompt_tokens: int = 32  # reported in usage
+    error_rate: float = 0.0  # share of requests answered with `error_status`
+    error_status: int = 500
+    retry_after: float = 1.0  # Retry-After sent with 429 errors
+    seed: int = 0
+
+
+def _reply_tokens(count: int):
+    words = ["Hello", "there", "this", "is", "a", "mock", "reply", "from", "the", "benchmark", "server."]
+    return [(" " if i else "") + words[i % len(words)] for i in range(count)]
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(settings.seed)
+    counters = {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def error_response():
+        counters["errors"] += 1
+        headers = {"retry-after": str(settings.retry_after)} if settings.error_status == 429 else {}
+        return JSONResponse({"error": {"message": "injected error", "type": "mock_error"}},
+                            status_code=settings.error_status, headers=headers)
+
+    def usage():
+        return {
+            "prompt_tokens": settings.prompt_tokens,
+            "completion_tokens": settings.reply_tokens,
+            "total_tokens": settings.prompt_tokens + settings.reply_tokens,
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        counters["requests"] += 1
+        model = body.get("model", "mock")
+        if settings.latency:
+            await asyncio.sleep(settings.latency)
+        if settings.error_rate and rng.random() < settings.error_rate:
+            return error_response()
+        tokens = _reply_tokens(settings.reply_tokens)
+        interval = 1.0 / settings.tokens_per_sec if settings.tokens_per_sec > 0 else 0.0
+
+        if not body.get("stream"):
+            counters["in_flight"] += 1
+            counters["max_in_flight"] = max(counters["max_in_flight"], counters["in_flight"])
+            try:
+                await asyncio.sleep(settings.ttft + interval * max(0, len(tokens) - 1))
+            finally:
+                counters["in_flight"] -= 1
+            return {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage(),
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def events():
+            counters["in_flight"] += 1
+            counters["max_in_flight"] = max(counters["max_in_flight"], counters["in_flight"])
+            try:
+                await asyncio.sleep(settings.ttft)
+                for index, token in enumerate(tokens):
+                    if index:
+                        await asyncio.sleep(interval)
+                    chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": model,
+                             "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                if include_usage:
+                    chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": model,
+                             "choices": [], "usage": usage()}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                counters["in_flight"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model"}]}
+
+    @app.get("/mock/stats")
+    async def stats():
+        return {**counters, "settings": asdict(settings)}
+
+    return app
+
+
+def add_settings_arguments(parser: argparse.ArgumentParser, prefix: str = "") -> None:
+    """Adds one option per `MockSettings` field (e.g. --ttft, or --mock-ttft with a prefix)."""
+    for name, default in asdict(MockSettings()).items():
+        parser.add_argument(f"--{prefix}{name.replace('_', '-')}", type=type(default), default=default,
+                            dest=f"{prefix.replace('-', '_')}{name}")
+
+
+def settings_from_args(args: argparse.Namespace, prefix: str = "") -> MockSettings:
+    return MockSettings(**{name: getattr(args, f"{prefix.replace('-', '_')}{name}")
+                           for name in asdict(MockSettings())})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18100)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(settings_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
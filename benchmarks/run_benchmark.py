@@ -0,0 +1,284 @@
+"""
+End-to-end benchmark of the chat API against a stand-in LLM.
+
+Starts the mock OpenAI-compatible server and the chat server (each in its own
+process), drives /api/chat or /api/chat/stream with the load generator and reports
+latency percentiles, throughput, time to first token and the chat server's memory
+and file-descriptor growth. Results are written as JSON; pass an earlier result with
+--compare to flag regressions.
+
+    python -m benchmarks.run_benchmark --concurrency 32 --requests 500 --stream \\
+        --mock-ttft 0.2 --output results/stream.json --compare results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+from .load_generator import LoadResult, run_load
+from .mock_openai_server import add_settings_arguments, settings_from_args
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = {
+    "latency.p50": False,
+    "latency.p95": False,
+    "latency.p99": False,
+    "ttft.p50": False,
+    "ttft.p95": False,
+    "throughput_rps": True,
+    "error_rate": False,
+    "server.rss_growth_kb": False,
+    "server.fd_growth": False,
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server for {url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server for {url} did not start within {timeout:.0f}s")
+
+
+@contextmanager
+def _server(module: str, args: List[str], ready_url: str) -> Iterator[subprocess.Popen]:
+    process = subprocess.Popen([sys.executable, "-m", module, *args], cwd=ROOT)
+    try:
+        _wait_ready(ready_url, process)
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def process_usage(pid: int) -> Dict[str, Optional[int]]:
+    """Resident memory (KiB) and open file descriptors of a process, where the OS reports them."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            rss = next((int(line.split()[1]) for line in status if line.startswith("VmRSS:")), None)
+        return {"rss_kb": rss, "fds": len(os.listdir(f"/proc/{pid}/fd"))}
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return {"rss_kb": None, "fds": None}
+    process = psutil.Process(pid)
+    fds = process.num_fds() if hasattr(process, "num_fds") else process.num_handles()
+    return {"rss_kb": process.memory_info().rss // 1024, "fds": fds}
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+            "mean": sum(ordered) / len(ordered), "max": ordered[-1]}
+
+
+def summarize(result: LoadResult) -> Dict:
+    samples = result.samples
+    ok = [s for s in samples if s.status == "ok"]
+    statuses: Dict[str, int] = {}
+    for sample in samples:
+        statuses[sample.status] = statuses.get(sample.status, 0) + 1
+    return {
+        "requests": len(samples),
+        "statuses": statuses,
+        "error_rate": (len(samples) - len(ok)) / len(samples) if samples else 0.0,
+        "duration": result.duration,
+        "throughput_rps": len(ok) / result.duration if result.duration else 0.0,
+        "latency": percentiles([s.latency for s in ok]),
+        "ttft": percentiles([s.ttft for s in ok if s.ttft is not None]),
+    }
+
+
+def _lookup(result: Dict, path: str) -> Optional[float]:
+    value = result
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value if isinstance(value, (int, float)) else None
+
+
+# Differences below these are noise (allocator arenas, keep-alive sockets, a stray error)
+_ABSOLUTE_SLACK = {"error_rate": 0.01, "server.rss_growth_kb": 4096, "server.fd_growth": 4}
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    """Returns a line per metric that got worse than the baseline by more than `tolerance`."""
+    regressions = []
+    for path, higher_is_better in COMPARED_METRICS.items():
+        before, after = _lookup(baseline, path), _lookup(current, path)
+        if before is None or after is None:
+            continue
+        slack = _ABSOLUTE_SLACK.get(path, 0.0)
+        if higher_is_better:
+            worse = after < before * (1 - tolerance) - slack
+        else:
+            worse = after > before * (1 + tolerance) + slack
+        if worse:
+            regressions.append(f"{path}: {before:.4g} -> {after:.4g}")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load-test the chat API against a mock LLM")
+    load = parser.add_argument_group("load")
+    load.add_argument("--concurrency", type=int, default=8, help="Clients (closed loop) or max in flight (with --rate)")
+    load.add_argument("--rate", type=float, default=None, help="Open loop: requests started per second")
+    load.add_argument("--requests", type=int, default=None, help="Requests to send (default 200 without --duration)")
+    load.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    load.add_argument("--warmup", type=int, default=10, help="Requests sent before measuring")
+    load.add_argument("--stream", action="store_true", help="Use /api/chat/stream")
+    load.add_argument("--segment-sentences", action="store_true", help="Stream in sentence mode")
+    load.add_argument("--distinct-prompts", type=int, default=0,
+                      help="Cycle through this many prompts (0: every prompt is unique)")
+
+    server = parser.add_argument_group("chat server")
+    server.add_argument("--target", default=None,
+                        help="Benchmark an already running server at this URL instead of starting one")
+    server.add_argument("--response-cache", action="store_true")
+    server.add_argument("--no-coalesce", action="store_true")
+    server.add_argument("--max-concurrency", type=int, default=16, help="Scheduler slots per upstream")
+    server.add_argument("--max-queue", type=int, default=64)
+    server.add_argument("--workers", type=int, default=1, help="Chat server processes (like run_server.py --workers)")
+
+    add_settings_arguments(parser.add_argument_group("mock LLM"), prefix="mock-")
+
+    output = parser.add_argument_group("output")
+    output.add_argument("--output", default=None, help="Write the result JSON here")
+    output.add_argument("--compare", default=None, help="Baseline result JSON to check for regressions")
+    output.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown")
+    args = parser.parse_args(argv)
+    if args.requests is None and args.duration is None:
+        args.requests = 200
+    return args
+
+
+async def _measure(args: argparse.Namespace, base_url: str, pid: Optional[int]) -> Dict:
+    load_options = dict(concurrency=args.concurrency, stream=args.stream,
+                        segment_sentences=args.segment_sentences, distinct_prompts=args.distinct_prompts)
+    if args.warmup:
+        await run_load(base_url, requests=args.warmup, **load_options)
+    before = process_usage(pid) if pid else None
+    result = await run_load(base_url, rate=args.rate, requests=args.requests, duration=args.duration,
+                            **load_options)
+    summary = summarize(result)
+    if pid:
+        after = process_usage(pid)
+
+        def growth(key: str) -> Optional[int]:
+            return None if before[key] is None or after[key] is None else after[key] - before[key]
+
+        summary["server"] = {"before": before, "after": after,
+                             "rss_growth_kb": growth("rss_kb"), "fd_growth": growth("fds")}
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        response = await client.get("/api/llm/stats")
+        if response.status_code == 200:
+            summary["llm_stats"] = response.json()
+    return summary
+
+
+def run(args: argparse.Namespace) -> Dict:
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "tolerance")}
+    if args.target:
+        summary = asyncio.run(_measure(args, args.target, None))
+    else:
+        mock_port, chat_port = _free_port(), _free_port()
+        mock_args = []
+        for name, value in vars(settings_from_args(args, prefix="mock-")).items():
+            mock_args += [f"--{name.replace('_', '-')}", str(value)]
+        chat_args = ["--port", str(chat_port), "--upstream", f"http://127.0.0.1:{mock_port}/v1",
+                     "--max-concurrency", str(args.max_concurrency), "--max-queue", str(args.max_queue),
+                     "--workers", str(args.workers)]
+        if args.response_cache:
+            chat_args.append("--response-cache")
+        if args.no_coalesce:
+            chat_args.append("--no-coalesce")
+        base_url = f"http://127.0.0.1:{chat_port}"
+        with _server("benchmarks.mock_openai_server", ["--port", str(mock_port), *mock_args],
+                     f"http://127.0.0.1:{mock_port}/v1/models"), \
+                _server("benchmarks.chat_server", chat_args, f"{base_url}/metrics") as chat_process:
+            summary = asyncio.run(_measure(args, base_url, chat_process.pid))
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        **summary,
+    }
+
+
+def _format(value: Optional[float], scale: float = 1000.0, unit: str = "ms") -> str:
+    return "-" if value is None else f"{value * scale:.1f}{unit}"
+
+
+def print_report(result: Dict) -> None:
+    latency, ttft = result["latency"], result["ttft"]
+    print(f"requests: {result['requests']}  statuses: {result['statuses']}  duration: {result['duration']:.2f}s")
+    print(f"throughput: {result['throughput_rps']:.1f} req/s  error rate: {result['error_rate']:.2%}")
+    print("latency:  " + "  ".join(f"{q} {_format(latency[q])}" for q in ("p50", "p95", "p99", "max")))
+    if ttft["p50"] is not None:
+        print("ttft:     " + "  ".join(f"{q} {_format(ttft[q])}" for q in ("p50", "p95", "p99", "max")))
+    server = result.get("server")
+    if server:
+        print(f"server:   rss {server['before']['rss_kb']} -> {server['after']['rss_kb']} KiB, "
+              f"fds {server['before']['fds']} -> {server['after']['fds']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    result = run(args)
+    print_report(result)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved results to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, result, args.tolerance)
+        if regressions:
+            print(f"Regressions against {args.compare} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,21 @@
 import os
 import sys
 import atexit
+import asyncio
 import argparse
 from pathlib import Path
+from functools import lru_cache
 import tomli
-import uvicorn
 from loguru import logger
-from fastapi import FastAPI # Added for endpoint
-from pydantic import BaseModel # Added for request model
-from typing import List, Optional # Added for request model typing
-
-from upgrade import sync_user_config, select_language
-from src.open_llm_vtuber.server import WebSocketServer
-from src.open_llm_vtuber.config_manager import Config, read_yaml, validate_config
-# Corrected import for validate_config based on its usage pattern
-from src.open_llm_vtuber.llm_config_manager import (
-    LLMClientManager,
-    OpenAICompatibleConfig,
-    initialize_global_llm_manager,
-    global_llm_client_manager
-)
+from typing import Dict, Optional
+
+# Only lightweight imports here: the server stack is imported inside run() and build_app(),
+# after --profile-startup has had a chance to start timing imports
+from src.open_llm_vtuber.startup_profile import PROFILER
+
+# Passed from the main process to the worker processes of --workers
+WORKERS_ENV = "OPEN_LLM_VTUBER_WORKERS"
+LOG_LEVEL_ENV = "OPEN_LLM_VTUBER_LOG_LEVEL"
 
 
 os.environ["HF_HOME"] = str(Path(__file__).parent / "models")
@@ -38,10 +34,10 @@ def init_logger(console_log_level: str = "INFO") -> None:
     logger.add(
         sys.stderr,
         level=console_log_level,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</
-level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | {mess
-age}",
+        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | {message}",
         colorize=True,
+        # Log records are written by a background thread, so logging never blocks the event loop
+        enqueue=True,
     )
 
     # File output
@@ -50,39 +46,142 @@ age}",
         rotation="10 MB",
         retention="30 days",
         level="DEBUG",
-        format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}
-:{line} | {message} | {extra}",
+        format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} | {message} | {extra}",
         backtrace=True,
         diagnose=True,
+        enqueue=True,
     )
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Open-LLM-VTuber Server")
-    parser.add_argument("--verbose", action="store_true", help="Enable verbose l
-ogging")
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
     parser.add_argument(
         "--hf_mirror", action="store_true", help="Use Hugging Face mirror"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of server processes; sessions, cached responses and rate limits are then shared via sqlite",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report import and initialization time per module, then exit without serving",
+    )
     return parser.parse_args()
 
 
 @logger.catch
-def run(console_log_level: str):
+def run(console_log_level: str, profile_startup: bool = False, workers: int = 1):
     init_logger(console_log_level)
     logger.info(f"Open-LLM-VTuber, version v{get_version()}")
+
+    with PROFILER.phase("import server stack"):
+        import uvicorn
+        from upgrade import sync_user_config, select_language
+        from src.open_llm_vtuber.server import WebSocketServer
+        from src.open_llm_vtuber.config_manager import read_yaml, validate_config
+
     # Sync user config with default config
     try:
-        sync_user_config(logger=logger, lang=select_language())
+        with PROFILER.phase("sync user config"):
+            sync_user_config(logger=logger, lang=select_language())
     except Exception as e:
         logger.error(f"Error syncing user config: {e}")
 
+    # Clears the per-utterance audio files in cache/; the TTS audio cache lives elsewhere and persists
     atexit.register(WebSocketServer.clean_cache)
 
+    if workers > 1 and not profile_startup:
+        # Every worker process builds its own app (and LLM client manager) in create_worker_app()
+        server_config = validate_config(read_yaml("conf.yaml")).system_config
+        os.environ[WORKERS_ENV] = str(workers)
+        os.environ[LOG_LEVEL_ENV] = console_log_level
+        logger.info(f"Starting {workers} worker processes")
+        uvicorn.run(
+            "run_server:create_worker_app",
+            factory=True,
+            workers=workers,
+            host=server_config.host,
+            port=server_config.port,
+            log_level=console_log_level.lower(),
+        )
+        return
+
+    app = build_app()
+
+    if profile_startup:
+        PROFILER.stop()
+        PROFILER.log_report()
+        return
+
+    uvicorn.run(
+        app=app,
+        host=app.state.server_config.host,
+        port=app.state.server_config.port,
+        log_level=console_log_level.lower(),
+    )
+
+
+def create_worker_app():
+    """uvicorn app factory, called in each worker process of `--workers`."""
+    init_logger(os.environ.get(LOG_LEVEL_ENV, "INFO"))
+    return build_app(workers=int(os.environ.get(WORKERS_ENV, "1")))
+
+
+def build_app(workers: int = 1):
+    """
+    Loads the config and builds the server app with its LLM client manager, stores and
+    routes. With several workers, state that has to be shared between them (sessions,
+    cached responses, rate-limit pauses) is kept in sqlite instead of process memory.
+    """
+    with PROFILER.phase("import app modules"):
+        from src.open_llm_vtuber.server import WebSocketServer
+        from src.open_llm_vtuber.config_manager import Config, read_yaml, validate_config
+        from src.open_llm_vtuber.session_store import create_session_store
+        from src.open_llm_vtuber.chat_api import register_chat_routes
+        from src.open_llm_vtuber.character_registry import CharacterRegistry
+        from src.open_llm_vtuber.prompt_compiler import PromptCompiler
+        from src.open_llm_vtuber.prompts import prompt_loader
+        from src.open_llm_vtuber.group_conversation import GroupTurnScheduler
+        from src.open_llm_vtuber.live2d_model import Live2dModel
+        from src.open_llm_vtuber.audio_stream import register_audio_stream_route
+        from src.open_llm_vtuber.warm_pool import WarmPool
+        from src.open_llm_vtuber.tts_cache import create_tts_cache, load_phrases, prewarm, wrap_tts_engine
+        from src.open_llm_vtuber.character_manager import TTSCacheConfig
+        from src.open_llm_vtuber.llm_config_manager import (
+            LLMClientManager,
+            LLMClientPoolConfig,
+            LLMRouterConfig,
+            LLMSchedulerConfig,
+            OpenAICompatibleConfig,
+            ResponseCacheConfig,
+            SessionStoreConfig,
+            WarmPoolConfig,
+            initialize_global_llm_manager,
+        )
+
     # Load configurations from yaml file
-    config: Config = validate_config(read_yaml("conf.yaml")) # type: ignore
+    with PROFILER.phase("load config"):
+        raw_config = read_yaml("conf.yaml")
+        config: Config = validate_config(raw_config) # type: ignore
     server_config = config.system_config
 
+    def system_setting(name: str, default=None):
+        # Settings SystemConfig does not declare are dropped by validation, so fall back to the yaml
+        value = getattr(server_config, name, None)
+        if value is None:
+            value = (raw_config.get("system_config") or {}).get(name, default)
+        return value
+
+    # Validated once and re-validated only when a file changes, so character switches
+    # are a lookup and edits apply without a restart
+    with PROFILER.phase("character registry"):
+        character_registry = CharacterRegistry(server_config.config_alts_dir, base_config_path="conf.yaml")
+        character_registry.refresh()
+
     # Initialize the global LLM client manager
     # We need to extract a default LLM configuration that fits OpenAICompatibleConfig
     # This is a simplification; the actual config path might be more complex
@@ -90,10 +189,35 @@ def run(console_log_level: str):
     # or config.character_config.agent_config.llm_configs.openai_llm etc.
     # We'll try to find a compatible one or pass None.
     default_llm_config_for_manager: Optional[OpenAICompatibleConfig] = None
+    pool_config: Optional[LLMClientPoolConfig] = None
+    cache_config: Optional[ResponseCacheConfig] = None
+    coalesce_requests = True
+    cache_breakpoints = True
+    prepend_persona_prompt = False
+    session_store_config: Optional[SessionStoreConfig] = None
+    router_config: Optional[LLMRouterConfig] = None
+    router_backends: Dict[str, OpenAICompatibleConfig] = {}
+    scheduler_config: Optional[LLMSchedulerConfig] = None
+    warm_pool_config: Optional[WarmPoolConfig] = None
     if config.character_config and \
        config.character_config.agent_config and \
        config.character_config.agent_config.llm_configs:
         llm_configs = config.character_config.agent_config.llm_configs
+        pool_config = llm_configs.client_pool
+        cache_config = llm_configs.response_cache
+        coalesce_requests = llm_configs.coalesce_requests
+        cache_breakpoints = llm_configs.cache_breakpoints
+        prepend_persona_prompt = llm_configs.prepend_persona_prompt
+        session_store_config = llm_configs.session_store
+        router_config = llm_configs.router
+        scheduler_config = llm_configs.scheduler
+        warm_pool_config = llm_configs.warm_pool
+        for name in router_config.backends:
+            backend = getattr(llm_configs, name, None)
+            if isinstance(backend, OpenAICompatibleConfig):
+                router_backends[name] = backend
+            else:
+                logger.warning(f"Router backend '{name}' is not a configured OpenAI-compatible LLM, skipping it.")
         # Prioritize openai_compatible_llm, then ollama, then openai official
         if llm_configs.openai_compatible_llm and isinstance(llm_configs.openai_compatible_llm, OpenAICompatibleConfig):
             default_llm_config_for_manager = llm_configs.openai_compatible_llm
@@ -103,47 +227,151 @@ def run(console_log_level: str):
             default_llm_config_for_manager = llm_configs.openai_llm
         # Add other potential compatible configs here if necessary
 
+    if workers > 1:
+        # Worker processes do not see each other's memory, so shared state goes to sqlite
+        if session_store_config and session_store_config.enabled and session_store_config.backend == "memory":
+            logger.info("Multiple workers: keeping chat sessions in sqlite instead of memory")
+            session_store_config = session_store_config.model_copy(update={"backend": "sqlite"})
+        if cache_config and cache_config.enabled and cache_config.backend == "memory":
+            logger.info("Multiple workers: keeping cached LLM responses in sqlite instead of memory")
+            cache_config = cache_config.model_copy(update={"backend": "sqlite"})
+
     if default_llm_config_for_manager:
         logger.info(f"Initializing LLM Manager with default config: {default_llm_config_for_manager.model_dump(exclude_none=True)}")
     else:
         logger.warning("No compatible default LLM config found for LLMClientManager. It will rely on user-provided keys for OpenRouter.")
-    initialize_global_llm_manager(config=default_llm_config_for_manager)
+    # Keep a reference to the manager; the module-level global is rebound on initialization,
+    # so importing the global by name would still give None.
+    with PROFILER.phase("LLM client manager"):
+        llm_client_manager: LLMClientManager = initialize_global_llm_manager(
+            config=default_llm_config_for_manager, pool_config=pool_config, cache_config=cache_config,
+            coalesce_requests=coalesce_requests, router_config=router_config, router_backends=router_backends,
+            scheduler_config=scheduler_config, cache_breakpoints=cache_breakpoints, workers=workers,
+        )
+    response_cache_ttl = config.character_config.response_cache_ttl
+    if default_llm_config_for_manager:
+        # Every configured backend may declare its own context budget and concurrency limit
+        for field_name in type(llm_configs).model_fields:
+            backend = getattr(llm_configs, field_name)
+            if not isinstance(backend, OpenAICompatibleConfig):
+                continue
+            if backend.context_token_budget:
+                llm_client_manager.context_window.set_budget(backend.model, backend.context_token_budget)
+            llm_client_manager.set_concurrency_limit(backend)
+    # Local models of every character, loaded at startup and kept loaded
+    warm_pool = WarmPool.from_config(
+        warm_pool_config,
+        [config.character_config] + [
+            character_registry.get(character["filename"]) for character in character_registry.list_characters()
+        ],
+        workers=workers,
+    )
+    llm_client_manager.warm_pool = warm_pool
+    if warm_pool:
+        # Edited or new character files may select another local model
+        character_registry.add_listener(
+            lambda changed: warm_pool.add_characters(character_registry.get(filename) for filename in changed)
+        )
+
+    # Server-side chat history, so clients with a session_id only upload the new turn
+    with PROFILER.phase("session store"):
+        session_store = create_session_store(session_store_config)
 
+    with PROFILER.phase("TTS audio cache"):
+        # One process-wide cache, so it is a system setting rather than a per-character one
+        tts_cache_config = system_setting("tts_cache")
+        if not isinstance(tts_cache_config, TTSCacheConfig):
+            tts_cache_config = TTSCacheConfig.model_validate(tts_cache_config or {})
+        tts_cache = create_tts_cache(tts_cache_config)
 
     # Initialize and run the WebSocket server
-    server = WebSocketServer(config=config)
-
-    # Define Pydantic model for chat request
-    class ChatRequest(BaseModel):
-        message: str
-        history: List[dict] = []
-        openRouterApiKey: Optional[str] = None
-        openRouterModelName: Optional[str] = None
-
-    # Add HTTP endpoint to the existing FastAPI app instance within WebSocketServer
-    @server.app.post("/api/chat") # type: ignore
-    async def chat_endpoint(request: ChatRequest):
-        logger.info(f"Received chat request: {request.message}")
-        messages = request.history + [{"role": "user", "content": request.message}]
-
-        if not global_llm_client_manager:
-            logger.error("LLM Client Manager not initialized.")
-            return {"error": "LLM Client Manager not initialized."}
-
-        response_text = await global_llm_client_manager.generate_response(
-            messages=messages, # type: ignore
-            user_api_key=request.openRouterApiKey,
-            user_openrouter_model_name=request.openRouterModelName
+    with PROFILER.phase("WebSocketServer"):
+        server = WebSocketServer(config=config)
+    server.app.state.server_config = server_config
+
+    # Client sessions start from the default context, so they share the wrapped engine
+    default_context = getattr(server, "default_context_cache", None)
+    if tts_cache and getattr(default_context, "tts_engine", None) is not None:
+        default_context.tts_engine = wrap_tts_engine(
+            default_context.tts_engine, config.character_config.tts_config, tts_cache
         )
-        return {"response": response_text}
 
-    uvicorn.run(
-        app=server.app, # type: ignore
-        host=server_config.host,
-        port=server_config.port,
-        log_level=console_log_level.lower(),
+    @server.app.on_event("startup") # type: ignore
+    async def prewarm_tts_cache():
+        if not tts_cache or not tts_cache_config.prewarm_phrases_file:
+            return
+        engine = getattr(default_context, "tts_engine", None)
+        if engine is None:
+            logger.warning("No TTS engine to prewarm the TTS audio cache with.")
+            return
+        try:
+            phrases = load_phrases(tts_cache_config.prewarm_phrases_file)
+        except OSError as e:
+            logger.warning(f"Could not read the TTS prewarm phrases: {e}")
+            return
+        # In the background, so startup does not wait for synthesis; kept referenced until done
+        server.app.state.tts_prewarm = asyncio.create_task(prewarm(engine, phrases))
+
+    @server.app.on_event("startup") # type: ignore
+    async def watch_character_configs():
+        character_registry.start_watching()
+        if warm_pool:
+            warm_pool.start()
+
+    @server.app.on_event("shutdown") # type: ignore
+    async def close_llm_clients():
+        await character_registry.stop_watching()
+        if warm_pool:
+            await warm_pool.close()
+        await llm_client_manager.close()
+        if session_store is not None:
+            session_store.close()
+
+    @lru_cache(maxsize=None)
+    def emotion_keys(live2d_model_name: str) -> str:
+        # What the live2d expression prompt lists, as in the agents' own system prompts
+        return Live2dModel(live2d_model_name).emo_str
+
+    prompt_compiler = PromptCompiler(
+        tool_prompts=server_config.tool_prompts,
+        substitutions=lambda character: {"[<insert_emomap_keys>]": emotion_keys(character.live2d_model_name)},
+    )
+    # Rounds of /api/chat/group, each participant's reply from its own LLM
+    group_scheduler = GroupTurnScheduler.from_config(
+        llm_client_manager,
+        system_setting("group_turns"),
+        prompt_compiler=prompt_compiler,
+        group_prompt=prompt_loader.load_util(server_config.group_conversation_prompt)
+        if server_config.group_conversation_prompt else "",
     )
 
+    register_chat_routes(
+        server.app,
+        llm_client_manager,
+        session_store=session_store,
+        response_cache_ttl=response_cache_ttl,
+        tts_preprocessor_config=config.character_config.tts_preprocessor_config,
+        # Per request, so character switches are an index lookup and edits apply without a restart
+        character=lambda key: character_registry.get(key or character_registry.base_filename),
+        prompt_compiler=prompt_compiler if prepend_persona_prompt else None,
+        # Goes through the TTS audio cache when it is enabled (wrapped above)
+        synthesize=default_context.tts_engine.async_generate_audio
+        if getattr(default_context, "tts_engine", None) is not None else None,
+        group_scheduler=group_scheduler,
+    )
+
+    # Binary audio frames with incremental VAD and (for online models) streaming ASR
+    if getattr(default_context, "vad_engine", None) is not None and \
+            config.character_config.vad_config.vad_model == "silero_vad":
+        register_audio_stream_route(
+            server.app,
+            vad_engine=lambda: default_context.vad_engine,
+            asr_engine=lambda: default_context.asr_engine,
+            vad_config=config.character_config.vad_config.silero_vad,
+        )
+
+    return server.app
+
 
 if __name__ == "__main__":
     args = parse_args()
@@ -152,9 +380,10 @@ if __name__ == "__main__":
         logger.info("Running in verbose mode")
     else:
         logger.info(
-            "Running in standard mode. For detailed debug logs, use: uv run run_
-server.py --verbose"
+            "Running in standard mode. For detailed debug logs, use: uv run run_server.py --verbose"
         )
     if args.hf_mirror:
         os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
-    run(console_log_level=console_log_level)
+    if args.profile_startup:
+        PROFILER.start()
+    run(console_log_level=console_log_level, profile_startup=args.profile_startup, workers=args.workers)
@@ -0,0 +1,361 @@
+"""
+Streaming audio ingestion for server-side VAD and ASR.
+
+Binary WebSocket frames (mono PCM at `SAMPLE_RATE`, little-endian float32 or int16)
+are viewed with `np.frombuffer` and copied once into a preallocated ring buffer;
+no Python lists or intermediate bytes objects are created per frame. VAD runs
+incrementally on fixed windows as they fill. Streaming ASR models (sherpa-onnx
+online recognizers) are fed while the user is still speaking, so partial
+transcripts go out early and the final one is ready at the end of speech; offline
+models get the utterance as one array when speech ends. Each connection has VAD and
+ASR state of its own, and the model calls run in a worker thread, off the event loop.
+"""
+import asyncio
+import copy
+import json
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Literal, Optional
+
+import numpy as np
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from loguru import logger
+
+from . import metrics
+
+SAMPLE_RATE = 16000
+# Silero VAD's window at 16 kHz
+VAD_WINDOW = 512
+
+SampleFormat = Literal["float32", "int16"]
+_FRAME_DTYPES = {"float32": np.dtype("<f4"), "int16": np.dtype("<i2")}
+_INT16_SCALE = 1.0 / 32768.0
+
+
+class AudioRingBuffer:
+    """Fixed-size float32 sample buffer addressed by absolute sample position."""
+
+    __slots__ = ("_buffer", "capacity", "written")
+
+    def __init__(self, capacity: int):
+        self._buffer = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        # Samples written since creation; positions below `oldest` are overwritten
+        self.written = 0
+
+    @property
+    def oldest(self) -> int:
+        return max(0, self.written - self.capacity)
+
+    def write(self, samples: np.ndarray, scale: float = 1.0) -> None:
+        """Copies (and scales, e.g. int16 to float) `samples` in, overwriting the oldest ones."""
+        n = len(samples)
+        if n > self.capacity:
+            self.written += n - self.capacity
+            samples, n = samples[-self.capacity:], self.capacity
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        for target, source in ((self._buffer[start:start + first], samples[:first]),
+                               (self._buffer[:n - first], samples[first:])):
+            if scale == 1.0:
+                np.copyto(target, source, casting="unsafe")
+            else:
+                np.multiply(source, scale, out=target, casting="unsafe")
+        self.written += n
+
+    def read(self, start: int, end: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Samples [start, end) as a view into the buffer, or copied into `out` (allocated if
+        None) when the range wraps around. Views are only valid until the next write.
+        """
+        if start < self.oldest or end > self.written or start > end:
+            raise ValueError(f"Samples [{start}, {end}) are not in the buffer "
+                             f"[{self.oldest}, {self.written})")
+        length = end - start
+        offset = start % self.capacity
+        if offset + length <= self.capacity:
+            return self._buffer[offset:offset + length]
+        if out is None:
+            out = np.empty(length, dtype=np.float32)
+        head = self.capacity - offset
+        out[:head] = self._buffer[offset:]
+        out[head:length] = self._buffer[:length - head]
+        return out[:length]
+
+
+class StreamingVAD:
+    """
+    Speech detection one window at a time, with the hysteresis of the silero engine:
+    a smoothed speech probability plus a loudness gate, `required_hits` speech windows
+    to start an utterance and `required_misses` silent windows to end it.
+    """
+
+    def __init__(self, speech_prob: Callable[[np.ndarray], float], prob_threshold: float = 0.4,
+                 db_threshold: float = 60, required_hits: int = 3, required_misses: int = 24,
+                 smoothing_window: int = 5):
+        self.speech_prob = speech_prob
+        self.prob_threshold = prob_threshold
+        self.db_threshold = db_threshold
+        self.required_hits = required_hits
+        self.required_misses = required_misses
+        self._probs: deque = deque(maxlen=max(1, smoothing_window))
+        self.speaking = False
+        self._hits = 0
+        self._misses = 0
+
+    @classmethod
+    def from_config(cls, speech_prob: Callable[[np.ndarray], float], config) -> "StreamingVAD":
+        """Uses the thresholds of a `silero_vad` config section."""
+        settings = {name: getattr(config, name) for name in
+                    ("prob_threshold", "db_threshold", "required_hits", "required_misses", "smoothing_window")
+                    if getattr(config, name, None) is not None}
+        return cls(speech_prob, **settings)
+
+    @staticmethod
+    def loudness_db(window: np.ndarray) -> float:
+        # On the int16 scale, where the silero config's thresholds are set
+        rms = float(np.sqrt(np.dot(window, window) / len(window))) * 32768.0
+        return 20.0 * np.log10(rms) if rms > 0 else -np.inf
+
+    def process(self, window: np.ndarray) -> Optional[str]:
+        """Returns "start" or "end" when the window changes the state, else None."""
+        self._probs.append(self.speech_prob(window))
+        is_speech = (sum(self._probs) / len(self._probs) >= self.prob_threshold
+                     and self.loudness_db(window) >= self.db_threshold)
+        if is_speech:
+            self._hits += 1
+            self._misses = 0
+            if not self.speaking and self._hits >= self.required_hits:
+                self.speaking = True
+                return "start"
+        else:
+            self._misses += 1
+            self._hits = 0
+            if self.speaking and self._misses >= self.required_misses:
+                self.speaking = False
+                return "end"
+        return None
+
+    def reset(self) -> None:
+        self._probs.clear()
+        self.speaking = False
+        self._hits = self._misses = 0
+        reset_model = getattr(self.speech_prob, "reset", None)
+        if reset_model is not None:
+            reset_model()
+
+
+class SileroSpeechProb:
+    """
+    Speech probability of one window. The silero model is recurrent, so every stream
+    gets its own copy of the `VADEngine`'s model, with freshly reset state.
+    """
+
+    def __init__(self, vad_engine, sample_rate: int = SAMPLE_RATE):
+        import torch
+
+        self._torch = torch
+        self.model = copy.deepcopy(vad_engine.model)
+        self.sample_rate = sample_rate
+        self.reset()
+
+    def __call__(self, window: np.ndarray) -> float:
+        with self._torch.no_grad():
+            return self.model(self._torch.from_numpy(window), self.sample_rate).item()
+
+    def reset(self) -> None:
+        self.model.reset_states()
+
+
+class OnlineRecognition:
+    """Feeds a sherpa-onnx `OnlineRecognizer` as audio arrives."""
+
+    def __init__(self, recognizer, sample_rate: int = SAMPLE_RATE):
+        self.recognizer = recognizer
+        self.sample_rate = sample_rate
+        self.stream = recognizer.create_stream()
+        self.text = ""
+
+    def _decode(self) -> str:
+        while self.recognizer.is_ready(self.stream):
+            self.recognizer.decode_stream(self.stream)
+        result = self.recognizer.get_result(self.stream)
+        self.text = getattr(result, "text", result).strip()
+        return self.text
+
+    def accept(self, samples: np.ndarray) -> str:
+        """Decodes `samples` and returns the hypothesis so far."""
+        self.stream.accept_waveform(self.sample_rate, samples)
+        return self._decode()
+
+    def finish(self) -> str:
+        self.stream.input_finished()
+        return self._decode()
+
+
+def online_recognizer(asr_engine) -> Optional[Any]:
+    """The ASR engine's recognizer if it is a streaming (online) one, else None."""
+    recognizer = getattr(asr_engine, "recognizer", None)
+    if recognizer is not None and hasattr(recognizer, "is_endpoint") and hasattr(recognizer, "create_stream"):
+        return recognizer
+    return None
+
+
+async def transcribe(asr_engine, audio: np.ndarray) -> str:
+    if hasattr(asr_engine, "async_transcribe_np"):
+        return await asr_engine.async_transcribe_np(audio)
+    return await asyncio.to_thread(asr_engine.transcribe_np, audio)
+
+
+class AudioStreamSession:
+    """
+    VAD and ASR state of one audio stream. `feed()` takes raw frames and returns the
+    events they caused:
+        {"type": "speech-start"}
+        {"type": "partial", "text": ...}                  (streaming ASR only)
+        {"type": "speech-end", "audio": ndarray or None, "text": str or None}
+    "speech-end" has the final text with streaming ASR, else the utterance audio
+    to transcribe.
+    """
+
+    def __init__(self, vad: StreamingVAD, recognizer=None, sample_rate: int = SAMPLE_RATE,
+                 buffer_seconds: float = 60.0, window: int = VAD_WINDOW, pre_roll_windows: int = 8):
+        self.vad = vad
+        self.recognizer = recognizer
+        self.window = window
+        self.ring = AudioRingBuffer(int(buffer_seconds * sample_rate))
+        self.sample_rate = sample_rate
+        # Audio before the VAD triggers, so the first syllable is not cut off
+        self.pre_roll = (pre_roll_windows + vad.required_hits) * window
+        self._processed = 0
+        self._utterance_start: Optional[int] = None
+        self._recognition: Optional[OnlineRecognition] = None
+        self._fed = 0
+        self._wrap = np.empty(window, dtype=np.float32)
+
+    def feed(self, frame: bytes, sample_format: SampleFormat = "float32") -> List[Dict[str, Any]]:
+        dtype = _FRAME_DTYPES[sample_format]
+        # Drop a trailing partial sample instead of failing on it
+        usable = len(frame) - len(frame) % dtype.itemsize
+        samples = np.frombuffer(frame, dtype=dtype, count=usable // dtype.itemsize)
+        self.ring.write(samples, scale=_INT16_SCALE if sample_format == "int16" else 1.0)
+
+        events: List[Dict[str, Any]] = []
+        if self.ring.oldest > self._processed:
+            logger.warning("Audio stream fell behind, dropping unprocessed audio")
+            self._processed = self.ring.oldest
+        while self.ring.written - self._processed >= self.window:
+            start = self._processed
+            self._processed += self.window
+            change = self.vad.process(self.ring.read(start, self._processed, out=self._wrap))
+            if change == "start":
+                self._utterance_start = max(self.ring.oldest, self._processed - self.pre_roll)
+                self._fed = self._utterance_start
+                events.append({"type": "speech-start"})
+                if self.recognizer is not None:
+                    self._recognition = OnlineRecognition(self.recognizer, self.sample_rate)
+            elif change == "end":
+                events.append(self._end_utterance())
+        if self._recognition is not None and self.vad.speaking:
+            previous = self._recognition.text
+            text = self._recognition.accept(self._take_unfed())
+            if text and text != previous:
+                events.append({"type": "partial", "text": text})
+        return events
+
+    def _take_unfed(self) -> np.ndarray:
+        start = max(self._fed, self.ring.oldest)
+        self._fed = self._processed
+        # A copy: the recognizer may keep the samples beyond the next write
+        return self.ring.read(start, self._processed).copy()
+
+    def _end_utterance(self) -> Dict[str, Any]:
+        start = max(self._utterance_start or 0, self.ring.oldest)
+        self._utterance_start = None
+        if self._recognition is not None:
+            self._recognition.accept(self._take_unfed())
+            text = self._recognition.finish()
+            self._recognition = None
+            return {"type": "speech-end", "audio": None, "text": text}
+        # A copy, so ASR can run while new frames arrive
+        audio = self.ring.read(start, self._processed).copy()
+        return {"type": "speech-end", "audio": audio, "text": None}
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Ends the utterance in progress (the client stopped the microphone) and resets the VAD."""
+        events = [self._end_utterance()] if self.vad.speaking else []
+        self.vad.reset()
+        return events
+
+
+def register_audio_stream_route(app: FastAPI, vad_engine: Callable[[], Any], asr_engine: Callable[[], Any],
+                                vad_config=None, path: str = "/client-ws/audio-stream",
+                                on_transcript: Optional[Callable[[str], Any]] = None,
+                                speech_prob: Callable[[Any], Callable[[np.ndarray], float]] = SileroSpeechProb
+                                ) -> None:
+    """
+    Adds a WebSocket endpoint that takes binary audio frames (`?format=int16` for
+    16-bit PCM, float32 otherwise) and sends JSON events back:
+    {"type": "control", "text": "mic-audio-end"} at the end of speech,
+    {"type": "user-input-partial-transcription", "text"} while speaking (streaming ASR),
+    {"type": "user-input-transcription", "text"} with the final transcript.
+    A text frame {"type": "mic-audio-end"} ends the current utterance; other text
+    frames are ignored. `vad_engine` and `asr_engine` return the current engines
+    (they change with the character); `on_transcript` may be async. `speech_prob`
+    builds a connection's speech probability function from the VAD engine.
+    """
+
+    def end_requested(text: Optional[str]) -> bool:
+        try:
+            message = json.loads(text or "")
+        except ValueError:
+            message = None
+        if isinstance(message, dict) and message.get("type") == "mic-audio-end":
+            return True
+        logger.debug(f"Ignoring text frame on the audio stream: {text!r:.80}")
+        return False
+
+    @app.websocket(path)
+    async def audio_stream(websocket: WebSocket):
+        sample_format = websocket.query_params.get("format", "float32")
+        if sample_format not in _FRAME_DTYPES:
+            await websocket.close(code=1003, reason=f"Unsupported sample format {sample_format}")
+            return
+        await websocket.accept()
+        asr = asr_engine()
+        recognizer = online_recognizer(asr)
+        # Copying the model takes a moment; other connections keep being served meanwhile
+        prob = await asyncio.to_thread(speech_prob, vad_engine())
+        vad = StreamingVAD.from_config(prob, vad_config) if vad_config is not None else StreamingVAD(prob)
+        session = AudioStreamSession(vad, recognizer)
+        mode = "streaming" if recognizer is not None else "offline"
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    # VAD and streaming ASR decoding block, so they run off the event loop
+                    events = await asyncio.to_thread(session.feed, message["bytes"], sample_format)
+                elif end_requested(message.get("text")):
+                    events = await asyncio.to_thread(session.finish)
+                else:
+                    continue
+                for event in events:
+                    if event["type"] == "partial":
+                        await websocket.send_text(json.dumps(
+                            {"type": "user-input-partial-transcription", "text": event["text"]}))
+                        continue
+                    if event["type"] != "speech-end":
+                        continue
+                    ended = time.perf_counter()
+                    await websocket.send_text(json.dumps({"type": "control", "text": "mic-audio-end"}))
+                    text = event["text"] if event["text"] is not None else await transcribe(asr, event["audio"])
+                    metrics.ASR_TRANSCRIPT_SECONDS.observe(time.perf_counter() - ended, mode=mode)
+                    await websocket.send_text(json.dumps({"type": "user-input-transcription", "text": text}))
+                    if on_transcript is not None and text:
+                        result = on_transcript(text)
+                        if asyncio.iscoroutine(result):
+                            await result
+        except WebSocketDisconnect:
+            pass
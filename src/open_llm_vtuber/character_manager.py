@@ -1,6 +1,6 @@
 # config_manager/character.py
 from pydantic import Field, field_validator
-from typing import Dict, ClassVar
+from typing import Dict, ClassVar, Optional
 from .i18n import I18nMixin, Description
 from .asr import ASRConfig
 from .tts import TTSConfig
@@ -10,6 +10,34 @@ from .tts_preprocessor import TTSPreprocessorConfig
 from .agent import AgentConfig
 
 
+class TTSCacheConfig(I18nMixin):
+    """Persistent cache of synthesized audio (`system_config.tts_cache`), shared by all characters."""
+
+    enabled: bool = Field(False, alias="enabled")
+    directory: str = Field("tts_cache", alias="directory")
+    max_size_mb: float = Field(512, alias="max_size_mb")
+    prewarm_phrases_file: str = Field("", alias="prewarm_phrases_file")
+
+    DESCRIPTIONS: ClassVar[Dict[str, Description]] = {
+        "enabled": Description(
+            en="Reuse synthesized audio for identical text, engine and voice settings",
+            zh="对相同文本、引擎和语音设置复用已合成的音频",
+        ),
+        "directory": Description(
+            en="Directory of the audio cache (must not be inside 'cache', which is cleared on exit)",
+            zh="音频缓存目录 (不能位于退出时会被清空的 'cache' 目录中)",
+        ),
+        "max_size_mb": Description(
+            en="Maximum cache size in MB; least recently used audio is evicted beyond it",
+            zh="缓存最大容量 (MB), 超出时淘汰最久未使用的音频",
+        ),
+        "prewarm_phrases_file": Description(
+            en="Text file with one phrase per line to synthesize into the cache at startup",
+            zh="启动时预先合成并缓存的短语文件, 每行一句",
+        ),
+    }
+
+
 class CharacterConfig(I18nMixin):
     """Character configuration settings."""
 
@@ -27,6 +55,7 @@ class CharacterConfig(I18nMixin):
     tts_preprocessor_config: TTSPreprocessorConfig = Field(
         ..., alias="tts_preprocessor_config"
     )
+    response_cache_ttl: Optional[float] = Field(None, alias="response_cache_ttl")
 
     DESCRIPTIONS: ClassVar[Dict[str, Description]] = {
         "conf_name": Description(
@@ -67,14 +96,17 @@ class CharacterConfig(I18nMixin):
         "avatar": Description(
             en="Avatar image path for the character", zh="角色头像图片路径"
         ),
+        "response_cache_ttl": Description(
+            en="Seconds cached LLM responses stay valid for this character (uses the response cache default if empty)",
+            zh="该角色的 LLM 响应缓存有效秒数 (为空时使用响应缓存的默认值)",
+        ),
     }
 
     @field_validator("persona_prompt")
     def check_default_persona_prompt(cls, v):
         if not v:
             raise ValueError(
-                "Persona_prompt cannot be empty. Please provide a persona prompt
-."
+                "Persona_prompt cannot be empty. Please provide a persona prompt."
             )
         return v
 
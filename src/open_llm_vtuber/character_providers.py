@@ -0,0 +1,23 @@
+"""
+The ASR, TTS, VAD, agent and LLM providers a character selects.
+
+The provider implementations are constructed by the factories of their packages,
+which import only the selected one. This module answers which providers a
+`CharacterConfig` uses, for the parts of the server that manage them across
+characters (the warm pool, group conversations).
+"""
+from typing import Dict, Optional
+
+
+def selected_providers(character_config) -> Dict[str, Optional[str]]:
+    """The provider name of each kind referenced by a `CharacterConfig` (None if it selects none)."""
+    agent_config = character_config.agent_config
+    agent = getattr(agent_config, "conversation_agent_choice", None)
+    agent_settings = getattr(getattr(agent_config, "agent_settings", None), agent or "", None)
+    return {
+        "asr": getattr(character_config.asr_config, "asr_model", None),
+        "tts": getattr(character_config.tts_config, "tts_model", None),
+        "vad": getattr(character_config.vad_config, "vad_model", None),
+        "agent": agent,
+        "llm": getattr(agent_settings, "llm_provider", None),
+    }
@@ -0,0 +1,199 @@
+"""
+Indexed, cached registry of character configurations.
+
+Every YAML file in `config_alts_dir` (and the main conf.yaml) is parsed and
+validated into a `CharacterConfig` once, indexed by file name, `conf_uid` and
+`conf_name`, and kept until the file changes, so switching characters is a dict
+lookup instead of re-reading and re-validating YAML. `watch()` polls the files'
+mtime and size in the background and re-validates only the files that changed
+(and whose content hash differs), so edits apply without restarting the server.
+
+Character files only need the settings that differ from conf.yaml: like a
+character switch, they are merged over conf.yaml's `character_config`.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from .character_manager import CharacterConfig
+from .config_manager import read_yaml
+
+YAML_SUFFIXES = (".yaml", ".yml")
+
+
+def deep_merge(base: dict, override: dict) -> dict:
+    """Returns `base` updated with `override`, merging nested dicts instead of replacing them."""
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class CharacterEntry:
+    """One indexed character file and its validated config."""
+
+    __slots__ = ("filename", "path", "mtime_ns", "size", "digest", "config", "error")
+
+    def __init__(self, filename: str, path: str, mtime_ns: int, size: int, digest: str):
+        self.filename = filename
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = digest
+        # Last valid config; kept while a later edit of the file fails validation
+        self.config: Optional[CharacterConfig] = None
+        self.error: Optional[str] = None
+
+
+class CharacterRegistry:
+    """Character configs of conf.yaml and `config_alts_dir`, validated once and reloaded on change."""
+
+    def __init__(self, config_alts_dir: str, base_config_path: Optional[str] = "conf.yaml"):
+        self.config_alts_dir = config_alts_dir
+        self.base_config_path = base_config_path
+        self.base_filename = os.path.basename(base_config_path) if base_config_path else None
+        self._base: Optional[CharacterEntry] = None
+        self._base_data: Dict[str, Any] = {}
+        self._entries: Dict[str, CharacterEntry] = {}
+        # file name, conf_uid and conf_name -> entry; replaced as a whole on reload
+        self._index: Dict[str, CharacterEntry] = {}
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[List[str]], Any]] = []
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def get(self, key: str) -> Optional[CharacterConfig]:
+        """Looks a character up by file name, conf_uid or conf_name."""
+        entry = self._index.get(key)
+        return entry.config if entry is not None else None
+
+    def list_characters(self) -> List[Dict[str, str]]:
+        """File name, name and uid of every character file with a valid config."""
+        return [
+            {"filename": entry.filename, "name": entry.config.conf_name, "uid": entry.config.conf_uid}
+            for entry in sorted(self._entries.values(), key=lambda entry: entry.filename)
+            if entry.config is not None
+        ]
+
+    def refresh(self) -> List[str]:
+        """Reloads the files that changed since the last refresh; returns the names of changed characters."""
+        with self._lock:
+            changed: List[str] = []
+            base_changed = False
+            if self.base_config_path:
+                self._base, base_changed = self._load(self.base_filename, self.base_config_path, self._base,
+                                                      is_base=True)
+                if base_changed:
+                    changed.append(self.base_filename)
+
+            seen = set()
+            try:
+                files = sorted(os.scandir(self.config_alts_dir), key=lambda dirent: dirent.name)
+            except FileNotFoundError:
+                files = []
+            for dirent in files:
+                if not dirent.name.endswith(YAML_SUFFIXES) or not dirent.is_file():
+                    continue
+                seen.add(dirent.name)
+                # conf.yaml changes what every character file is merged over
+                entry, entry_changed = self._load(dirent.name, dirent.path, self._entries.get(dirent.name),
+                                                  force=base_changed)
+                if entry is not None:
+                    self._entries[dirent.name] = entry
+                if entry_changed:
+                    changed.append(dirent.name)
+            for filename in [name for name in self._entries if name not in seen]:
+                del self._entries[filename]
+                changed.append(filename)
+
+            if changed:
+                self._index = self._build_index()
+            return changed
+
+    def _load(self, filename: str, path: str, previous: Optional[CharacterEntry], is_base: bool = False,
+              force: bool = False) -> Tuple[Optional[CharacterEntry], bool]:
+        try:
+            stat = os.stat(path)
+            if previous is not None and not force and \
+                    (previous.mtime_ns, previous.size) == (stat.st_mtime_ns, stat.st_size):
+                return previous, False
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        except FileNotFoundError:
+            return None, previous is not None
+        if previous is not None and not force and previous.digest == digest:
+            # Touched or rewritten with the same content
+            previous.mtime_ns, previous.size = stat.st_mtime_ns, stat.st_size
+            return previous, False
+
+        entry = CharacterEntry(filename, path, stat.st_mtime_ns, stat.st_size, digest)
+        try:
+            character_data = (read_yaml(path) or {}).get("character_config") or {}
+            if not is_base:
+                character_data = deep_merge(self._base_data, character_data)
+            entry.config = CharacterConfig.model_validate(character_data)
+            if is_base:
+                # Only a valid conf.yaml is what character files are merged over
+                self._base_data = character_data
+        except Exception as e:
+            entry.error = f"{type(e).__name__}: {e}"
+            logger.error(f"Invalid character config {path}, keeping the previous version: {entry.error}")
+            entry.config = previous.config if previous is not None else None
+        return entry, entry.config is not (previous.config if previous is not None else None)
+
+    def _build_index(self) -> Dict[str, CharacterEntry]:
+        index: Dict[str, CharacterEntry] = {}
+        entries = list(self._entries.values())
+        if self._base is not None:
+            # The main config wins over character files using the same uid or name
+            entries.append(self._base)
+        for entry in entries:
+            if entry.config is None:
+                continue
+            index[entry.config.conf_name] = entry
+            index[entry.config.conf_uid] = entry
+        for entry in entries:
+            if entry.config is not None:
+                index[entry.filename] = entry
+        return index
+
+    def add_listener(self, callback: Callable[[List[str]], Any]) -> None:
+        """`callback(changed_filenames)` runs on the event loop after a reload; it may be async."""
+        self._listeners.append(callback)
+
+    async def watch(self, interval: float = 1.0) -> None:
+        """Polls for changed files every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changed = await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Reloading character configs failed: {e}")
+                continue
+            if not changed:
+                continue
+            logger.info(f"Reloaded character configs: {', '.join(changed)}")
+            for listener in self._listeners:
+                try:
+                    result = listener(changed)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    logger.error(f"Character config listener failed: {e}")
+
+    def start_watching(self, interval: float = 1.0) -> asyncio.Task:
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self.watch(interval))
+        return self._watch_task
+
+    async def stop_watching(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
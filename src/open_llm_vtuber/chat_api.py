@@ -0,0 +1,498 @@
+"""
+HTTP chat API: /api/chat, its streaming variant /api/chat/stream, group conversation
+rounds (/api/chat/group), session interruption and deletion, /api/llm/stats and /metrics.
+
+A reply is cut off when the client disconnects or the session is interrupted: the
+upstream call is cancelled (which closes its HTTP stream and frees its queue slot),
+and the part of the reply the user got is stored in the session, followed by the same
+interruption marker the agents add to their memory.
+
+The routes are registered on an existing FastAPI app (the one created by
+`WebSocketServer` in run_server.py, or a bare app in the benchmarks).
+"""
+import asyncio
+import json
+import math
+import uuid
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Literal, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from . import metrics
+from .group_conversation import GroupTurn, GroupTurnScheduler
+from .llm_config_manager import LLMClientManager, LLMErrorMessage
+from .prompt_compiler import PromptCompiler
+from .tts_pipeline import SentenceTTSPipeline, tts_filter
+
+
+class ChatRequest(BaseModel):
+    message: str
+    history: List[dict] = []
+    openRouterApiKey: Optional[str] = None
+    openRouterModelName: Optional[str] = None
+    # /api/chat/stream only: send whole sentences (with TTS-ready text, and the path of the
+    # synthesized audio when the server has a TTS engine) instead of raw deltas
+    segment_sentences: bool = False
+    # With the session store enabled: "" starts a new server-side session, an existing id
+    # continues it. `history` then only carries turns the server has not seen yet.
+    session_id: Optional[str] = None
+    # Scheduling class when the LLM backend is saturated: the streamer's own voice turns
+    # go ahead of chat-box messages
+    priority: Literal["voice", "chat", "background"] = "chat"
+    # Character to reply as (file name, conf_uid or conf_name); the default one if not set
+    character: Optional[str] = None
+
+
+class GroupChatRequest(BaseModel):
+    message: str
+    # Participants in speaking order: file names, conf_uids or conf_names of characters
+    characters: List[str] = Field(..., min_length=1)
+    # Shared history; the participants' turns carry their character_name as "name"
+    history: List[dict] = []
+    session_id: Optional[str] = None
+
+
+INTERRUPTED_MARKER = "[Interrupted by user]"
+
+
+def interrupted_turns(partial_reply: str, interrupt_method: str) -> List[dict]:
+    """The turns recording a reply the user cut off, as the agents' `handle_interrupt` does."""
+    turns = [{"role": "assistant", "content": partial_reply + "..."}] if partial_reply else []
+    turns.append({"role": "system" if interrupt_method == "system" else "user", "content": INTERRUPTED_MARKER})
+    return turns
+
+
+async def until_disconnected(http_request: Request) -> None:
+    # Only valid once the body has been read: the next ASGI message is the disconnect
+    while (await http_request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def until_set(events: AsyncIterator[dict], stop: asyncio.Event) -> AsyncIterator[dict]:
+    """Forwards `events` until `stop` is set, then cancels them and yields an "interrupted" event."""
+    stopped = asyncio.ensure_future(stop.wait())
+    next_event: Optional[asyncio.Future] = None
+    try:
+        while True:
+            next_event = asyncio.ensure_future(events.__anext__())
+            await asyncio.wait([next_event, stopped], return_when=asyncio.FIRST_COMPLETED)
+            if not next_event.done():
+                break
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield event
+    finally:
+        stopped.cancel()
+        # Also reached when the client went away while an event was pending
+        if next_event is not None and not next_event.done():
+            next_event.cancel()
+            await asyncio.gather(next_event, return_exceptions=True)
+        await events.aclose() # type: ignore
+    yield {"type": "interrupted"}
+
+
+def too_many_requests(message: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"error": message},
+        status_code=429,
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+def register_chat_routes(app: FastAPI, llm_client_manager: LLMClientManager,
+                         session_store=None, response_cache_ttl: Optional[float] = None,
+                         tts_preprocessor_config=None,
+                         character: Optional[Callable[[], Any]] = None,
+                         prompt_compiler: Optional[PromptCompiler] = None,
+                         synthesize: Optional[Callable[..., Awaitable[Any]]] = None,
+                         group_scheduler: Optional[GroupTurnScheduler] = None) -> None:
+    """
+    Adds the chat endpoints to `app`. Interrupts reach the replies running in this
+    process only, so with several workers the client has to stick to one.
+    Args:
+        session_store: Optional server-side history (see `create_session_store`).
+        response_cache_ttl: Lifetime of cached replies for this character.
+        tts_preprocessor_config: Text filters applied to sentences in sentence mode.
+        character: Returns the `CharacterConfig` for a request's `character` (None for the
+            default one), e.g. a lookup in the hot-reloading `CharacterRegistry`; its settings
+            then replace the two above per request. Unknown characters are answered with 404.
+        prompt_compiler: With `character`, puts the character's precompiled system prompt
+            in front of requests that do not bring their own (`prepend_persona_prompt`).
+        synthesize: TTS for sentence mode, called as `synthesize(text, file_name_no_ext)`
+            and returning the audio file's path (e.g. the cache-wrapped engine's
+            `async_generate_audio`). Without it, clients synthesize the sentences themselves.
+        group_scheduler: Runs the rounds of /api/chat/group, whose participants are looked
+            up with `character`; without both, the endpoint answers 404.
+    """
+
+    def unknown_character(request: ChatRequest) -> Optional[JSONResponse]:
+        if request.character is None or character is None or character(request.character) is not None:
+            return None
+        return JSONResponse({"error": f"Unknown character: {request.character}"}, status_code=404)
+
+    def character_settings(request: ChatRequest) -> Tuple[Optional[float], Any]:
+        current = character(request.character) if character is not None else None
+        if current is None:
+            return response_cache_ttl, tts_preprocessor_config
+        return current.response_cache_ttl, current.tts_preprocessor_config
+
+    async def synthesize_sentence(text: str) -> Optional[str]:
+        # Engines name files after the given stem, so concurrent replies need distinct ones
+        try:
+            return await synthesize(text, f"chat_{uuid.uuid4().hex}")
+        except Exception as e:
+            logger.error(f"TTS failed for a streamed sentence: {e}")
+            return None
+
+    def session_history(request) -> Tuple[List[dict], List[dict], Optional[str]]:
+        """
+        Returns the history up to and including the user's new message, the new turns to
+        store after a successful reply, and the session id (None when the request does not
+        use a server-side session).
+        """
+        new_turns = request.history + [{"role": "user", "content": request.message}]
+        session_id = None
+        history = new_turns
+        if request.session_id is not None and session_store is not None:
+            session_id = request.session_id or uuid.uuid4().hex
+            history = session_store.get(session_id) + new_turns
+        return history, new_turns, session_id
+
+    def resolve_history(request: ChatRequest) -> Tuple[List[dict], List[dict], Optional[str]]:
+        """`session_history`, with the character's system prompt in front of the messages."""
+        messages, new_turns, session_id = session_history(request)
+        current = character(request.character) if character is not None and prompt_compiler is not None else None
+        # A client that sends its own system prompt keeps full control of it
+        if current is not None and not any(turn.get("role") == "system" for turn in request.history):
+            # The same string on every turn, so upstream prompt caches can reuse the prefix
+            messages = prompt_compiler.prepend(messages, current)
+        return messages, new_turns, session_id
+
+    # Stop signals of the replies in progress, by session
+    interrupts: Dict[str, List[asyncio.Event]] = {}
+
+    def interruptible(session_id: Optional[str]) -> Optional[asyncio.Event]:
+        if session_id is None:
+            return None
+        stop = asyncio.Event()
+        interrupts.setdefault(session_id, []).append(stop)
+        return stop
+
+    def release(session_id: Optional[str], stop: Optional[asyncio.Event]) -> None:
+        stops = interrupts.get(session_id) if session_id is not None else None
+        if stops and stop in stops:
+            stops.remove(stop)
+            if not stops:
+                del interrupts[session_id]
+
+    def record_interrupted(session_id: str, new_turns: List[dict], partial_reply: str) -> None:
+        default_config = llm_client_manager.default_config
+        interrupt_method = getattr(default_config, "interrupt_method", "user")
+        session_store.append(session_id, new_turns + interrupted_turns(partial_reply, interrupt_method))
+
+    async def unless_stopped(reply: Awaitable, http_request: Request,
+                             stop: Optional[asyncio.Event]) -> Tuple[bool, Any]:
+        """
+        Awaits `reply` unless the client disconnects or `stop` is set first, in which case
+        it is cancelled. Returns (True, result) or (False, None).
+        """
+        task = asyncio.ensure_future(reply)
+        watchers = [asyncio.ensure_future(until_disconnected(http_request))]
+        if stop is not None:
+            watchers.append(asyncio.ensure_future(stop.wait()))
+        try:
+            await asyncio.wait([task, *watchers], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for watcher in watchers:
+                watcher.cancel()
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        if task.cancelled():
+            return False, None
+        return True, task.result()
+
+    @app.post("/api/chat") # type: ignore
+    async def chat_endpoint(request: ChatRequest, http_request: Request):
+        logger.debug("Received chat request: {message}", message=request.message, session_id=request.session_id)
+        not_found = unknown_character(request)
+        if not_found is not None:
+            return not_found
+        messages, new_turns, session_id = resolve_history(request)
+        cache_ttl, _ = character_settings(request)
+
+        if not llm_client_manager:
+            logger.error("LLM Client Manager not initialized.")
+            return {"error": "LLM Client Manager not initialized."}
+
+        async def reply(parts: List[str]) -> str:
+            # Streamed internally, so that a reply cut off midway is known (and its tokens
+            # are counted as wasted) like on /api/chat/stream
+            async with aclosing(llm_client_manager.generate_response_stream(
+                messages=messages, # type: ignore
+                user_api_key=request.openRouterApiKey,
+                user_openrouter_model_name=request.openRouterModelName,
+                cache_ttl=cache_ttl,
+                session_key=session_id,
+                priority=request.priority,
+            )) as events:
+                async for event in events:
+                    if event["type"] == "delta":
+                        parts.append(event["content"])
+                    elif event["type"] == "error":
+                        error = LLMErrorMessage(event["error"])
+                        error.retry_after = event.get("retry_after")
+                        return error
+            if not parts:
+                return LLMErrorMessage("Received an empty message from LLM.")
+            return "".join(parts)
+
+        parts: List[str] = []
+        stop = interruptible(session_id)
+        with metrics.ChatRequestTimer("chat") as timer:
+            try:
+                completed, response_text = await unless_stopped(reply(parts), http_request, stop)
+            finally:
+                release(session_id, stop)
+            if not completed:
+                timer.status = "interrupted" if stop is not None and stop.is_set() else "cancelled"
+            elif isinstance(response_text, LLMErrorMessage):
+                timer.status = "busy" if response_text.retry_after is not None else "error"
+        if not completed:
+            # The part generated before the interruption, as the streaming endpoint keeps it
+            partial = "".join(parts)
+            if session_id is None:
+                return {"response": partial, "interrupted": True}
+            record_interrupted(session_id, new_turns, partial)
+            return {"response": partial, "interrupted": True, "session_id": session_id}
+        if isinstance(response_text, LLMErrorMessage) and response_text.retry_after is not None:
+            return too_many_requests(response_text, response_text.retry_after)
+        if session_id is None:
+            return {"response": response_text}
+        if not isinstance(response_text, LLMErrorMessage):
+            session_store.append(session_id, new_turns + [{"role": "assistant", "content": response_text}])
+        return {"response": response_text, "session_id": session_id}
+
+    # Streaming variant of /api/chat. Deltas are forwarded as Server-Sent Events as soon as
+    # the LLM produces them, followed by a final "done" frame with usage and timing.
+    @app.post("/api/chat/stream") # type: ignore
+    async def chat_stream_endpoint(request: ChatRequest):
+        logger.debug("Received streaming chat request: {message}", message=request.message,
+                     session_id=request.session_id)
+        not_found = unknown_character(request)
+        if not_found is not None:
+            return not_found
+        timer = metrics.ChatRequestTimer("chat_stream")
+        messages, new_turns, session_id = resolve_history(request)
+        cache_ttl, preprocessor_config = character_settings(request)
+
+        def sse(event: dict) -> str:
+            return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+        async def recorded(events):
+            # Stores the turn in the session once the reply has completed successfully, or
+            # the part of it that was sent if it was interrupted or the client went away
+            parts = []
+            finished = interrupted = False
+            try:
+                async for event in events:
+                    if event["type"] == "delta":
+                        parts.append(event["content"])
+                    elif event["type"] == "interrupted":
+                        interrupted = True
+                    elif event["type"] in ("done", "error"):
+                        finished = True
+                        if event["type"] == "done" and session_id is not None:
+                            session_store.append(session_id,
+                                                 new_turns + [{"role": "assistant", "content": "".join(parts)}])
+                    yield event
+            except (GeneratorExit, asyncio.CancelledError):
+                interrupted = not finished
+                raise
+            finally:
+                if interrupted and session_id is not None:
+                    record_interrupted(session_id, new_turns, "".join(parts))
+
+        stop = interruptible(session_id)
+        upstream = llm_client_manager.generate_response_stream(
+            messages=messages, # type: ignore
+            user_api_key=request.openRouterApiKey,
+            user_openrouter_model_name=request.openRouterModelName,
+            cache_ttl=cache_ttl,
+            session_key=session_id,
+            priority=request.priority,
+        )
+        upstream_events = recorded(until_set(upstream, stop) if stop is not None else upstream)
+        # Wait for the first event before committing to a 200, so a request rejected by a
+        # full upstream queue can still be answered with a 429
+        try:
+            first_event = await upstream_events.__anext__()
+        except BaseException:
+            release(session_id, stop)
+            timer.finish("error")
+            raise
+        if first_event["type"] == "error" and first_event.get("retry_after") is not None:
+            await upstream_events.aclose()
+            release(session_id, stop)
+            timer.finish("busy")
+            return too_many_requests(first_event["error"], first_event["retry_after"])
+
+        def final_status(event: dict, current: str) -> str:
+            return {"done": "ok", "error": "error", "interrupted": "interrupted"}.get(event["type"], current)
+
+        async def replayed():
+            # Also finishes the request timer: "cancelled" if the client went away mid-reply
+            status = final_status(first_event, "cancelled")
+            try:
+                yield first_event
+                async for event in upstream_events:
+                    status = final_status(event, status)
+                    yield event
+            finally:
+                release(session_id, stop)
+                timer.finish(status)
+
+        async def event_stream():
+            if session_id is not None:
+                yield sse({"type": "session", "session_id": session_id})
+            events = replayed()
+            if not request.segment_sentences:
+                async for event in events:
+                    yield sse(event)
+                return
+
+            # Sentence mode: deltas are regrouped into sentences so the client can start
+            # speaking the first one while the rest of the reply is still being generated.
+            trailing_events = []
+
+            async def deltas():
+                async for event in events:
+                    if event["type"] == "delta":
+                        yield event["content"]
+                    else:
+                        trailing_events.append(event)
+
+            pipeline = SentenceTTSPipeline(
+                synthesize=synthesize_sentence if synthesize is not None else None,
+                preprocessor_config=preprocessor_config,
+            )
+            async for sentence in pipeline.run(deltas()):
+                yield sse({"type": "sentence", "text": sentence.text, "tts_text": sentence.tts_text,
+                           "audio_path": sentence.audio})
+            for event in trailing_events:
+                yield sse(event)
+
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    # One round of a group conversation: every participant replies once, in order. Each
+    # turn is sent as a Server-Sent Event once its text is final (with its audio when the
+    # server has a TTS engine), followed by "done", or "interrupted" if the round was cut off.
+    @app.post("/api/chat/group") # type: ignore
+    async def group_chat_endpoint(request: GroupChatRequest):
+        if group_scheduler is None or character is None:
+            return JSONResponse({"error": "Group conversations are not available"}, status_code=404)
+        participants = [character(key) for key in request.characters]
+        unknown = [key for key, participant in zip(request.characters, participants) if participant is None]
+        if unknown:
+            return JSONResponse({"error": f"Unknown character: {', '.join(unknown)}"}, status_code=404)
+        logger.debug("Received group chat request: {message}", message=request.message,
+                     session_id=request.session_id)
+        timer = metrics.ChatRequestTimer("chat_group")
+        history, new_turns, session_id = session_history(request)
+        stop = interruptible(session_id) or asyncio.Event()
+        turn_events: asyncio.Queue = asyncio.Queue()
+        # The turns the client has been sent, which is what gets stored if the round is cut off
+        delivered: List[dict] = []
+
+        def sse(event: dict) -> str:
+            return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+        async def deliver(turn: GroupTurn) -> None:
+            # Over HTTP a turn is "spoken" once it is handed to the client; while its audio
+            # is synthesized, the speculative mode already generates the next reply
+            audio_path = None
+            if synthesize is not None:
+                tts_text = tts_filter(turn.text, turn.character.tts_preprocessor_config)
+                audio_path = await synthesize_sentence(tts_text) if tts_text else None
+            delivered.append(turn.message())
+            await turn_events.put({"type": "turn", "name": turn.name, "uid": turn.character.conf_uid,
+                                   "text": turn.text, "audio_path": audio_path})
+
+        async def run_round():
+            try:
+                return await group_scheduler.run_round(history, participants, deliver, stop)
+            finally:
+                await turn_events.put(None)
+
+        async def event_stream():
+            status = "cancelled"
+            round_task = asyncio.ensure_future(run_round())
+            try:
+                if session_id is not None:
+                    yield sse({"type": "session", "session_id": session_id})
+                while (event := await turn_events.get()) is not None:
+                    yield sse(event)
+                try:
+                    group_round = await round_task
+                except Exception as e:
+                    logger.error(f"Group conversation round failed: {e}")
+                    status = "error"
+                    yield sse({"type": "error", "error": str(e)})
+                    return
+                if group_round.interrupted:
+                    status = "interrupted"
+                    yield sse({"type": "interrupted"})
+                    return
+                status = "ok"
+                if session_id is not None:
+                    session_store.append(session_id, new_turns + delivered)
+                yield sse({"type": "done", "turns": len(delivered), "discarded": group_round.discarded})
+            finally:
+                if not round_task.done():
+                    # The client went away
+                    stop.set()
+                    await asyncio.gather(round_task, return_exceptions=True)
+                if status in ("interrupted", "cancelled") and session_id is not None:
+                    record_interrupted(session_id, new_turns + delivered, "")
+                release(session_id, stop)
+                timer.finish(status)
+
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    # Cuts off the replies in progress for a session, e.g. when the user starts talking
+    # over the avatar. Streams end with an "interrupted" event.
+    @app.post("/api/chat/session/{session_id}/interrupt") # type: ignore
+    async def interrupt_session_endpoint(session_id: str):
+        stops = interrupts.get(session_id, [])
+        for stop in stops:
+            stop.set()
+        return {"interrupted": bool(stops)}
+
+    @app.delete("/api/chat/session/{session_id}") # type: ignore
+    async def delete_session_endpoint(session_id: str):
+        if session_store is not None:
+            session_store.delete(session_id)
+        llm_client_manager.context_window.forget(session_id)
+        return {"deleted": session_id}
+
+    @app.get("/api/llm/stats") # type: ignore
+    async def llm_stats_endpoint():
+        return llm_client_manager.stats()
+
+    @app.get("/metrics") # type: ignore
+    async def metrics_endpoint():
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
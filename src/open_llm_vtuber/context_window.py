@@ -0,0 +1,230 @@
+"""
+Token-budgeted context window for LLM requests.
+
+Conversations are trimmed to a per-model token budget before they are sent upstream.
+The leading system messages (persona prompt and tool prompts) are always kept, and
+the newest turns are kept in preference to older ones. Optionally, turns that fall
+out of the window are folded into a rolling summary that is generated in the
+background and carried in the system prefix on later turns.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+try:
+    import tiktoken
+except ImportError:  # optional dependency, a character-based estimate is used without it
+    tiktoken = None
+
+# Tokens added by the chat format around every message (role, separators)
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation between the user and the assistant in a few "
+    "sentences. Keep names, facts, preferences and promises that later replies may need. "
+    "Reply with the summary only."
+)
+# Starts the rolling summary appended to the system prompt; everything before it is the
+# static prefix that upstream prompt caches can reuse (see prompt_compiler)
+SUMMARY_HEADING = "Summary of the earlier conversation: "
+
+
+class TokenCounter:
+    """
+    Counts tokens per message and caches the result, so each message is tokenized once
+    rather than re-tokenizing the whole history on every turn.
+    """
+
+    def __init__(self, max_cache_entries: int = 50_000):
+        self.max_cache_entries = max_cache_entries
+        self._cache: "OrderedDict[Tuple[str, str, str], int]" = OrderedDict()
+        self._encodings: Dict[str, Any] = {}
+
+    def count_message(self, message: Dict[str, Any], model: str = "") -> int:
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            content = str(content)
+        encoding_name = self._encoding_name(model)
+        key = (encoding_name, message.get("role", ""), content)
+        tokens = self._cache.get(key)
+        if tokens is not None:
+            self._cache.move_to_end(key)
+            return tokens
+        tokens = self.count_text(content, model) + _MESSAGE_OVERHEAD_TOKENS
+        self._cache[key] = tokens
+        if len(self._cache) > self.max_cache_entries:
+            self._cache.popitem(last=False)
+        return tokens
+
+    def count_messages(self, messages: List[Dict[str, Any]], model: str = "") -> int:
+        return sum(self.count_message(message, model) for message in messages)
+
+    def count_text(self, text: str, model: str = "") -> int:
+        encoding = self._encoding(model)
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        # Rough estimate: ~4 characters per token for ASCII text, ~1 per character otherwise (CJK)
+        ascii_chars = sum(1 for char in text if ord(char) < 128)
+        return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+    def _encoding_name(self, model: str) -> str:
+        encoding = self._encoding(model)
+        return encoding.name if encoding is not None else "estimate"
+
+    def _encoding(self, model: str):
+        if tiktoken is None:
+            return None
+        if model not in self._encodings:
+            try:
+                self._encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                # Non-OpenAI models: cl100k is a reasonable approximation
+                self._encodings[model] = tiktoken.get_encoding("cl100k_base")
+        return self._encodings[model]
+
+
+class _Summary:
+    __slots__ = ("text", "last_covered")
+
+    def __init__(self, text: str, last_covered: Tuple[str, str]):
+        self.text = text
+        # (role, content) of the newest message folded into `text`
+        self.last_covered = last_covered
+
+
+class ContextWindowManager:
+    """Trims message lists to the token budget of the target model."""
+
+    def __init__(self, default_budget: Optional[int] = None, reserve_tokens: int = 1024,
+                 summarize: Optional[Callable[[List[Dict[str, str]]], Awaitable[str]]] = None,
+                 token_counter: Optional[TokenCounter] = None, max_summaries: int = 10_000):
+        """
+        Args:
+            default_budget: Context size in tokens for models without their own budget.
+                None disables trimming for those models.
+            reserve_tokens: Tokens kept free for the reply.
+            summarize: Coroutine function turning a message list into a summary text.
+                If set, turns dropped from the window are summarized in the background.
+            max_summaries: Number of sessions whose rolling summary is kept.
+        """
+        self.default_budget = default_budget
+        self.reserve_tokens = reserve_tokens
+        self.summarize = summarize
+        self.token_counter = token_counter or TokenCounter()
+        self.max_summaries = max_summaries
+        self._budgets: Dict[str, int] = {}
+        self._summaries: "OrderedDict[str, _Summary]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.trimmed_requests = 0
+        self.dropped_messages = 0
+
+    def set_budget(self, model: str, budget: int) -> None:
+        self._budgets[model] = budget
+
+    def budget_for(self, model: str) -> Optional[int]:
+        return self._budgets.get(model, self.default_budget)
+
+    def fit(self, messages: List[Dict[str, Any]], model: str,
+            session_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Returns `messages` trimmed to the model's budget. The leading system messages and
+        the last message are always kept.
+        Args:
+            session_key: Identifies the conversation (e.g. the chat session id). Rolling
+                summaries are only kept for requests that have one.
+        """
+        budget = self.budget_for(model)
+        if budget is None:
+            return messages
+
+        prefix_length = 0
+        while prefix_length < len(messages) and messages[prefix_length].get("role") == "system":
+            prefix_length += 1
+        prefix, turns = messages[:prefix_length], messages[prefix_length:]
+
+        summary = self._summaries.get(session_key) if session_key else None
+        available = budget - self.reserve_tokens - self.token_counter.count_messages(prefix, model)
+        if summary:
+            available -= self.token_counter.count_text(summary.text, model)
+
+        keep_from = len(turns)
+        for index in range(len(turns) - 1, -1, -1):
+            tokens = self.token_counter.count_message(turns[index], model)
+            if tokens > available and keep_from < len(turns):
+                break
+            available -= tokens
+            keep_from = index
+        if keep_from == 0:
+            return messages
+
+        dropped = turns[:keep_from]
+        self.trimmed_requests += 1
+        self.dropped_messages += len(dropped)
+        if self.summarize and session_key:
+            self._schedule_summary(session_key, dropped)
+        if summary:
+            prefix = self._with_summary(prefix, summary.text)
+        return prefix + turns[keep_from:]
+
+    @staticmethod
+    def _with_summary(prefix: List[Dict[str, Any]], summary_text: str) -> List[Dict[str, Any]]:
+        # Append to the last system message rather than inserting a new one, since some
+        # providers do not accept system messages after the first position.
+        note = SUMMARY_HEADING + summary_text
+        if not prefix:
+            return [{"role": "system", "content": note}]
+        last = dict(prefix[-1])
+        last["content"] = f"{last.get('content') or ''}\n\n{note}"
+        return prefix[:-1] + [last]
+
+    def _schedule_summary(self, session_key: str, dropped: List[Dict[str, Any]]) -> None:
+        if session_key in self._pending:
+            return
+        summary = self._summaries.get(session_key)
+        new_messages = dropped
+        if summary:
+            covered = [index for index, m in enumerate(dropped)
+                       if (m.get("role", ""), m.get("content") or "") == summary.last_covered]
+            if covered:
+                new_messages = dropped[covered[-1] + 1:]
+        if not new_messages:
+            return
+
+        task = asyncio.create_task(self._update_summary(session_key, summary, new_messages))
+        self._pending[session_key] = task
+        task.add_done_callback(lambda _: self._pending.pop(session_key, None))
+
+    async def _update_summary(self, session_key: str, previous: Optional[_Summary],
+                              new_messages: List[Dict[str, Any]]) -> None:
+        messages = list(new_messages)
+        if previous:
+            messages.insert(0, {"role": "system", "content": f"Earlier summary: {previous.text}"})
+        try:
+            text = await self.summarize(messages)
+        except Exception as e:
+            logger.warning(f"Rolling summary for session {session_key} failed: {e}")
+            return
+        if not text:
+            return
+        last = new_messages[-1]
+        self._summaries[session_key] = _Summary(text.strip(), (last.get("role", ""), last.get("content") or ""))
+        self._summaries.move_to_end(session_key)
+        while len(self._summaries) > self.max_summaries:
+            self._summaries.popitem(last=False)
+        logger.debug(f"Updated rolling summary for session {session_key} ({len(new_messages)} new messages)")
+
+    def forget(self, session_key: str) -> None:
+        """Drops the rolling summary of a session."""
+        self._summaries.pop(session_key, None)
+        task = self._pending.pop(session_key, None)
+        if task:
+            task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "trimmed_requests": self.trimmed_requests,
+            "dropped_messages": self.dropped_messages,
+            "summaries": len(self._summaries),
+        }
@@ -0,0 +1,239 @@
+"""
+Scheduling of the AI participants' turns in a group conversation.
+
+Each participant is a `CharacterConfig` and sees the shared history from its own
+point of view: its own turns as "assistant", everybody else's as "user" messages
+prefixed with the speaker's name. A round gives every participant one turn, in
+order, and each turn is spoken (`deliver`, i.e. TTS and playback) before the next
+one. How the LLM calls of a round overlap is set by the mode:
+
+- "sequential": the next participant's reply is generated after the previous one
+  was spoken, one full round trip after another.
+- "speculative": the next participant's reply is generated as soon as the previous
+  speaker's text is final, while that text is still being spoken. The replies are
+  the same as in sequential mode.
+- "parallel": all participants react to the history as it was at the start of the
+  round, so their replies are generated concurrently; later speakers do not see
+  the earlier turns of the same round.
+
+Each participant's reply comes from the LLM its own `agent_config` selects. Only
+OpenAI-compatible backends (which includes Ollama) can be called through
+`LLMClientManager`; characters using another kind fall back to the default LLM.
+
+Setting `stop` (the user interrupted) cancels the turn being spoken and discards
+the replies generated ahead of it.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Literal, NamedTuple, Optional
+
+from loguru import logger
+
+from . import metrics
+from .llm_config_manager import LLMClientManager, LLMErrorMessage, OpenAICompatibleConfig
+from .llm_scheduler import DEFAULT_PRIORITY
+from .prompt_compiler import PromptCompiler, normalize_prompt
+from .character_providers import selected_providers
+
+GroupTurnMode = Literal["sequential", "speculative", "parallel"]
+GROUP_TURN_MODES = ("sequential", "speculative", "parallel")
+
+
+class GroupTurn:
+    """One participant's reply in a round."""
+
+    __slots__ = ("character", "text", "generation_seconds")
+
+    def __init__(self, character, text: str, generation_seconds: float):
+        self.character = character
+        self.text = text
+        self.generation_seconds = generation_seconds
+
+    @property
+    def name(self) -> str:
+        return self.character.character_name
+
+    def message(self) -> Dict[str, str]:
+        """The turn as an entry of the shared history."""
+        return {"role": "assistant", "name": self.name, "content": self.text}
+
+
+class GroupRound(NamedTuple):
+    """The turns that were spoken, whether the round was interrupted, and replies thrown away."""
+
+    turns: List[GroupTurn]
+    interrupted: bool
+    discarded: int
+
+
+def participant_messages(history: List[Dict[str, Any]], character, system_prompt: str) -> List[Dict[str, Any]]:
+    """
+    The shared history as seen by `character`. History entries are chat messages; an
+    entry's "name" is its speaker (the user's turns may leave it out).
+    """
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": system_prompt}]
+    for entry in history:
+        name = entry.get("name")
+        if entry.get("role") == "assistant" and name == character.character_name:
+            messages.append({"role": "assistant", "content": entry["content"]})
+        elif entry.get("role") == "system":
+            messages.append({"role": "system", "content": entry["content"]})
+        else:
+            speaker = name or character.human_name
+            messages.append({"role": "user", "content": f"{speaker}: {entry['content']}"})
+    return messages
+
+
+def character_llm_config(character) -> Optional[OpenAICompatibleConfig]:
+    """The OpenAI-compatible LLM config a character selects, or None to use the default LLM."""
+    provider = selected_providers(character)["llm"]
+    llm_configs = getattr(character.agent_config, "llm_configs", None)
+    config = getattr(llm_configs, provider or "", None)
+    if config is None:
+        return None
+    if not isinstance(config, OpenAICompatibleConfig):
+        logger.warning(f"{character.character_name} uses {provider}, which group conversations cannot "
+                       f"call through the LLM client manager; using the default LLM")
+        return None
+    return config
+
+
+class GroupTurnScheduler:
+    """Runs the rounds of a group conversation with overlapping LLM calls."""
+
+    def __init__(self, llm_client_manager: LLMClientManager, mode: GroupTurnMode = "speculative",
+                 prompt_compiler: Optional[PromptCompiler] = None, group_prompt: str = "",
+                 priority: str = DEFAULT_PRIORITY,
+                 llm_config_for: Callable[[Any], Optional[OpenAICompatibleConfig]] = character_llm_config):
+        """
+        Args:
+            mode: How the turns' LLM calls overlap (see the module docstring).
+            prompt_compiler: Builds each character's static system prompt; the persona
+                prompt alone is used without one.
+            group_prompt: `group_conversation_prompt`, added after each participant's
+                system prompt with "{human_name}" and "{other_ais}" filled in.
+            llm_config_for: Returns the backend config of a character (None for the default LLM).
+        """
+        self.llm_client_manager = llm_client_manager
+        self.mode = mode
+        self.prompt_compiler = prompt_compiler
+        self.group_prompt = normalize_prompt(group_prompt) if group_prompt else ""
+        self.priority = priority
+        self.llm_config_for = llm_config_for
+
+    @classmethod
+    def from_config(cls, llm_client_manager: LLMClientManager, group_turns: Optional[str] = None,
+                    **kwargs) -> "GroupTurnScheduler":
+        """Takes the mode from `system_config.group_turns` (speculative if unset)."""
+        mode = group_turns or "speculative"
+        if mode not in GROUP_TURN_MODES:
+            raise ValueError(f"group_turns must be one of {', '.join(GROUP_TURN_MODES)}, not {mode!r}")
+        return cls(llm_client_manager, mode, **kwargs)
+
+    def system_prompt(self, character, participants: List[Any]) -> str:
+        if self.prompt_compiler is not None:
+            prompt = self.prompt_compiler.compile(character).text
+        else:
+            prompt = normalize_prompt(character.persona_prompt)
+        if not self.group_prompt:
+            return prompt
+        # After the static prefix, so the cached part of the prompt stays the same
+        others = ", ".join(p.character_name for p in participants if p.conf_uid != character.conf_uid)
+        group_prompt = self.group_prompt.replace("{human_name}", character.human_name).replace("{other_ais}", others)
+        return f"{prompt}\n\n{group_prompt}"
+
+    async def generate(self, character, history: List[Dict[str, Any]],
+                       participants: List[Any]) -> Optional[GroupTurn]:
+        """One participant's reply to `history`, or None if the LLM call failed."""
+        start = time.perf_counter()
+        messages = participant_messages(history, character, self.system_prompt(character, participants))
+        text = await self.llm_client_manager.generate_response(
+            messages=messages, # type: ignore
+            priority=self.priority,
+            llm_config=self.llm_config_for(character),
+        )
+        if isinstance(text, LLMErrorMessage):
+            logger.warning(f"Group turn of {character.character_name} failed: {text}")
+            return None
+        return GroupTurn(character, text, time.perf_counter() - start)
+
+    async def run_round(self, history: List[Dict[str, Any]], participants: List[Any],
+                        deliver: Optional[Callable[[GroupTurn], Awaitable[Any]]] = None,
+                        stop: Optional[asyncio.Event] = None) -> GroupRound:
+        """
+        Gives every participant one turn, in order.
+        Args:
+            history: The shared history before the round; not modified.
+            deliver: Speaks a turn and returns once it was played; cancelled on `stop`.
+            stop: Set when the user interrupts the round.
+        Returns:
+            The turns that were spoken in full. A turn cut off by `stop` is not among
+            them; `deliver` knows how much of it was heard.
+        """
+        stop = stop or asyncio.Event()
+        start = time.perf_counter()
+        round_history: List[Dict[str, Any]] = []
+        turns: List[GroupTurn] = []
+        tasks: List[Optional[asyncio.Future]] = [None] * len(participants)
+        delivering: Optional[asyncio.Future] = None
+        interrupted = False
+
+        def generate(index: int) -> asyncio.Future:
+            task = asyncio.ensure_future(self.generate(participants[index], history + round_history, participants))
+            tasks[index] = task
+            return task
+
+        if self.mode == "parallel":
+            for index in range(len(participants)):
+                generate(index)
+        try:
+            for index in range(len(participants)):
+                task = tasks[index] or generate(index)
+                if not await self._unless_stopped(task, stop):
+                    interrupted = True
+                    break
+                turn = task.result()
+                if turn is None:
+                    continue
+                round_history.append(turn.message())
+                if self.mode == "speculative" and index + 1 < len(participants):
+                    # The text is final: the next reply can be generated while this one is spoken
+                    generate(index + 1)
+                if deliver is not None:
+                    delivering = asyncio.ensure_future(deliver(turn))
+                    if not await self._unless_stopped(delivering, stop):
+                        interrupted = True
+                        break
+                    delivering.result()
+                turns.append(turn)
+                metrics.GROUP_TURNS.inc(mode=self.mode, state="spoken")
+        finally:
+            if delivering is not None and not delivering.done():
+                delivering.cancel()
+            discarded = 0
+            for task in tasks:
+                if task is None:
+                    continue
+                if not task.done():
+                    task.cancel()
+                    discarded += 1
+                elif not task.cancelled() and task.exception() is None and task.result() is not None \
+                        and task.result() not in turns:
+                    discarded += 1
+            if discarded:
+                metrics.GROUP_TURNS.inc(discarded, mode=self.mode, state="discarded")
+            metrics.GROUP_ROUND_SECONDS.observe(time.perf_counter() - start, mode=self.mode,
+                                                outcome="interrupted" if interrupted else "complete")
+        return GroupRound(turns, interrupted, discarded)
+
+    @staticmethod
+    async def _unless_stopped(task: asyncio.Future, stop: asyncio.Event) -> bool:
+        """Waits for `task` or `stop`; True if the task finished first."""
+        if stop.is_set():
+            return False
+        stopped = asyncio.ensure_future(stop.wait())
+        try:
+            await asyncio.wait([task, stopped], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopped.cancel()
+        return task.done()
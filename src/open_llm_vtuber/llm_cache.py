@@ -0,0 +1,231 @@
+"""
+Response cache for LLM completions.
+
+Identical prompts (greetings, canned questions) sent to the same model return the
+cached completion instead of calling the upstream API again. Keys are built from the
+model, the temperature and the normalized message list, so trivial differences in
+case or whitespace still hit the same entry.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from .metrics import LLM_CACHE_LOOKUPS
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalizes, case-folds and collapses whitespace."""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split()).casefold()
+
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    normalized = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            content = normalize_text(content)
+        else:
+            # Multi-part content (images, tool calls) is compared verbatim
+            content = json.dumps(content, sort_keys=True, ensure_ascii=False)
+        normalized.append({"role": message.get("role", ""), "content": content})
+    return normalized
+
+
+def make_cache_key(model: str, temperature: Optional[float], messages: List[Dict[str, Any]],
+                   base_url: str = "") -> str:
+    """Builds the cache key for a completion request."""
+    payload = json.dumps(
+        {
+            "base_url": base_url.rstrip("/"),
+            "model": model,
+            "temperature": temperature,
+            "messages": normalize_messages(messages),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class InMemoryCacheBackend:
+    """LRU cache kept in process memory."""
+
+    blocking = False
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        self._entries[key] = (value, time.time() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        self._entries.clear()
+
+
+class SQLiteCacheBackend:
+    """LRU cache stored in a sqlite database, so entries survive restarts."""
+
+    # Disk I/O: ResponseCache runs the calls in a worker thread
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_response_cache_last_access "
+            "ON llm_response_cache (last_access)"
+        )
+        self._conn.execute("DELETE FROM llm_response_cache WHERE expires_at <= ?", (time.time(),))
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE llm_response_cache SET last_access = ? WHERE key = ?", (now, key)
+            )
+        return row[0]
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_response_cache (key, value, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            self._conn.execute(
+                "DELETE FROM llm_response_cache WHERE key IN ("
+                "SELECT key FROM llm_response_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_response_cache").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    Front of the response cache: applies the temperature policy and counts hits.
+
+    Sampling at high temperature is meant to produce varied answers, so such requests
+    bypass the cache unless `cache_high_temperature` is set.
+    """
+
+    def __init__(self, backend, default_ttl: float = 3600.0, max_temperature: float = 0.5,
+                 cache_high_temperature: bool = False):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.max_temperature = max_temperature
+        self.cache_high_temperature = cache_high_temperature
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    @classmethod
+    def from_config(cls, config) -> Optional["ResponseCache"]:
+        """Builds the cache from a `ResponseCacheConfig`, or returns None if it is disabled."""
+        if config is None or not config.enabled:
+            return None
+        if config.backend == "sqlite":
+            backend = SQLiteCacheBackend(config.sqlite_path, max_entries=config.max_entries)
+        else:
+            backend = InMemoryCacheBackend(max_entries=config.max_entries)
+        logger.info(f"LLM response cache enabled ({config.backend}, {config.max_entries} entries)")
+        return cls(
+            backend,
+            default_ttl=config.default_ttl,
+            max_temperature=config.max_temperature,
+            cache_high_temperature=config.cache_high_temperature,
+        )
+
+    def accepts(self, temperature: Optional[float]) -> bool:
+        """Whether a request at this temperature may be served from / stored in the cache."""
+        if self.cache_high_temperature or temperature is None or temperature <= self.max_temperature:
+            return True
+        self.bypassed += 1
+        return False
+
+    async def _run(self, method, *args) -> Any:
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self._run(self.backend.get, key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        LLM_CACHE_LOOKUPS.inc(result="miss" if value is None else "hit")
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl > 0:
+            await self._run(self.backend.set, key, value, ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        self.backend.close()
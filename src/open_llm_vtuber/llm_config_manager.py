@@ -1,5 +1,12 @@
 # config_manager/llm.py
-from typing import ClassVar, Literal, Optional, List, Dict, Any
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing, asynccontextmanager, nullcontext
+from typing import AsyncIterator, Awaitable, Callable, ClassVar, Deque, Literal, Optional, List, Dict, Any, Set, Tuple
+import httpx
+from loguru import logger
 from pydantic import BaseModel, Field
 # Attempt to import I18nMixin and Description from a relative path
 # This might fail if the file structure isn't what's expected
@@ -14,7 +21,15 @@ except ImportError:
             self.en = en
             self.zh = zh
 
-from openai import OpenAI, AsyncOpenAI # Ensure openai is installed
+from openai import AsyncOpenAI # Ensure openai is installed
+
+from .llm_cache import ResponseCache, make_cache_key
+from .request_coalescer import SingleFlight
+from .context_window import SUMMARY_PROMPT, ContextWindowManager
+from .llm_router import LLMBackend, LLMRouter, NoHealthyBackendError
+from .llm_scheduler import DEFAULT_PRIORITY, LLMScheduler, UpstreamBusyError, upstream_key
+from .metrics import LLM_TOKENS, LLM_TTFT_SECONDS, cached_prompt_tokens, record_usage, track_upstream_call
+from .prompt_compiler import with_cache_breakpoints
 
 # Keep existing Pydantic models for configuration structure
 class StatelessLLMBaseConfig(I18nMixin):
@@ -25,8 +40,7 @@ class StatelessLLMBaseConfig(I18nMixin):
     DESCRIPTIONS: ClassVar[dict[str, Description]] = {
         "interrupt_method": Description(
             en="""The method to use for prompting the interruption signal.
-            If the provider supports inserting system prompt anywhere in the cha
-t memory, use "system".
+            If the provider supports inserting system prompt anywhere in the chat memory, use "system".
             Otherwise, use "user". You don't need to change this setting.""",
             zh="""用于表示中断信号的方法(提示词模式)。如果LLM支持在聊天记忆中的任何位置插入系统提示词，请使用“system”。
             否则，请使用“user”。您不需要更改此设置。""",
@@ -41,6 +55,10 @@ class OpenAICompatibleConfig(StatelessLLMBaseConfig):
     organization_id: str | None = Field(None, alias="organization_id")
     project_id: str | None = Field(None, alias="project_id")
     temperature: float = Field(1.0, alias="temperature")
+    context_token_budget: Optional[int] = Field(None, alias="context_token_budget")
+    context_reserve_tokens: int = Field(1024, alias="context_reserve_tokens")
+    rolling_summary: bool = Field(False, alias="rolling_summary")
+    max_concurrent_requests: Optional[int] = Field(None, alias="max_concurrent_requests")
     _OPENAI_COMPATIBLE_DESCRIPTIONS: ClassVar[dict[str, Description]] = {
         "base_url": Description(en="Base URL for the API endpoint", zh="API的URL端点"),
         "llm_api_key": Description(en="API key for authentication", zh="API 认证密钥"),
@@ -48,6 +66,10 @@ class OpenAICompatibleConfig(StatelessLLMBaseConfig):
         "project_id": Description(en="Project ID for the API (Optional)", zh="项目 ID (可选)"),
         "model": Description(en="Name of the LLM model to use", zh="LLM 模型名称"),
         "temperature": Description(en="What sampling temperature to use, between 0 and 2.", zh="使用的采样温度，介于 0 和 2 之间。"),
+        "context_token_budget": Description(en="Context size in tokens. Older turns are dropped to fit (empty = no limit)", zh="上下文的 token 数上限。超出时丢弃较早的对话 (为空则不限制)"),
+        "context_reserve_tokens": Description(en="Tokens of the budget kept free for the reply", zh="为回复预留的 token 数"),
+        "rolling_summary": Description(en="Summarize dropped turns in the background and keep the summary in the system prompt", zh="在后台总结被丢弃的对话, 并将总结保留在系统提示词中"),
+        "max_concurrent_requests": Description(en="Maximum concurrent requests to this backend's host (empty = scheduler default)", zh="对该后端主机的最大并发请求数 (为空则使用调度器默认值)"),
     }
     DESCRIPTIONS: ClassVar[dict[str, Description]] = {
         **StatelessLLMBaseConfig.DESCRIPTIONS,
@@ -108,13 +130,136 @@ class LlamaCppConfig(StatelessLLMBaseConfig):
     }
     DESCRIPTIONS: ClassVar[dict[str, Description]] = {**StatelessLLMBaseConfig.DESCRIPTIONS, **_LLAMA_DESCRIPTIONS}
 
+class LLMClientPoolConfig(I18nMixin):
+    """Configuration for the pool of reusable LLM API clients."""
+    max_size: int = Field(32, alias="max_size")
+    idle_ttl: float = Field(300.0, alias="idle_ttl")
+    http2: bool = Field(False, alias="http2")
+    max_connections: int = Field(100, alias="max_connections")
+    max_keepalive_connections: int = Field(20, alias="max_keepalive_connections")
+    keepalive_expiry: float = Field(30.0, alias="keepalive_expiry")
+    DESCRIPTIONS: ClassVar[dict[str, Description]] = {
+        "max_size": Description(en="Maximum number of distinct API clients kept in the pool", zh="连接池中保留的 API 客户端的最大数量"),
+        "idle_ttl": Description(en="Close a pooled client after it has been idle for this many seconds", zh="客户端空闲超过该秒数后将被关闭"),
+        "http2": Description(en="Use HTTP/2 for upstream connections (requires the h2 package)", zh="上游连接使用 HTTP/2 (需要安装 h2)"),
+        "max_connections": Description(en="Maximum number of open connections per client", zh="每个客户端的最大连接数"),
+        "max_keepalive_connections": Description(en="Maximum number of idle keep-alive connections per client", zh="每个客户端保持的最大空闲连接数"),
+        "keepalive_expiry": Description(en="Seconds an idle keep-alive connection is kept open", zh="空闲 keep-alive 连接的保持秒数"),
+    }
+
+class ResponseCacheConfig(I18nMixin):
+    """Configuration for caching LLM responses to identical prompts."""
+    enabled: bool = Field(False, alias="enabled")
+    backend: Literal["memory", "sqlite"] = Field("memory", alias="backend")
+    sqlite_path: str = Field("db/llm_response_cache.sqlite3", alias="sqlite_path")
+    max_entries: int = Field(1024, alias="max_entries")
+    default_ttl: float = Field(3600.0, alias="default_ttl")
+    max_temperature: float = Field(0.5, alias="max_temperature")
+    cache_high_temperature: bool = Field(False, alias="cache_high_temperature")
+    DESCRIPTIONS: ClassVar[dict[str, Description]] = {
+        "enabled": Description(en="Serve identical prompts from a response cache", zh="对相同的提示词使用响应缓存"),
+        "backend": Description(en="Cache backend: 'memory' (LRU in process) or 'sqlite' (survives restarts)", zh="缓存后端: 'memory' (进程内 LRU) 或 'sqlite' (重启后保留)"),
+        "sqlite_path": Description(en="Database file for the sqlite backend", zh="sqlite 后端的数据库文件"),
+        "max_entries": Description(en="Maximum number of cached responses", zh="缓存响应的最大数量"),
+        "default_ttl": Description(en="Seconds a cached response stays valid, unless the character sets response_cache_ttl", zh="缓存响应的有效秒数 (角色可用 response_cache_ttl 覆盖)"),
+        "max_temperature": Description(en="Requests with a higher temperature bypass the cache", zh="温度高于该值的请求不使用缓存"),
+        "cache_high_temperature": Description(en="Cache responses even above max_temperature", zh="即使温度高于 max_temperature 也使用缓存"),
+    }
+
+class SessionStoreConfig(I18nMixin):
+    """Configuration for the server-side chat history used by /api/chat."""
+    enabled: bool = Field(False, alias="enabled")
+    backend: Literal["memory", "sqlite"] = Field("memory", alias="backend")
+    sqlite_path: str = Field("db/chat_sessions.sqlite3", alias="sqlite_path")
+    max_messages: int = Field(200, alias="max_messages")
+    max_chars: int = Field(200_000, alias="max_chars")
+    idle_ttl: float = Field(3600.0, alias="idle_ttl")
+    max_sessions: int = Field(10_000, alias="max_sessions")
+    DESCRIPTIONS: ClassVar[dict[str, Description]] = {
+        "enabled": Description(en="Keep chat history on the server, keyed by session_id", zh="在服务器端按 session_id 保存聊天记录"),
+        "backend": Description(en="Store backend: 'memory' or 'sqlite' (WAL, survives restarts)", zh="存储后端: 'memory' 或 'sqlite' (WAL 模式, 重启后保留)"),
+        "sqlite_path": Description(en="Database file for the sqlite backend", zh="sqlite 后端的数据库文件"),
+        "max_messages": Description(en="Maximum number of messages kept per session", zh="每个会话保留的最大消息数"),
+        "max_chars": Description(en="Maximum total characters kept per session", zh="每个会话保留的最大字符总数"),
+        "idle_ttl": Description(en="Seconds after which an idle session is removed", zh="空闲会话被移除前的秒数"),
+        "max_sessions": Description(en="Maximum number of sessions kept (memory backend)", zh="保留的最大会话数 (memory 后端)"),
+    }
+
+class LLMRouterConfig(I18nMixin):
+    """Configuration for routing default requests across several LLM backends."""
+    enabled: bool = Field(False, alias="enabled")
+    backends: List[str] = Field(default_factory=list, alias="backends")
+    hedge: bool = Field(False, alias="hedge")
+    hedge_quantile: float = Field(0.95, alias="hedge_quantile")
+    hedge_min_delay: float = Field(0.3, alias="hedge_min_delay")
+    hedge_max_delay: float = Field(3.0, alias="hedge_max_delay")
+    ewma_alpha: float = Field(0.3, alias="ewma_alpha")
+    error_cooldown: float = Field(10.0, alias="error_cooldown")
+    max_attempts: int = Field(3, alias="max_attempts")
+    DESCRIPTIONS: ClassVar[dict[str, Description]] = {
+        "enabled": Description(en="Route requests across several backends by measured latency and errors", zh="根据测得的延迟和错误率在多个后端之间路由请求"),
+        "backends": Description(en="Names of the llm_configs entries to route between, e.g. ['ollama_llm', 'groq_llm']", zh="参与路由的 llm_configs 条目名称, 例如 ['ollama_llm', 'groq_llm']"),
+        "hedge": Description(en="Also send a request to the next backend if the first one is slower than its usual p95", zh="如果第一个后端慢于其通常的 p95, 同时向下一个后端发送请求"),
+        "hedge_quantile": Description(en="Latency quantile used as the hedging deadline", zh="用作对冲截止时间的延迟分位数"),
+        "hedge_min_delay": Description(en="Minimum seconds to wait before hedging", zh="对冲前的最短等待秒数"),
+        "hedge_max_delay": Description(en="Maximum seconds to wait before hedging (also used before any latency is measured)", zh="对冲前的最长等待秒数 (在尚未测得延迟时也使用此值)"),
+        "ewma_alpha": Description(en="Weight of the newest sample in the latency and error-rate averages", zh="延迟和错误率滑动平均中最新样本的权重"),
+        "error_cooldown": Description(en="Seconds a failing backend is skipped (429 responses use Retry-After when given)", zh="出错的后端被跳过的秒数 (429 响应优先使用 Retry-After)"),
+        "max_attempts": Description(en="Maximum number of backends tried per request", zh="每个请求最多尝试的后端数"),
+    }
+
+class LLMSchedulerConfig(I18nMixin):
+    """Configuration for per-upstream concurrency limits and the request queue."""
+    enabled: bool = Field(True, alias="enabled")
+    max_concurrency: int = Field(16, alias="max_concurrency")
+    max_queue: int = Field(64, alias="max_queue")
+    limits: Dict[str, int] = Field(default_factory=dict, alias="limits")
+    honor_rate_limit_headers: bool = Field(True, alias="honor_rate_limit_headers")
+    shared_state_path: str = Field("db/llm_rate_limits.sqlite3", alias="shared_state_path")
+    DESCRIPTIONS: ClassVar[dict[str, Description]] = {
+        "enabled": Description(en="Limit concurrent LLM requests per upstream and queue the rest", zh="限制每个上游的并发 LLM 请求数, 其余请求排队"),
+        "max_concurrency": Description(en="Default maximum concurrent requests per upstream host", zh="每个上游主机的默认最大并发请求数"),
+        "max_queue": Description(en="Requests that may wait per upstream; beyond this new requests get HTTP 429", zh="每个上游允许排队的请求数; 超出后新请求返回 HTTP 429"),
+        "limits": Description(en="Per-host concurrency limits, e.g. {'localhost:11434': 2}", zh="按主机设置的并发上限, 例如 {'localhost:11434': 2}"),
+        "honor_rate_limit_headers": Description(en="Pause an upstream while its Retry-After / x-ratelimit headers say its limit is exhausted", zh="当上游的 Retry-After / x-ratelimit 头表示额度耗尽时暂停向其发送请求"),
+        "shared_state_path": Description(en="Database that shares rate-limit pauses between worker processes (run_server.py --workers)", zh="多个工作进程之间共享限流暂停状态的数据库 (run_server.py --workers)"),
+    }
+
+class WarmPoolConfig(I18nMixin):
+    """Configuration for preloading and keeping local models loaded."""
+    enabled: bool = Field(True, alias="enabled")
+    preload_at_startup: bool = Field(True, alias="preload_at_startup")
+    keep_alive_margin: float = Field(0.8, alias="keep_alive_margin")
+    min_ping_interval: float = Field(30.0, alias="min_ping_interval")
+    shared_state_path: str = Field("db/warm_pool_workers.sqlite3", alias="shared_state_path")
+    DESCRIPTIONS: ClassVar[dict[str, Description]] = {
+        "enabled": Description(en="Manage the local models (Ollama, llama.cpp) the characters use", zh="管理角色使用的本地模型 (Ollama、llama.cpp)"),
+        "preload_at_startup": Description(en="Load the local models concurrently when the server starts", zh="服务器启动时并发加载本地模型"),
+        "keep_alive_margin": Description(en="Ping an idle Ollama model once this fraction of its keep_alive has passed", zh="空闲的 Ollama 模型经过其 keep_alive 的该比例时间后发送保活请求"),
+        "min_ping_interval": Description(en="Minimum seconds between keep-alive pings of one model", zh="同一模型两次保活请求之间的最短秒数"),
+        "shared_state_path": Description(en="Database in which worker processes (run_server.py --workers) pick the one that preloads and pings, and find the last to exit", zh="多个工作进程 (run_server.py --workers) 借此数据库选出负责预加载与保活的进程, 并确定最后退出的进程"),
+    }
+
 class StatelessLLMConfigs(I18nMixin, BaseModel):
     openai_compatible_llm: OpenAICompatibleConfig | None = Field(None, alias="openai_compatible_llm")
     ollama_llm: OllamaConfig | None = Field(None, alias="ollama_llm")
-    # ... (other configs remain the same) ...
+    openai_llm: OpenAIConfig | None = Field(None, alias="openai_llm")
+    gemini_llm: GeminiConfig | None = Field(None, alias="gemini_llm")
+    zhipu_llm: ZhipuConfig | None = Field(None, alias="zhipu_llm")
+    deepseek_llm: DeepseekConfig | None = Field(None, alias="deepseek_llm")
+    groq_llm: GroqConfig | None = Field(None, alias="groq_llm")
     claude_llm: ClaudeConfig | None = Field(None, alias="claude_llm")
     llama_cpp_llm: LlamaCppConfig | None = Field(None, alias="llama_cpp_llm")
     mistral_llm: MistralConfig | None = Field(None, alias="mistral_llm")
+    client_pool: LLMClientPoolConfig = Field(default_factory=LLMClientPoolConfig, alias="client_pool")
+    response_cache: ResponseCacheConfig = Field(default_factory=ResponseCacheConfig, alias="response_cache")
+    coalesce_requests: bool = Field(True, alias="coalesce_requests")
+    session_store: SessionStoreConfig = Field(default_factory=SessionStoreConfig, alias="session_store")
+    router: LLMRouterConfig = Field(default_factory=LLMRouterConfig, alias="router")
+    scheduler: LLMSchedulerConfig = Field(default_factory=LLMSchedulerConfig, alias="scheduler")
+    cache_breakpoints: bool = Field(True, alias="cache_breakpoints")
+    prepend_persona_prompt: bool = Field(False, alias="prepend_persona_prompt")
+    warm_pool: WarmPoolConfig = Field(default_factory=WarmPoolConfig, alias="warm_pool")
     DESCRIPTIONS: ClassVar[dict[str, Description]] = {
         "openai_compatible_llm": Description(en="Configuration for OpenAI-compatible LLM providers", zh="OpenAI兼容的语言模型提供者配置"),
         "ollama_llm": Description(en="Configuration for Ollama", zh="Ollama 配置"),
@@ -126,107 +271,762 @@ class StatelessLLMConfigs(I18nMixin, BaseModel):
         "groq_llm": Description(en="Configuration for Groq API", zh="Groq API 配置"),
         "claude_llm": Description(en="Configuration for Claude API", zh="Claude API配置"),
         "llama_cpp_llm": Description(en="Configuration for local Llama.cpp", zh="本地Llama.cpp配置"),
+        "client_pool": Description(en="Connection pooling for LLM API clients", zh="LLM API 客户端连接池配置"),
+        "response_cache": Description(en="Cache for responses to identical prompts", zh="相同提示词的响应缓存"),
+        "coalesce_requests": Description(en="Let identical concurrent requests share one upstream call", zh="相同的并发请求共享一次上游调用"),
+        "session_store": Description(en="Server-side chat history for /api/chat", zh="/api/chat 的服务器端聊天记录"),
+        "router": Description(en="Latency-aware routing, failover and hedging across backends", zh="跨后端的延迟感知路由、故障转移与对冲"),
+        "scheduler": Description(en="Per-upstream concurrency limits and priority queue", zh="每个上游的并发限制与优先级队列"),
+        "cache_breakpoints": Description(en="Mark the static system prompt with cache_control for models that need explicit prompt-cache breakpoints (Claude, Gemini via OpenRouter)", zh="为需要显式缓存断点的模型 (Claude、经 OpenRouter 的 Gemini) 用 cache_control 标记静态系统提示词"),
+        "prepend_persona_prompt": Description(en="Put the character's persona and tool prompts in front of /api/chat requests that send no system message", zh="为未携带系统消息的 /api/chat 请求加上角色设定与工具提示词"),
+        "warm_pool": Description(en="Preloading, keep-alive pings and unloading of local models", zh="本地模型的预加载、保活与卸载"),
     }
 
+class LLMClientPool:
+    """
+    Bounded pool of reusable AsyncOpenAI clients.
+
+    Clients are keyed by a hash of (api key, base_url, organization, project), so
+    repeated requests with the same credentials share one httpx connection pool
+    instead of opening a new one (and a new TLS handshake) per request.
+    The least recently used client is evicted once `max_size` is exceeded, and
+    clients idle for longer than `idle_ttl` are evicted on the next access.
+    Evicted clients are closed, or closed on release if a request still holds them.
+    """
+
+    def __init__(self, config: Optional[LLMClientPoolConfig] = None,
+                 on_response: Optional[Callable[[httpx.Response], Awaitable[None]]] = None):
+        """
+        Args:
+            on_response: Optional httpx response hook installed on every client (used to
+                read upstream rate-limit headers).
+        """
+        self.config = config or LLMClientPoolConfig()
+        self.event_hooks = {"response": [on_response]} if on_response else None
+        self._clients: "OrderedDict[str, Tuple[AsyncOpenAI, float]]" = OrderedDict()
+        self._leases: Dict[int, int] = {}
+        self._retiring: Dict[int, AsyncOpenAI] = {}
+        self._closing: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(api_key: Optional[str], base_url: str,
+                 organization: Optional[str] = None, project: Optional[str] = None) -> str:
+        """Hashes the client identity so raw API keys are never kept as dict keys."""
+        raw = "\x00".join([api_key or "", base_url.rstrip("/"), organization or "", project or ""])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def create_client(self, api_key: Optional[str], base_url: str,
+                      organization: Optional[str] = None, project: Optional[str] = None) -> AsyncOpenAI:
+        """Builds a client using the pool's HTTP settings, without registering it in the pool."""
+        limits = httpx.Limits(
+            max_connections=self.config.max_connections,
+            max_keepalive_connections=self.config.max_keepalive_connections,
+            keepalive_expiry=self.config.keepalive_expiry,
+        )
+        try:
+            http_client = httpx.AsyncClient(http2=self.config.http2, limits=limits, event_hooks=self.event_hooks)
+        except ImportError:
+            # httpx raises ImportError when http2=True but the h2 package is missing
+            logger.warning("HTTP/2 requested for LLM clients but h2 is not installed. Falling back to HTTP/1.1.")
+            http_client = httpx.AsyncClient(limits=limits, event_hooks=self.event_hooks)
+        return AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            organization=organization,
+            project=project,
+            http_client=http_client,
+        )
+
+    def get(self, api_key: Optional[str], base_url: str,
+            organization: Optional[str] = None, project: Optional[str] = None) -> AsyncOpenAI:
+        """Returns the pooled client for these credentials, creating it on a miss."""
+        now = time.monotonic()
+        self._evict_idle(now)
+        key = self.make_key(api_key, base_url, organization, project)
+        entry = self._clients.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._clients[key] = (entry[0], now)
+            self._clients.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        client = self.create_client(api_key, base_url, organization, project)
+        self._clients[key] = (client, now)
+        while len(self._clients) > self.config.max_size:
+            _, (evicted, _) = self._clients.popitem(last=False)
+            self._retire(evicted)
+        return client
+
+    @asynccontextmanager
+    async def lease(self, client: AsyncOpenAI):
+        """Marks `client` as in use so eviction defers closing it until the request is done."""
+        client_id = id(client)
+        self._leases[client_id] = self._leases.get(client_id, 0) + 1
+        try:
+            yield client
+        finally:
+            remaining = self._leases[client_id] - 1
+            if remaining:
+                self._leases[client_id] = remaining
+            else:
+                del self._leases[client_id]
+                retired = self._retiring.pop(client_id, None)
+                if retired is not None:
+                    await retired.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._clients),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "in_use": len(self._leases),
+        }
+
+    async def aclose(self) -> None:
+        """Closes every pooled client. Call on server shutdown."""
+        clients = [client for client, _ in self._clients.values()] + list(self._retiring.values())
+        self._clients.clear()
+        self._retiring.clear()
+        for client in clients:
+            await client.close()
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+    def _evict_idle(self, now: float) -> None:
+        while self._clients:
+            key, (client, last_used) = next(iter(self._clients.items()))
+            if now - last_used < self.config.idle_ttl:
+                break
+            del self._clients[key]
+            self._retire(client)
+
+    def _retire(self, client: AsyncOpenAI) -> None:
+        self.evictions += 1
+        if id(client) in self._leases:
+            self._retiring[id(client)] = client
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop, so the client cannot have open connections to release.
+            return
+        task = loop.create_task(client.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+class LLMErrorMessage(str):
+    """
+    A user-facing error text returned by `generate_response` in place of a reply.
+    It behaves like a plain string, but callers that persist replies (e.g. chat
+    history) can tell it apart with isinstance().
+    """
+    # Set when the request was rejected because the upstream's queue is full
+    retry_after: Optional[float] = None
+
+    @classmethod
+    def busy(cls, retry_after: float) -> "LLMErrorMessage":
+        message = cls("Sorry, too many requests are waiting for the LLM right now. Please try again shortly.")
+        message.retry_after = retry_after
+        return message
+
+    @classmethod
+    def from_exception(cls, error: Exception) -> "LLMErrorMessage":
+        retry_after = _busy_retry_after(error)
+        if retry_after is not None:
+            return cls.busy(retry_after)
+        return cls(f"Sorry, I encountered an error: {error}")
+
+
+def _busy_retry_after(error: BaseException) -> Optional[float]:
+    """Retry-After for a request rejected by full queues (on every routed backend), else None."""
+    if isinstance(error, UpstreamBusyError):
+        return error.retry_after
+    if isinstance(error, NoHealthyBackendError) and error.errors and \
+            all(isinstance(e, UpstreamBusyError) for e in error.errors.values()):
+        return min(e.retry_after for e in error.errors.values())
+    return None
+
 # New LLMClientManager class
 class LLMClientManager:
-    def __init__(self, default_config: Optional[OpenAICompatibleConfig] = None):
+    def __init__(self, default_config: Optional[OpenAICompatibleConfig] = None,
+                 pool_config: Optional[LLMClientPoolConfig] = None,
+                 cache_config: Optional[ResponseCacheConfig] = None,
+                 coalesce_requests: bool = True,
+                 router_config: Optional[LLMRouterConfig] = None,
+                 router_backends: Optional[Dict[str, OpenAICompatibleConfig]] = None,
+                 scheduler_config: Optional[LLMSchedulerConfig] = None,
+                 cache_breakpoints: bool = True,
+                 workers: int = 1):
         """
         Initializes the LLMClientManager.
         Args:
             default_config: An optional OpenAICompatibleConfig object representing the
                             default configuration loaded from a file (e.g., conf.yaml).
+            pool_config: Optional settings for the pool of clients built from user-provided keys.
+            cache_config: Optional settings for the response cache. Caching is off if omitted.
+            coalesce_requests: Whether identical concurrent requests share one upstream call.
+            router_config: Optional settings for routing default requests across several backends.
+            router_backends: The backend configs named in `router_config.backends`, by name.
+            scheduler_config: Optional settings for per-upstream concurrency limits. Calls are
+                unbounded if omitted.
+            cache_breakpoints: Whether to add prompt-cache breakpoints for models that need them.
+            workers: Number of server worker processes sharing the upstreams' concurrency limits.
         """
         self.default_config = default_config
         self.default_client = None
         self.default_model = None
+        self.scheduler: Optional[LLMScheduler] = LLMScheduler.from_config(scheduler_config, workers=workers)
+        self.client_pool = LLMClientPool(
+            pool_config, on_response=self.scheduler.observe_response if self.scheduler else None
+        )
+        # Timing of the most recent streamed requests (ttft, tokens/sec), newest last
+        self.stream_timings: Deque[Dict[str, Any]] = deque(maxlen=256)
+        self.response_cache: Optional[ResponseCache] = ResponseCache.from_config(cache_config)
+        self.single_flight: Optional[SingleFlight] = SingleFlight() if coalesce_requests else None
+        self.cache_breakpoints = cache_breakpoints
+        self.context_window = ContextWindowManager(
+            default_budget=default_config.context_token_budget if default_config else None,
+            reserve_tokens=default_config.context_reserve_tokens if default_config else 1024,
+            summarize=self._summarize if default_config and default_config.rolling_summary else None,
+        )
 
         if self.default_config and self.default_config.llm_api_key and self.default_config.base_url:
             try:
-                self.default_client = AsyncOpenAI(
+                # The default client lives for the whole process, so it is not subject to pool eviction.
+                self.default_client = self.client_pool.create_client(
                     api_key=self.default_config.llm_api_key,
-                    base_url=self.default_config.base_url
+                    base_url=self.default_config.base_url,
+                    organization=self.default_config.organization_id,
+                    project=self.default_config.project_id,
                 )
                 self.default_model = self.default_config.model
-                print("Default LLM client initialized from config.")
+                self.set_concurrency_limit(self.default_config)
+                logger.info("Default LLM client initialized from config.")
             except Exception as e:
-                print(f"Error initializing default client from config: {e}")
+                logger.error(f"Error initializing default client from config: {e}")
         else:
-            print("Default config not provided or incomplete for client initialization.")
+            logger.warning("Default config not provided or incomplete for client initialization.")
+
+        # Set by run_server.py when local models are managed (see warm_pool.WarmPool)
+        self.warm_pool = None
+        # (base_url, model) of the per-request backend configs whose limits were applied
+        self._configured_backends: Set[Tuple[str, str]] = set()
+
+        self.router: Optional[LLMRouter] = None
+        if router_config and router_config.enabled and router_backends:
+            self.router = self._build_router(router_config, router_backends)
+
+    def _build_router(self, router_config: LLMRouterConfig,
+                      router_backends: Dict[str, OpenAICompatibleConfig]) -> LLMRouter:
+        backends = []
+        for name, config in router_backends.items():
+            client = self.client_pool.create_client(
+                api_key=config.llm_api_key,
+                base_url=config.base_url,
+                organization=config.organization_id,
+                project=config.project_id,
+            # The router fails over itself, rather than waiting on the SDK's retries
+            ).with_options(max_retries=0)
+            backends.append(LLMBackend(name, client, config.model, temperature=config.temperature,
+                                       ewma_alpha=router_config.ewma_alpha))
+            if config.context_token_budget:
+                self.context_window.set_budget(config.model, config.context_token_budget)
+            self.set_concurrency_limit(config)
+        logger.info(f"LLM router enabled with backends: {', '.join(router_backends)}")
+        return LLMRouter(
+            backends,
+            hedge=router_config.hedge,
+            hedge_quantile=router_config.hedge_quantile,
+            hedge_min_delay=router_config.hedge_min_delay,
+            hedge_max_delay=router_config.hedge_max_delay,
+            error_cooldown=router_config.error_cooldown,
+            max_attempts=router_config.max_attempts,
+        )
+
+    def set_concurrency_limit(self, config: OpenAICompatibleConfig) -> None:
+        """Applies a backend's max_concurrent_requests to its host, if it sets one."""
+        if self.scheduler and config.max_concurrent_requests:
+            self.scheduler.set_limit(config.base_url, config.max_concurrent_requests)
+
+    def client_for(self, config: OpenAICompatibleConfig) -> AsyncOpenAI:
+        """
+        The pooled client for a backend other than the default one (e.g. a character's own
+        LLM). Its context budget and concurrency limit are applied on first use.
+        """
+        backend = (config.base_url, config.model)
+        if backend not in self._configured_backends:
+            self._configured_backends.add(backend)
+            if config.context_token_budget:
+                self.context_window.set_budget(config.model, config.context_token_budget)
+            self.set_concurrency_limit(config)
+        return self.client_pool.get(api_key=config.llm_api_key, base_url=config.base_url,
+                                    organization=config.organization_id, project=config.project_id)
+
+    def _slot(self, client: AsyncOpenAI, priority: str):
+        """Waits for a concurrency slot on the client's upstream (no-op without a scheduler)."""
+        return self.scheduler.slot(client.base_url, priority) if self.scheduler else nullcontext()
+
+    def _use_router(self, model_name_override: Optional[str], user_api_key: Optional[str]) -> bool:
+        """Requests without a user key or explicit model go through the router, if there is one."""
+        return self.router is not None and not user_api_key and not model_name_override
+
+    @property
+    def _router_model(self) -> str:
+        # Stands in for the model name in cache keys and logs of routed requests
+        return "router:" + ",".join(backend.name for backend in self.router.backends)
 
     def get_client(self, user_api_key: Optional[str] = None, user_base_url: Optional[str] = None) -> AsyncOpenAI:
         """
         Gets an OpenAI client. Uses user-provided details if available, otherwise falls back to default.
+        Clients for user-provided keys come from the client pool and are reused across requests.
         """
         if user_api_key and user_base_url:
-            print(f"Using user-provided API key and base_url: {user_base_url}")
-            return AsyncOpenAI(api_key=user_api_key, base_url=user_base_url)
+            logger.debug("Using user-provided API key and base_url: {base_url}", base_url=user_base_url)
+            return self.client_pool.get(api_key=user_api_key, base_url=user_base_url)
         elif user_api_key and self.default_config and self.default_config.base_url : # User key, default base URL
-            print(f"Using user-provided API key with default base_url: {self.default_config.base_url}")
-            return AsyncOpenAI(api_key=user_api_key, base_url=self.default_config.base_url)
+            logger.debug("Using user-provided API key with default base_url: {base_url}",
+                         base_url=self.default_config.base_url)
+            return self.client_pool.get(api_key=user_api_key, base_url=self.default_config.base_url)
         elif self.default_client:
-            print("Using default client from configuration.")
+            logger.debug("Using default client from configuration.")
             return self.default_client
         else:
             # This case should ideally not be reached if configuration or user params are expected
             raise ValueError("LLM client cannot be initialized. No default config and no user API key/base_url provided.")
 
-    async def generate_response(self, messages: List[Dict[str, str]],
-                                model_name_override: Optional[str] = None,
-                                user_api_key: Optional[str] = None,
-                                user_openrouter_model_name: Optional[str] = None) -> str:
+    def _resolve_client_and_model(self, model_name_override: Optional[str] = None,
+                                  user_api_key: Optional[str] = None,
+                                  user_openrouter_model_name: Optional[str] = None,
+                                  llm_config: Optional[OpenAICompatibleConfig] = None
+                                  ) -> Tuple[Optional[AsyncOpenAI], Optional[str], Optional[str]]:
         """
-        Generates a response from the LLM.
-        Args:
-            messages: A list of message dictionaries (e.g., [{"role": "user", "content": "Hello"}]).
-            model_name_override: Specific model name to use, overriding default or OpenRouter model.
-            user_api_key: User's OpenRouter API key.
-            user_openrouter_model_name: User's desired OpenRouter model name.
+        Picks the client and model for a request.
         Returns:
-            The LLM's response text or an error message.
+            A (client, model, error) tuple. `error` is a user-facing message when no
+            usable client or model could be determined, otherwise None.
         """
-        client_to_use: AsyncOpenAI
-        model_to_use: Optional[str]
-
         open_router_base_url = "https://openrouter.ai/api/v1"
 
-        if user_api_key and user_openrouter_model_name:
+        if llm_config is not None:
+            client_to_use = self.client_for(llm_config)
+            model_to_use = model_name_override or llm_config.model
+            logger.debug("Generating response using the request's backend config: model {model} at {base_url}",
+                         model=model_to_use, base_url=llm_config.base_url)
+        elif user_api_key and user_openrouter_model_name:
             client_to_use = self.get_client(user_api_key=user_api_key, user_base_url=open_router_base_url)
             model_to_use = user_openrouter_model_name
-            print(f"Generating response using OpenRouter: model {model_to_use} at {open_router_base_url}")
+            logger.debug("Generating response using OpenRouter: model {model} at {base_url}",
+                         model=model_to_use, base_url=open_router_base_url)
         elif user_api_key: # User wants to use their own key with a potentially default provider or custom base_url if they passed it
             # If user_openrouter_model_name is None, we assume they might be using a default_config setup
             # or want to use their key with the default_model if no model_name_override is given.
             client_to_use = self.get_client(user_api_key=user_api_key, user_base_url=self.default_config.base_url if self.default_config else None)
             model_to_use = model_name_override or user_openrouter_model_name or self.default_model
-            print(f"Generating response using user API key: model {model_to_use} at {client_to_use.base_url}")
+            logger.debug("Generating response using user API key: model {model} at {base_url}",
+                         model=model_to_use, base_url=str(client_to_use.base_url))
         elif self.default_client and self.default_model:
             client_to_use = self.default_client
             model_to_use = model_name_override or self.default_model
-            print(f"Generating response using default configuration: model {model_to_use} at {client_to_use.base_url}")
+            logger.debug("Generating response using default configuration: model {model} at {base_url}",
+                         model=model_to_use, base_url=str(client_to_use.base_url))
         else:
-            return "LLM client not configured. Please provide API key/model or check default configuration."
+            return None, None, LLMErrorMessage("LLM client not configured. Please provide API key/model or check default configuration.")
 
         if not model_to_use:
-            return "Model name not determined. Cannot generate response."
+            return None, None, LLMErrorMessage("Model name not determined. Cannot generate response.")
+        return client_to_use, model_to_use, None
+
+    def _resolve_temperature(self, temperature: Optional[float]) -> Optional[float]:
+        if temperature is not None:
+            return temperature
+        return self.default_config.temperature if self.default_config else None
+
+    def _sent_temperatures(self, temperature: Optional[float], routed: bool) -> List[Optional[float]]:
+        """
+        The temperatures a request may be sent with. A routed request without its own
+        temperature goes out with the temperature of whichever backend answers it.
+        """
+        if routed and temperature is None:
+            return [backend.temperature for backend in self.router.backends]
+        return [self._resolve_temperature(temperature)]
+
+    def _cache_key(self, client: Optional[AsyncOpenAI], model: str, temperatures: List[Optional[float]],
+                   messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        Returns the response cache key, or None if this request must not be cached.
+        `client` is None for routed requests, which share entries whichever backend answered;
+        they are cacheable only if every backend's temperature is.
+        """
+        if self.response_cache is None or not all(self.response_cache.accepts(t) for t in temperatures):
+            return None
+        temperature = temperatures[0] if len(set(temperatures)) == 1 else temperatures
+        return make_cache_key(model, temperature, messages, base_url=str(client.base_url) if client else "")  # type: ignore
+
+    def _flight_key(self, client: Optional[AsyncOpenAI], model: str, temperature: Optional[float],
+                    messages: List[Dict[str, str]], cache_key: Optional[str]) -> str:
+        """
+        Key under which identical in-flight requests are coalesced. It includes the
+        API key, so requests made with different users' keys are never merged.
+        """
+        base_url = str(client.base_url) if client else ""
+        request_key = cache_key or make_cache_key(model, temperature, messages, base_url=base_url)
+        return request_key + ":" + LLMClientPool.make_key(client.api_key if client else None, base_url)
+
+    async def generate_response(self, messages: List[Dict[str, str]],
+                                model_name_override: Optional[str] = None,
+                                user_api_key: Optional[str] = None,
+                                user_openrouter_model_name: Optional[str] = None,
+                                temperature: Optional[float] = None,
+                                cache_ttl: Optional[float] = None,
+                                session_key: Optional[str] = None,
+                                priority: str = DEFAULT_PRIORITY,
+                                llm_config: Optional[OpenAICompatibleConfig] = None) -> str:
+        """
+        Generates a response from the LLM.
+        Args:
+            messages: A list of message dictionaries (e.g., [{"role": "user", "content": "Hello"}]).
+            model_name_override: Specific model name to use, overriding default or OpenRouter model.
+            user_api_key: User's OpenRouter API key.
+            user_openrouter_model_name: User's desired OpenRouter model name.
+            temperature: Sampling temperature. Defaults to the temperature of the default config.
+            cache_ttl: Lifetime of the cached response in seconds (e.g. the character's
+                       response_cache_ttl). Defaults to the cache's default_ttl.
+            session_key: Identifies the conversation for rolling summaries (e.g. the session id).
+            priority: Scheduling class when the upstream is saturated: "voice", "chat" or "background".
+            llm_config: Backend to use instead of the default one (e.g. a character's own
+                        LLM); its temperature applies unless `temperature` is given.
+        Returns:
+            The LLM's response text or an error message. An error message with `retry_after`
+            set means the request was rejected because the upstream's queue is full.
+        """
+        routed = llm_config is None and self._use_router(model_name_override, user_api_key)
+        if routed:
+            # Each backend trims the messages to its own budget, see _routed_complete
+            client_to_use, model_to_use = None, self._router_model
+        else:
+            client_to_use, model_to_use, error = self._resolve_client_and_model(
+                model_name_override, user_api_key, user_openrouter_model_name, llm_config
+            )
+            if error:
+                return error
+            messages = self.context_window.fit(messages, model_to_use, session_key)
+            if temperature is None and llm_config is not None:
+                temperature = llm_config.temperature
+
+        request_temperature = temperature
+        temperature = self._resolve_temperature(temperature)
+        cache_key = self._cache_key(client_to_use, model_to_use,
+                                    self._sent_temperatures(request_temperature, routed), messages)
+        if cache_key:
+            cached = await self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Serving response for model {model} from cache", model=model_to_use)
+                return cached
+
+        def call_upstream() -> Awaitable[str]:
+            if routed:
+                return self._routed_complete(messages, request_temperature, session_key, cache_key, cache_ttl,
+                                             priority)
+            return self._complete(client_to_use, model_to_use, messages, temperature, cache_key, cache_ttl,
+                                  priority)
+
+        if self.single_flight:
+            flight_key = self._flight_key(client_to_use, model_to_use, temperature, messages, cache_key)
+            return await self.single_flight.do(flight_key, call_upstream)
+        return await call_upstream()
+
+    async def _complete(self, client_to_use: AsyncOpenAI, model_to_use: str,
+                        messages: List[Dict[str, str]], temperature: Optional[float],
+                        cache_key: Optional[str], cache_ttl: Optional[float],
+                        priority: str = DEFAULT_PRIORITY) -> str:
+        """Makes the upstream call for `generate_response` and stores the result in the cache."""
+        try:
+            content = await self._request_completion(client_to_use, model_to_use, messages, temperature, priority)
+        except Exception as e:
+            logger.warning("Error during LLM API call to {base_url} for model {model}: {error}",
+                           base_url=str(client_to_use.base_url), model=model_to_use, error=str(e))
+            return LLMErrorMessage.from_exception(e)
+        if cache_key and not isinstance(content, LLMErrorMessage):
+            await self.response_cache.set(cache_key, content, ttl=cache_ttl)
+        return content
+
+    async def _routed_complete(self, messages: List[Dict[str, str]], temperature: Optional[float],
+                               session_key: Optional[str], cache_key: Optional[str],
+                               cache_ttl: Optional[float], priority: str = DEFAULT_PRIORITY) -> str:
+        """Like `_complete`, but lets the router pick the backend, fail over and hedge."""
+        def attempt(backend: LLMBackend) -> Awaitable[str]:
+            return self._request_completion(
+                backend.client, backend.model,
+                self.context_window.fit(messages, backend.model, session_key),
+                temperature if temperature is not None else backend.temperature,
+                priority,
+            )
 
         try:
-            completion = await client_to_use.chat.completions.create(
-                model=model_to_use,
-                messages=messages  # type: ignore # openai client expects List[ChatCompletionMessageParam]
+            content = await self.router.run(attempt)
+        except Exception as e:
+            logger.warning("Error during routed LLM API call: {error}", error=str(e))
+            return LLMErrorMessage.from_exception(e)
+        if cache_key and not isinstance(content, LLMErrorMessage):
+            await self.response_cache.set(cache_key, content, ttl=cache_ttl)
+        return content
+
+    def _prepare_messages(self, messages: List[Dict[str, str]], model: str) -> List[Dict[str, Any]]:
+        """Final form of the messages sent upstream (cache keys and token counts use the plain ones)."""
+        return with_cache_breakpoints(messages, model) if self.cache_breakpoints else messages
+
+    async def _request_completion(self, client_to_use: AsyncOpenAI, model_to_use: str,
+                                  messages: List[Dict[str, str]], temperature: Optional[float],
+                                  priority: str = DEFAULT_PRIORITY) -> str:
+        """One non-streaming upstream call. Raises on API errors and on a full upstream queue."""
+        async with self._slot(client_to_use, priority), self.client_pool.lease(client_to_use):
+            if self.warm_pool:
+                self.warm_pool.note_request(client_to_use.base_url, model_to_use)
+            with track_upstream_call(upstream_key(client_to_use.base_url), model_to_use):
+                completion = await client_to_use.chat.completions.create(
+                    model=model_to_use,
+                    messages=self._prepare_messages(messages, model_to_use),  # type: ignore # openai client expects List[ChatCompletionMessageParam]
+                    **({"temperature": temperature} if temperature is not None else {}),
+                )
+        record_usage(model_to_use, completion.usage)
+        # Check if choices is not None and has at least one element
+        if completion.choices and len(completion.choices) > 0:
+            # Check if message is not None and content is not None
+            if completion.choices[0].message and completion.choices[0].message.content:
+                return completion.choices[0].message.content
+            return LLMErrorMessage("Received an empty message from LLM.")
+        return LLMErrorMessage("Received no choices from LLM.")
+
+    async def generate_response_stream(self, messages: List[Dict[str, str]],
+                                       model_name_override: Optional[str] = None,
+                                       user_api_key: Optional[str] = None,
+                                       user_openrouter_model_name: Optional[str] = None,
+                                       temperature: Optional[float] = None,
+                                       cache_ttl: Optional[float] = None,
+                                       session_key: Optional[str] = None,
+                                       priority: str = DEFAULT_PRIORITY,
+                                       llm_config: Optional[OpenAICompatibleConfig] = None
+                                       ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams a response from the LLM as it is generated.
+        Args:
+            Same as `generate_response`.
+        Yields:
+            {"type": "delta", "content": str} for every content chunk, followed by a single
+            {"type": "done", ...} frame carrying usage and timing, or a single
+            {"type": "error", "error": str} frame if the request could not be completed
+            (with "retry_after" when it was rejected because the upstream's queue is full).
+            A cached response is replayed as one delta and a "done" frame with "cached": True.
+        """
+        routed = llm_config is None and self._use_router(model_name_override, user_api_key)
+        if routed:
+            client_to_use, model_to_use = None, self._router_model
+        else:
+            client_to_use, model_to_use, error = self._resolve_client_and_model(
+                model_name_override, user_api_key, user_openrouter_model_name, llm_config
             )
-            # Check if choices is not None and has at least one element
-            if completion.choices and len(completion.choices) > 0:
-                # Check if message is not None and content is not None
-                if completion.choices[0].message and completion.choices[0].message.content:
-                    return completion.choices[0].message.content
-                else:
-                    return "Received an empty message from LLM."
+            if error:
+                yield {"type": "error", "error": error}
+                return
+            messages = self.context_window.fit(messages, model_to_use, session_key)
+            if temperature is None and llm_config is not None:
+                temperature = llm_config.temperature
+
+        request_temperature = temperature
+        temperature = self._resolve_temperature(temperature)
+        cache_key = self._cache_key(client_to_use, model_to_use,
+                                    self._sent_temperatures(request_temperature, routed), messages)
+        if cache_key:
+            cached = await self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Serving streamed response for model {model} from cache", model=model_to_use)
+                yield {"type": "delta", "content": cached}
+                yield {"type": "done", "model": model_to_use, "usage": None, "cached": True}
+                return
+
+        def stream_upstream() -> AsyncIterator[Dict[str, Any]]:
+            if routed:
+                chunks = self.router.stream(lambda backend: self._open_stream(
+                    backend.client, backend.model,
+                    self.context_window.fit(messages, backend.model, session_key),
+                    request_temperature if request_temperature is not None else backend.temperature,
+                    priority,
+                ))
             else:
-                return "Received no choices from LLM."
+                chunks = self._open_stream(client_to_use, model_to_use, messages, temperature, priority)
+            return self._stream_completion(chunks, model_to_use, cache_key, cache_ttl)
+
+        if self.single_flight:
+            flight_key = self._flight_key(client_to_use, model_to_use, temperature, messages, cache_key)
+            events = self.single_flight.stream(
+                flight_key, stream_upstream,
+                cancelled_event={"type": "error", "error": LLMErrorMessage("Sorry, the response was cancelled.")},
+            )
+        else:
+            events = stream_upstream()
+        # aclosing() makes sure a disconnecting caller detaches from the shared stream right away
+        async with aclosing(events):
+            async for event in events:
+                yield event
+
+    async def _open_stream(self, client_to_use: AsyncOpenAI, model_to_use: str,
+                           messages: List[Dict[str, str]], temperature: Optional[float],
+                           priority: str = DEFAULT_PRIORITY) -> AsyncIterator[Dict[str, Any]]:
+        """
+        One streaming upstream call. Yields {"type": "delta"} frames and a final
+        {"type": "usage"} frame; raises on API errors.
+        """
+        usage = None
+        upstream = upstream_key(client_to_use.base_url)
+        async with self._slot(client_to_use, priority), self.client_pool.lease(client_to_use):
+            if self.warm_pool:
+                self.warm_pool.note_request(client_to_use.base_url, model_to_use)
+            with track_upstream_call(upstream, model_to_use):
+                start_time = time.perf_counter()
+                first_token = True
+                generated = 0
+                completed = False
+                stream = await client_to_use.chat.completions.create(
+                    model=model_to_use,
+                    messages=self._prepare_messages(messages, model_to_use),  # type: ignore
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **({"temperature": temperature} if temperature is not None else {}),
+                )
+                try:
+                    async for chunk in stream:
+                        if chunk.usage:
+                            usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        content = chunk.choices[0].delta.content
+                        if content:
+                            if first_token:
+                                first_token = False
+                                LLM_TTFT_SECONDS.observe(time.perf_counter() - start_time,
+                                                         upstream=upstream, model=model_to_use)
+                            generated += 1
+                            yield {"type": "delta", "content": content}
+                    completed = True
+                finally:
+                    # Closing the response aborts generation upstream when the caller went away
+                    await stream.close()
+                    if not completed and generated:
+                        LLM_TOKENS.inc(generated, model=model_to_use, direction="wasted")
+        record_usage(model_to_use, usage)
+        yield {"type": "usage", "model": model_to_use, "usage": usage}
+
+    async def _stream_completion(self, chunks: AsyncIterator[Dict[str, Any]], model_to_use: str,
+                                 cache_key: Optional[str], cache_ttl: Optional[float]
+                                 ) -> AsyncIterator[Dict[str, Any]]:
+        """Turns the frames of `_open_stream` (direct or routed) into the frames of `generate_response_stream`."""
+        start_time = time.perf_counter()
+        first_token_time: Optional[float] = None
+        delta_count = 0
+        usage = None
+        parts: List[str] = []
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    if chunk["type"] == "usage":
+                        usage = chunk["usage"]
+                        model_to_use = chunk["model"]
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                    delta_count += 1
+                    parts.append(chunk["content"])
+                    yield chunk
         except Exception as e:
-            print(f"Error during LLM API call to {client_to_use.base_url} for model {model_to_use}: {e}")
-            return f"Sorry, I encountered an error: {e}"
+            logger.warning("Error during streaming LLM API call for model {model}: {error}",
+                           model=model_to_use, error=str(e))
+            message = LLMErrorMessage.from_exception(e)
+            error: Dict[str, Any] = {"type": "error", "error": message}
+            if message.retry_after is not None:
+                error["retry_after"] = message.retry_after
+            yield error
+            return
+
+        if cache_key and parts:
+            await self.response_cache.set(cache_key, "".join(parts), ttl=cache_ttl)
+        timing = self._record_stream_timing(
+            model_to_use, start_time, first_token_time, time.perf_counter(),
+            completion_tokens=usage.completion_tokens if usage else delta_count,
+        )
+        yield {
+            "type": "done",
+            "model": model_to_use,
+            "usage": usage.model_dump() if usage else None,
+            "cached_prompt_tokens": cached_prompt_tokens(usage),
+            "cached": False,
+            **timing,
+        }
+
+    def _record_stream_timing(self, model: str, start_time: float, first_token_time: Optional[float],
+                              end_time: float, completion_tokens: int) -> Dict[str, Any]:
+        """
+        Computes time-to-first-token and generation speed for one streamed request and
+        keeps it in `stream_timings`. When the provider reports no usage, the number of
+        content deltas is used as an approximation of the completion token count.
+        """
+        ttft = first_token_time - start_time if first_token_time is not None else None
+        generation_time = end_time - first_token_time if first_token_time is not None else 0.0
+        timing = {
+            "ttft": ttft,
+            "total_time": end_time - start_time,
+            "completion_tokens": completion_tokens,
+            "tokens_per_sec": completion_tokens / generation_time if generation_time > 0 else None,
+        }
+        self.stream_timings.append({"model": model, **timing})
+        logger.debug(
+            "Streamed {completion_tokens} tokens from {model}: ttft {ttft}, total {total_time:.3f}s",
+            model=model, **timing,
+        )
+        return timing
+
+    async def _summarize(self, messages: List[Dict[str, str]]) -> str:
+        """Summarizes turns dropped from the context window, using the default model."""
+        if not self.default_client or not self.default_model:
+            return ""
+        transcript = "\n".join(f"{m['role']}: {m.get('content') or ''}" for m in messages)
+        summary = await self._complete(
+            self.default_client, self.default_model,
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+            temperature=0.3, cache_key=None, cache_ttl=None, priority="background",
+        )
+        if isinstance(summary, LLMErrorMessage):
+            raise RuntimeError(summary)
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters of the client pool, the response cache, coalescing, the context window and the warm pool."""
+        return {
+            "client_pool": self.client_pool.stats(),
+            "response_cache": self.response_cache.stats() if self.response_cache else None,
+            "coalescing": self.single_flight.stats() if self.single_flight else None,
+            "context_window": self.context_window.stats(),
+            "router": self.router.stats() if self.router else None,
+            "scheduler": self.scheduler.stats() if self.scheduler else None,
+            "warm_pool": self.warm_pool.stats() if self.warm_pool else None,
+        }
+
+    async def close(self) -> None:
+        """Closes the default client, every pooled client, the response cache and the scheduler's shared state."""
+        if self.default_client:
+            await self.default_client.close()
+        if self.router:
+            for backend in self.router.backends:
+                await backend.client.close()
+        await self.client_pool.aclose()
+        if self.response_cache:
+            self.response_cache.close()
+        if self.scheduler:
+            self.scheduler.close()
 
 # Example of how this might be instantiated globally (though typically done in server setup)
 # This part is conceptual and depends on how `conf.yaml` is loaded and parsed.
@@ -249,10 +1049,24 @@ class LLMClientManager:
 # For now, this file defines the classes.
 global_llm_client_manager: Optional[LLMClientManager] = None
 
-def initialize_global_llm_manager(config: Optional[OpenAICompatibleConfig] = None):
+def initialize_global_llm_manager(config: Optional[OpenAICompatibleConfig] = None,
+                                  pool_config: Optional[LLMClientPoolConfig] = None,
+                                  cache_config: Optional[ResponseCacheConfig] = None,
+                                  coalesce_requests: bool = True,
+                                  router_config: Optional[LLMRouterConfig] = None,
+                                  router_backends: Optional[Dict[str, OpenAICompatibleConfig]] = None,
+                                  scheduler_config: Optional[LLMSchedulerConfig] = None,
+                                  cache_breakpoints: bool = True,
+                                  workers: int = 1):
     global global_llm_client_manager
-    global_llm_client_manager = LLMClientManager(default_config=config)
-    print("Global LLM Client Manager initialized.")
+    global_llm_client_manager = LLMClientManager(
+        default_config=config, pool_config=pool_config, cache_config=cache_config,
+        coalesce_requests=coalesce_requests, router_config=router_config,
+        router_backends=router_backends, scheduler_config=scheduler_config,
+        cache_breakpoints=cache_breakpoints, workers=workers,
+    )
+    logger.info("Global LLM Client Manager initialized.")
+    return global_llm_client_manager
 
 # Placeholder for i18n if import fails - already handled by try-except at the top.
 # class I18nMixin: pass
@@ -0,0 +1,333 @@
+"""
+Latency-aware routing across several configured LLM backends.
+
+Each backend keeps EWMA latency, time-to-first-token and error-rate statistics.
+Requests go to the fastest healthy backend and fail over to the next one on errors
+(including 429 rate limits, which put the backend into a cooldown). Optionally a
+request is hedged: if the chosen backend has not answered (or, when streaming, has
+not produced a first token) within a deadline derived from its recent p95, the
+request is also sent to the next backend and the first one to respond wins.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+import openai
+from loguru import logger
+
+from .llm_scheduler import UpstreamBusyError
+
+T = TypeVar("T")
+
+
+class NoHealthyBackendError(Exception):
+    """Raised when every backend tried for a request failed."""
+
+    def __init__(self, errors: Dict[str, BaseException]):
+        super().__init__("; ".join(f"{name}: {error}" for name, error in errors.items()))
+        self.errors = errors
+
+
+def _quantile(samples: Deque[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LLMBackend:
+    """One upstream model endpoint plus its health statistics."""
+
+    def __init__(self, name: str, client: Any, model: str, temperature: Optional[float] = None,
+                 ewma_alpha: float = 0.3, sample_size: int = 50):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.temperature = temperature
+        self.ewma_alpha = ewma_alpha
+        self.ewma_latency: Optional[float] = None
+        self.ewma_ttft: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency_samples: Deque[float] = deque(maxlen=sample_size)
+        self.ttft_samples: Deque[float] = deque(maxlen=sample_size)
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        return value if current is None else (1 - self.ewma_alpha) * current + self.ewma_alpha * value
+
+    def record_success(self, latency: Optional[float] = None, ttft: Optional[float] = None) -> None:
+        if latency is not None:
+            self.ewma_latency = self._ewma(self.ewma_latency, latency)
+            self.latency_samples.append(latency)
+        if ttft is not None:
+            self.ewma_ttft = self._ewma(self.ewma_ttft, ttft)
+            self.ttft_samples.append(ttft)
+        self.error_rate = (1 - self.ewma_alpha) * self.error_rate
+        self.consecutive_failures = 0
+
+    def record_abandoned(self, elapsed: float, streaming: bool) -> None:
+        """
+        A hedged attempt that lost the race: its real latency is unknown but at least
+        `elapsed`. That bound only ever raises the average, so the backend stops ranking
+        first; an attempt cancelled early says nothing about its speed.
+        """
+        if streaming:
+            self.ewma_ttft = self._ewma(self.ewma_ttft, max(self.ewma_ttft or 0.0, elapsed))
+        else:
+            self.ewma_latency = self._ewma(self.ewma_latency, max(self.ewma_latency or 0.0, elapsed))
+
+    def record_failure(self, cooldown: float) -> None:
+        self.failures += 1
+        self.error_rate = (1 - self.ewma_alpha) * self.error_rate + self.ewma_alpha
+        self.consecutive_failures += 1
+        if cooldown > 0:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + cooldown)
+
+    def healthy(self, now: float) -> bool:
+        return self.cooldown_until <= now
+
+    def score(self, streaming: bool) -> float:
+        """
+        Expected time to a first token (streaming) or a full reply, penalized by the error
+        rate. Unmeasured backends score 0 so they get tried.
+        """
+        if streaming:
+            latency = self.ewma_ttft if self.ewma_ttft is not None else self.ewma_latency
+        else:
+            latency = self.ewma_latency if self.ewma_latency is not None else self.ewma_ttft
+        return (latency or 0.0) * (1.0 + 4.0 * self.error_rate)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "ewma_latency": self.ewma_latency,
+            "ewma_ttft": self.ewma_ttft,
+            "p95_latency": _quantile(self.latency_samples, 0.95),
+            "p95_ttft": _quantile(self.ttft_samples, 0.95),
+            "error_rate": self.error_rate,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "cooling_down": not self.healthy(time.monotonic()),
+        }
+
+
+class LLMRouter:
+    """Chooses, fails over and optionally hedges between `LLMBackend`s."""
+
+    def __init__(self, backends: List[LLMBackend], hedge: bool = False, hedge_quantile: float = 0.95,
+                 hedge_min_delay: float = 0.3, hedge_max_delay: float = 3.0,
+                 error_cooldown: float = 10.0, failures_before_cooldown: int = 3,
+                 max_attempts: int = 3):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = backends
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.error_cooldown = error_cooldown
+        self.failures_before_cooldown = failures_before_cooldown
+        self.max_attempts = max_attempts
+        self.hedged_requests = 0
+        self.failovers = 0
+
+    def ranked(self, streaming: bool = False) -> List[LLMBackend]:
+        """Healthy backends fastest first, then cooling-down ones by the end of their cooldown."""
+        now = time.monotonic()
+        healthy = sorted((b for b in self.backends if b.healthy(now)), key=lambda b: b.score(streaming))
+        cooling = sorted((b for b in self.backends if not b.healthy(now)), key=lambda b: b.cooldown_until)
+        return (healthy + cooling)[:self.max_attempts]
+
+    def hedge_delay(self, backend: LLMBackend, streaming: bool) -> float:
+        samples = backend.ttft_samples if streaming else backend.latency_samples
+        deadline = _quantile(samples, self.hedge_quantile)
+        if deadline is None:
+            return self.hedge_max_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, deadline))
+
+    def _on_failure(self, backend: LLMBackend, error: BaseException) -> None:
+        if isinstance(error, UpstreamBusyError):
+            # Our own queue for this backend is full: try the next one, but the backend is not at fault
+            return
+        if isinstance(error, openai.RateLimitError):
+            cooldown = _retry_after(error) or self.error_cooldown
+        elif backend.consecutive_failures + 1 >= self.failures_before_cooldown:
+            cooldown = self.error_cooldown
+        else:
+            cooldown = 0.0
+        backend.record_failure(cooldown)
+        logger.warning(f"LLM backend {backend.name} failed ({type(error).__name__}: {error})")
+
+    async def _timed(self, backend: LLMBackend, attempt: Callable[[LLMBackend], Awaitable[T]]) -> T:
+        backend.requests += 1
+        backend.in_flight += 1
+        start = time.perf_counter()
+        try:
+            result = await attempt(backend)
+        except asyncio.CancelledError:
+            # Whether this was a lost hedge or the caller going away is decided in run()
+            raise
+        except Exception as e:
+            self._on_failure(backend, e)
+            raise
+        finally:
+            backend.in_flight -= 1
+        backend.record_success(latency=time.perf_counter() - start)
+        return result
+
+    def _hedge_timeout(self, candidates: List[LLMBackend], launched: int, running: int,
+                       primary: LLMBackend, streaming: bool) -> Optional[float]:
+        if self.hedge and running == 1 and launched < len(candidates):
+            return self.hedge_delay(primary, streaming)
+        return None
+
+    async def run(self, attempt: Callable[[LLMBackend], Awaitable[T]]) -> T:
+        """Runs `attempt(backend)` on the best backend, failing over and hedging as configured."""
+        candidates = self.ranked()
+        pending: Dict[asyncio.Task, Tuple[LLMBackend, float]] = {}
+        errors: Dict[str, BaseException] = {}
+        launched = 0
+        won = False
+
+        def launch() -> LLMBackend:
+            nonlocal launched
+            backend = candidates[launched]
+            launched += 1
+            pending[asyncio.ensure_future(self._timed(backend, attempt))] = (backend, time.perf_counter())
+            return backend
+
+        primary = launch()
+        try:
+            while pending:
+                timeout = self._hedge_timeout(candidates, launched, len(pending), primary, streaming=False)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged_requests += 1
+                    logger.debug(f"Hedging LLM request from {primary.name} after {timeout:.2f}s")
+                    launch()
+                    continue
+                for task in done:
+                    backend, _ = pending.pop(task)
+                    if task.exception() is None:
+                        won = True
+                        return task.result()
+                    errors[backend.name] = task.exception()
+                if not pending and launched < len(candidates):
+                    self.failovers += 1
+                    primary = launch()
+            raise NoHealthyBackendError(errors)
+        finally:
+            now = time.perf_counter()
+            for task, (backend, start) in pending.items():
+                if won:
+                    # Hedged attempts that lost the race
+                    backend.record_abandoned(now - start, streaming=False)
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def stream(self, open_stream: Callable[[LLMBackend], AsyncIterator[Dict[str, Any]]]
+                     ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams from the best backend. Failover and hedging apply until the first event
+        arrives; after that the stream is committed to the backend that produced it.
+        """
+        candidates = self.ranked(streaming=True)
+        attempts: Dict[asyncio.Task, Tuple[LLMBackend, AsyncIterator[Dict[str, Any]], float]] = {}
+        errors: Dict[str, BaseException] = {}
+        launched = 0
+
+        def launch() -> LLMBackend:
+            nonlocal launched
+            backend = candidates[launched]
+            launched += 1
+            backend.requests += 1
+            backend.in_flight += 1
+            iterator = open_stream(backend)
+            attempts[asyncio.ensure_future(iterator.__anext__())] = (backend, iterator, time.perf_counter())
+            return backend
+
+        async def discard(task: asyncio.Task, backend: LLMBackend, iterator, start: float) -> None:
+            if winner is not None:
+                # Lost the race to the winner's first event
+                backend.record_abandoned(time.perf_counter() - start, streaming=True)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await iterator.aclose()
+            backend.in_flight -= 1
+
+        winner = None
+        primary = launch()
+        try:
+            while attempts and winner is None:
+                timeout = self._hedge_timeout(candidates, launched, len(attempts), primary, streaming=True)
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged_requests += 1
+                    logger.debug(f"Hedging LLM stream from {primary.name} after {timeout:.2f}s without a first token")
+                    launch()
+                    continue
+                for task in done:
+                    backend, iterator, start = attempts.pop(task)
+                    error = task.exception()
+                    if winner is None and (error is None or isinstance(error, StopAsyncIteration)):
+                        first = None if error else task.result()
+                        winner = (backend, iterator, start, first)
+                        continue
+                    if error is not None and not isinstance(error, StopAsyncIteration):
+                        self._on_failure(backend, error)
+                        errors[backend.name] = error
+                    await iterator.aclose()
+                    backend.in_flight -= 1
+                if winner is None and not attempts and launched < len(candidates):
+                    self.failovers += 1
+                    primary = launch()
+        finally:
+            # Hedged attempts that lost the race (or everything, if we were cancelled)
+            for task, (backend, iterator, start) in attempts.items():
+                await discard(task, backend, iterator, start)
+
+        if winner is None:
+            raise NoHealthyBackendError(errors)
+
+        backend, iterator, start, first = winner
+        ttft = time.perf_counter() - start
+        try:
+            if first is not None:
+                yield first
+                async for event in iterator:
+                    yield event
+        except Exception as e:
+            self._on_failure(backend, e)
+            raise
+        else:
+            # One success per request, as for run()
+            backend.record_success(latency=time.perf_counter() - start, ttft=ttft)
+        finally:
+            backend.in_flight -= 1
+            await iterator.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedged_requests": self.hedged_requests,
+            "failovers": self.failovers,
+            "backends": {backend.name: backend.stats() for backend in self.backends},
+        }
@@ -0,0 +1,353 @@
+"""
+Per-upstream concurrency limits and a priority queue for LLM calls.
+
+Every upstream host gets at most `max_concurrency` requests in flight; further
+requests wait in a bounded queue ordered by priority class (the streamer's voice
+turns before chat-box messages before background work such as summaries). When the
+queue is full a request is rejected immediately with a suggested Retry-After, rather
+than piling up behind a backend that is already saturated. Rate-limit headers sent
+by the upstream (429 Retry-After, x-ratelimit-remaining/reset) pause the queue until
+the limit resets.
+
+With several worker processes (`run_server.py --workers`), each worker gets its share
+of the limits, and rate-limit pauses are written to a sqlite database so that a 429
+seen by one worker pauses the upstream for all of them.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from loguru import logger
+
+from .metrics import LLM_QUEUE_WAIT_SECONDS, LLM_QUEUE_WAITING, LLM_REJECTED
+
+# Lower values are served first
+PRIORITY_CLASSES: Dict[str, int] = {"voice": 0, "chat": 1, "background": 2}
+DEFAULT_PRIORITY = "chat"
+_PRIORITY_NAMES = {value: name for name, value in PRIORITY_CLASSES.items()}
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+# How long a limiter trusts its last read of the pauses other workers shared
+_SHARED_PAUSE_REFRESH = 1.0
+
+
+class UpstreamBusyError(Exception):
+    """Raised when the wait queue of an upstream is full."""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"Too many requests queued for {upstream}, retry after {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def upstream_key(url: Any) -> str:
+    """Limits apply per host:port, so several models served by one Ollama share a limit."""
+    return httpx.URL(str(url)).netloc.decode("ascii")
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parses rate-limit header durations: "2", "1.5", "20ms", "6m0s"."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def parse_milliseconds(value: Optional[str]) -> Optional[float]:
+    """Parses a "retry-after-ms" header (a plain number of milliseconds) into seconds."""
+    try:
+        return float(value) / 1000 if value else None
+    except ValueError:
+        return None
+
+
+class SharedRateLimits:
+    """Upstream rate-limit pauses in a sqlite database (WAL mode), shared by worker processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS upstream_pauses ("
+            "upstream TEXT PRIMARY KEY, paused_until REAL NOT NULL)"
+        )
+
+    def pause(self, upstream: str, until: float) -> None:
+        """Pauses `upstream` until the wall-clock time `until` (never shortens a pause)."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO upstream_pauses (upstream, paused_until) VALUES (?, ?) "
+                "ON CONFLICT(upstream) DO UPDATE SET paused_until = MAX(paused_until, excluded.paused_until)",
+                (upstream, until),
+            )
+
+    def paused_until(self, upstream: str) -> float:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT paused_until FROM upstream_pauses WHERE upstream = ?", (upstream,)
+            ).fetchone()
+        return row[0] if row else 0.0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class UpstreamLimiter:
+    """Concurrency limit and priority wait queue for one upstream."""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int,
+                 shared: Optional[SharedRateLimits] = None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.shared = shared
+        self.active = 0
+        self.paused_until = 0.0
+        # heap of [priority, sequence, future]
+        self._waiters: List[list] = []
+        self._sequence = itertools.count()
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+        self._synced_at = -math.inf
+        self.ewma_service_time: Optional[float] = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self, priority: int) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe_service_time(time.perf_counter() - start)
+            self.release()
+
+    async def acquire(self, priority: int) -> None:
+        if self.shared is not None:
+            self._sync_pause()
+        if not self._waiters and self.active < self.max_concurrency and not self._paused():
+            self.active += 1
+            self.admitted += 1
+            LLM_QUEUE_WAIT_SECONDS.observe(0.0, upstream=self.name, priority=_PRIORITY_NAMES.get(priority, ""))
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            # A full queue still admits a more urgent request by bumping the least urgent waiter
+            worst = max(self._waiters, key=lambda entry: (entry[0], entry[1]), default=None)
+            if worst is None or worst[0] <= priority:
+                self.rejected += 1
+                LLM_REJECTED.inc(upstream=self.name)
+                raise UpstreamBusyError(self.name, self.retry_after())
+            self._waiters.remove(worst)
+            heapq.heapify(self._waiters)
+            self.rejected += 1
+            LLM_REJECTED.inc(upstream=self.name)
+            worst[2].set_exception(UpstreamBusyError(self.name, self.retry_after()))
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._sequence), future])
+        self.queued += 1
+        LLM_QUEUE_WAITING.set(len(self._waiters), upstream=self.name)
+        queued_at = time.perf_counter()
+        # While paused, this arms the timer that resumes the queue
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # The slot was handed over just as we were cancelled
+                self.release()
+            else:
+                self._discard(future)
+            raise
+        finally:
+            LLM_QUEUE_WAITING.set(len(self._waiters), upstream=self.name)
+        self.admitted += 1
+        LLM_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - queued_at, upstream=self.name,
+                                       priority=_PRIORITY_NAMES.get(priority, ""))
+
+    def release(self) -> None:
+        self.active -= 1
+        self._wake()
+
+    def pause(self, seconds: float) -> None:
+        """Stops handing out slots for `seconds` (upstream rate limit)."""
+        until = time.monotonic() + seconds
+        if until > self.paused_until:
+            self.paused_until = until
+            logger.info(f"Pausing LLM requests to {self.name} for {seconds:.1f}s (upstream rate limit)")
+        if self.shared is not None:
+            self.shared.pause(self.name, time.time() + seconds)
+
+    def _sync_pause(self) -> None:
+        # Read at most every _SHARED_PAUSE_REFRESH seconds, so admitting a request does not
+        # wait on sqlite; another worker's pause arrives here up to that much later
+        now = time.monotonic()
+        if now - self._synced_at < _SHARED_PAUSE_REFRESH:
+            return
+        self._synced_at = now
+        # Pauses are stored as wall-clock times, since monotonic clocks differ between processes
+        remaining = self.shared.paused_until(self.name) - time.time()
+        if remaining > 0:
+            self.paused_until = max(self.paused_until, time.monotonic() + remaining)
+
+    def retry_after(self) -> float:
+        """Rough time until a new request could be served: the pause plus draining the queue."""
+        pause = max(0.0, self.paused_until - time.monotonic())
+        service_time = self.ewma_service_time or 1.0
+        drain = service_time * (len(self._waiters) + 1) / max(1, self.max_concurrency)
+        return max(1.0, math.ceil(pause + drain))
+
+    def _paused(self) -> bool:
+        return self.paused_until > time.monotonic()
+
+    def _wake(self) -> None:
+        if self._paused():
+            if self._wake_handle is None:
+                delay = self.paused_until - time.monotonic()
+                self._wake_handle = asyncio.get_running_loop().call_later(delay, self._resume)
+            return
+        while self._waiters and self.active < self.max_concurrency:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    def _resume(self) -> None:
+        self._wake_handle = None
+        self._wake()
+
+    def _discard(self, future: asyncio.Future) -> None:
+        for index, entry in enumerate(self._waiters):
+            if entry[2] is future:
+                self._waiters.pop(index)
+                heapq.heapify(self._waiters)
+                return
+
+    def _observe_service_time(self, seconds: float) -> None:
+        if self.ewma_service_time is None:
+            self.ewma_service_time = seconds
+        else:
+            self.ewma_service_time = 0.8 * self.ewma_service_time + 0.2 * seconds
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "paused_for": max(0.0, self.paused_until - time.monotonic()),
+        }
+
+
+class LLMScheduler:
+    """Hands out per-upstream slots for LLM calls."""
+
+    def __init__(self, max_concurrency: int = 16, max_queue: int = 64,
+                 honor_rate_limit_headers: bool = True, workers: int = 1,
+                 shared: Optional[SharedRateLimits] = None):
+        """
+        Args:
+            workers: Number of worker processes; limits and queue sizes are divided among them.
+            shared: Where rate-limit pauses are shared with the other workers.
+        """
+        self.workers = max(1, workers)
+        self.max_concurrency = self._share(max_concurrency)
+        self.max_queue = self._share(max_queue)
+        self.honor_rate_limit_headers = honor_rate_limit_headers
+        self.shared = shared
+        self._limits: Dict[str, int] = {}
+        self._limiters: Dict[str, UpstreamLimiter] = {}
+
+    @classmethod
+    def from_config(cls, config, workers: int = 1) -> Optional["LLMScheduler"]:
+        """Builds the scheduler from an `LLMSchedulerConfig`, or returns None if it is disabled."""
+        if config is None or not config.enabled:
+            return None
+        scheduler = cls(
+            max_concurrency=config.max_concurrency,
+            max_queue=config.max_queue,
+            honor_rate_limit_headers=config.honor_rate_limit_headers,
+            workers=workers,
+            shared=SharedRateLimits(config.shared_state_path) if workers > 1 else None,
+        )
+        for upstream, limit in config.limits.items():
+            scheduler.set_limit(upstream, limit)
+        return scheduler
+
+    def set_limit(self, url: str, max_concurrency: int) -> None:
+        """Sets the concurrency limit of the upstream serving `url` (a base URL or host:port)."""
+        key = upstream_key(url) if "//" in url else url
+        self._limits[key] = self._share(max_concurrency)
+        if key in self._limiters:
+            self._limiters[key].max_concurrency = self._limits[key]
+
+    def _share(self, limit: int) -> int:
+        """This worker's part of a limit for all workers together."""
+        return max(1, math.ceil(limit / self.workers))
+
+    def limiter(self, url: Any) -> UpstreamLimiter:
+        key = upstream_key(url)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = UpstreamLimiter(key, self._limits.get(key, self.max_concurrency), self.max_queue,
+                                      shared=self.shared)
+            self._limiters[key] = limiter
+        return limiter
+
+    def slot(self, url: Any, priority: str = DEFAULT_PRIORITY):
+        """Async context manager holding a slot for one call to the upstream serving `url`."""
+        return self.limiter(url).slot(PRIORITY_CLASSES.get(priority, PRIORITY_CLASSES[DEFAULT_PRIORITY]))
+
+    async def observe_response(self, response: httpx.Response) -> None:
+        """httpx response hook: pauses the upstream when it reports that its rate limit is exhausted."""
+        if not self.honor_rate_limit_headers:
+            return
+        headers = response.headers
+        pause = None
+        if response.status_code == 429:
+            pause = parse_milliseconds(headers.get("retry-after-ms"))
+            if pause is None:
+                pause = parse_duration(headers.get("retry-after"))
+        else:
+            for kind in ("requests", "tokens"):
+                if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+                    reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                    if reset is not None:
+                        pause = max(pause or 0.0, reset)
+        if pause:
+            self.limiter(response.request.url).pause(pause)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: limiter.stats() for name, limiter in self._limiters.items()}
+
+    def close(self) -> None:
+        if self.shared is not None:
+            self.shared.close()
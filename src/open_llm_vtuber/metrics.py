@@ -0,0 +1,273 @@
+"""
+Minimal Prometheus-style metrics for the chat path.
+
+Counters, gauges and histograms with labels, rendered in the Prometheus text
+exposition format by `render()` (served on /metrics). Updating a metric is a dict
+lookup and an addition, cheap enough for the per-token hot path. Values are kept
+per process.
+"""
+import bisect
+import math
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds: from a cached reply (ms) to a slow local model generating a long answer
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track_in_progress(self, **labels: str) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (non-cumulative, last one is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = ([0] * (len(self.buckets) + 1), [0.0])
+            self._values[key] = entry
+        counts, total = entry
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+CHAT_REQUEST_SECONDS = REGISTRY.histogram(
+    "chat_request_duration_seconds", "End-to-end duration of /api/chat requests", ("endpoint", "status"))
+CHAT_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "chat_requests_in_flight", "/api/chat requests currently being served", ("endpoint",))
+LLM_TTFT_SECONDS = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds", "Time from sending a streaming request to its first token", ("upstream", "model"))
+LLM_UPSTREAM_SECONDS = REGISTRY.histogram(
+    "llm_upstream_request_duration_seconds", "Duration of upstream LLM calls", ("upstream", "model", "outcome"))
+LLM_UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "llm_upstream_requests_in_flight", "Upstream LLM calls currently running", ("upstream",))
+LLM_UPSTREAM_ERRORS = REGISTRY.counter(
+    "llm_upstream_errors_total", "Failed upstream LLM calls by error type", ("upstream", "model", "error"))
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "Tokens sent to (in, of which cached) and generated by (out) upstream LLMs; "
+    "wasted counts streamed tokens (deltas) of calls aborted because the client went away",
+    ("model", "direction"))
+LLM_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "llm_queue_wait_seconds", "Time requests waited for a concurrency slot", ("upstream", "priority"))
+LLM_QUEUE_WAITING = REGISTRY.gauge(
+    "llm_queue_waiting", "Requests waiting for a concurrency slot", ("upstream",))
+LLM_REJECTED = REGISTRY.counter(
+    "llm_requests_rejected_total", "Requests rejected because the upstream's queue was full", ("upstream",))
+LLM_CACHE_LOOKUPS = REGISTRY.counter(
+    "llm_cache_lookups_total", "Response cache lookups", ("result",))
+LLM_MODEL_LOAD_SECONDS = REGISTRY.histogram(
+    "llm_model_load_seconds", "Time to load a local model", ("backend", "model"),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+LLM_MODEL_REQUESTS = REGISTRY.counter(
+    "llm_model_requests_total", "Requests to local models by whether the model was already loaded", ("model", "state"))
+ASR_TRANSCRIPT_SECONDS = REGISTRY.histogram(
+    "asr_end_of_speech_to_transcript_seconds", "Time from the end of speech to the final transcript", ("mode",))
+GROUP_ROUND_SECONDS = REGISTRY.histogram(
+    "group_round_duration_seconds", "Time for every participant of a group conversation to take a turn",
+    ("mode", "outcome"))
+GROUP_TURNS = REGISTRY.counter(
+    "group_turns_total", "Group conversation replies that were spoken, or generated ahead and thrown away",
+    ("mode", "state"))
+
+
+@contextmanager
+def track_upstream_call(upstream: str, model: str) -> Iterator[None]:
+    """Times one upstream LLM call and counts it as in flight, failed or cancelled."""
+    start = time.perf_counter()
+    outcome = "cancelled"
+    LLM_UPSTREAM_IN_FLIGHT.inc(upstream=upstream)
+    try:
+        yield
+        outcome = "ok"
+    except Exception as e:
+        outcome = "error"
+        LLM_UPSTREAM_ERRORS.inc(upstream=upstream, model=model, error=type(e).__name__)
+        raise
+    finally:
+        LLM_UPSTREAM_IN_FLIGHT.dec(upstream=upstream)
+        LLM_UPSTREAM_SECONDS.observe(time.perf_counter() - start, upstream=upstream, model=model, outcome=outcome)
+
+
+def cached_prompt_tokens(usage) -> Optional[int]:
+    """Prompt tokens served from the provider's prompt cache, if the usage reports them."""
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None)
+    if cached is None:
+        # DeepSeek reports its context cache hits at the top level
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    return cached
+
+
+def record_usage(model: str, usage) -> None:
+    """Counts the tokens of an OpenAI `CompletionUsage` (ignored if the provider sent none)."""
+    if usage is None:
+        return
+    LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, direction="in")
+    LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, direction="out")
+    cached = cached_prompt_tokens(usage)
+    if cached:
+        LLM_TOKENS.inc(cached, model=model, direction="cached")
+
+
+class ChatRequestTimer:
+    """
+    Times one /api/chat request from arrival until its response is complete. Used as a
+    context manager, or finished explicitly when the response outlives the handler (SSE).
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.status = "ok"
+        self.start = time.perf_counter()
+        self._finished = False
+        CHAT_REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+
+    def finish(self, status: Optional[str] = None) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        CHAT_REQUESTS_IN_FLIGHT.dec(endpoint=self.endpoint)
+        CHAT_REQUEST_SECONDS.observe(time.perf_counter() - self.start, endpoint=self.endpoint,
+                                     status=status or self.status)
+
+    def __enter__(self) -> "ChatRequestTimer":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.finish("error" if exc_type is not None else None)
+
+
+def render() -> str:
+    return REGISTRY.render()
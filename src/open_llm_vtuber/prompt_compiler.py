@@ -0,0 +1,153 @@
+"""
+Precompiled, byte-stable system prompts.
+
+Upstream prompt caches (OpenAI's automatic prefix caching, Anthropic `cache_control`
+breakpoints, Ollama/llama.cpp KV-cache reuse) only hit when the start of the prompt
+is byte-for-byte identical to an earlier request. `PromptCompiler` builds each
+character's static prefix (persona prompt plus the tool prompts from
+`system_config.tool_prompts`) once, normalizes it, and hands out the same string on
+every turn. Everything that changes between turns (rolling summary, history) goes
+after it. `with_cache_breakpoints` marks the end of that prefix for providers that
+need explicit breakpoints.
+"""
+import hashlib
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from loguru import logger
+
+from .context_window import SUMMARY_HEADING
+
+# Tool prompts that depend on the conversation rather than the character
+DYNAMIC_TOOL_PROMPTS = ("group_conversation_prompt",)
+
+# Models that take `cache_control` on content parts (Anthropic Claude, and Gemini via
+# OpenRouter). OpenAI, DeepSeek and Ollama cache prefixes automatically.
+_CACHE_CONTROL_MODELS = re.compile(r"^(anthropic/|claude|google/gemini)", re.IGNORECASE)
+
+_TRAILING_SPACE = re.compile(r"[ \t]+$", re.MULTILINE)
+_EXTRA_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+class CompiledPrompt(NamedTuple):
+    """A character's static system prompt."""
+
+    text: str
+    digest: str  # short hash of `text`, to see in logs whether the prefix stayed the same
+
+    def message(self) -> Dict[str, str]:
+        return {"role": "system", "content": self.text}
+
+
+def normalize_prompt(text: str) -> str:
+    """Canonical form of a prompt: NFC, \\n line endings, no trailing spaces or runs of blank lines."""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = _TRAILING_SPACE.sub("", text)
+    return _EXTRA_BLANK_LINES.sub("\n\n", text).strip()
+
+
+def _load_tool_prompt(name: str) -> str:
+    from .prompts import prompt_loader
+
+    return prompt_loader.load_util(name)
+
+
+class PromptCompiler:
+    """Builds and caches the static system prompt of each character."""
+
+    def __init__(self, tool_prompts: Optional[Dict[str, str]] = None,
+                 load_prompt: Callable[[str], str] = _load_tool_prompt,
+                 substitutions: Union[Dict[str, str], Callable[[Any], Dict[str, str]], None] = None,
+                 max_entries: int = 256):
+        """
+        Args:
+            tool_prompts: `system_config.tool_prompts`, prompt name -> prompt file.
+            load_prompt: Reads a prompt file by name (defaults to the prompts package).
+            substitutions: Placeholders replaced in the tool prompts, e.g.
+                {"[<insert_emomap_keys>]": "joy, sadness, ..."}, or a function returning
+                them for a character (e.g. the emotion keys of its Live2D model).
+        """
+        self.tool_prompts = dict(tool_prompts or {})
+        self.load_prompt = load_prompt
+        self.substitutions = substitutions if callable(substitutions) else dict(substitutions or {})
+        self.max_entries = max_entries
+        self._raw_tool_prompts: Optional[List[str]] = None
+        # substitutions -> tool prompt text
+        self._tool_text: Dict[Tuple[Tuple[str, str], ...], str] = {}
+        # (persona prompt, tool prompt text) -> compiled prompt; a changed persona (hot
+        # reload) is a new entry
+        self._compiled: "OrderedDict[Tuple[str, str], CompiledPrompt]" = OrderedDict()
+        self.compilations = 0
+
+    def _tool_prompt_text(self, character) -> str:
+        # Loaded once, and substituted once per distinct set of values
+        if self._raw_tool_prompts is None:
+            self._raw_tool_prompts = []
+            for name, prompt_file in self.tool_prompts.items():
+                if name in DYNAMIC_TOOL_PROMPTS or not prompt_file:
+                    continue
+                try:
+                    self._raw_tool_prompts.append(self.load_prompt(prompt_file))
+                except Exception as e:
+                    logger.warning(f"Could not load tool prompt '{name}' ({prompt_file}): {e}")
+        substitutions = self.substitutions(character) if callable(self.substitutions) else self.substitutions
+        key = tuple(sorted(substitutions.items()))
+        text = self._tool_text.get(key)
+        if text is None:
+            sections = []
+            for content in self._raw_tool_prompts:
+                for placeholder, value in substitutions.items():
+                    content = content.replace(placeholder, value)
+                sections.append(normalize_prompt(content))
+            text = self._tool_text[key] = "\n\n".join(section for section in sections if section)
+        return text
+
+    def compile(self, character) -> CompiledPrompt:
+        """The static system prompt of a `CharacterConfig`, built on first use."""
+        key = (character.persona_prompt, self._tool_prompt_text(character))
+        compiled = self._compiled.get(key)
+        if compiled is not None:
+            self._compiled.move_to_end(key)
+            return compiled
+        text = "\n\n".join(part for part in (normalize_prompt(key[0]), key[1]) if part)
+        compiled = CompiledPrompt(text, hashlib.sha256(text.encode("utf-8")).hexdigest()[:12])
+        self._compiled[key] = compiled
+        if len(self._compiled) > self.max_entries:
+            self._compiled.popitem(last=False)
+        self.compilations += 1
+        logger.debug("Compiled system prompt for {character}: {chars} chars, digest {digest}",
+                     character=character.conf_name, chars=len(text), digest=compiled.digest)
+        return compiled
+
+    def prepend(self, messages: List[Dict[str, Any]], character) -> List[Dict[str, Any]]:
+        """Puts the character's system prompt in front of `messages`, unless the caller sent its own."""
+        if messages and messages[0].get("role") == "system":
+            return messages
+        return [self.compile(character).message()] + messages
+
+
+def supports_cache_control(model: str) -> bool:
+    return bool(model) and _CACHE_CONTROL_MODELS.match(model) is not None
+
+
+def with_cache_breakpoints(messages: List[Dict[str, Any]], model: str) -> List[Dict[str, Any]]:
+    """
+    Marks the end of the static system prefix with `cache_control` for models that need
+    explicit breakpoints; other models get `messages` unchanged. A rolling summary that
+    was appended to the system prompt stays after the breakpoint, so it does not
+    invalidate the cached prefix when it changes.
+    """
+    if not supports_cache_control(model) or not messages or messages[0].get("role") != "system":
+        return messages
+    content = messages[0].get("content")
+    if not isinstance(content, str) or not content:
+        return messages
+    static, separator, dynamic = content.rpartition("\n\n" + SUMMARY_HEADING)
+    if not separator:
+        static = content
+    parts: List[Dict[str, Any]] = [{"type": "text", "text": static, "cache_control": {"type": "ephemeral"}}]
+    if separator:
+        parts.append({"type": "text", "text": separator + dynamic})
+    return [{**messages[0], "content": parts}] + messages[1:]
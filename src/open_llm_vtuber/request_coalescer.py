@@ -0,0 +1,178 @@
+"""
+Single-flight coalescing of identical in-flight LLM requests.
+
+Concurrent callers asking for the same thing share one upstream call. For plain
+requests they await the same task; for streaming requests every caller receives the
+same sequence of events, replayed from the start if it joined late.
+
+Cancellation is reference counted: a caller counts from the moment it joins (not
+when it first iterates), a caller that goes away only detaches itself, and the
+upstream call is cancelled once its last caller is gone. A stream cancelled while
+callers are still attached ends with a terminal frame (or error), never silently.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _SharedCall:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class StreamCancelledError(Exception):
+    """Raised to subscribers of a shared stream that was cancelled before it finished."""
+
+
+class SharedStream:
+    """Runs one async iterator in the background and fans its items out to subscribers."""
+
+    def __init__(self, source: AsyncIterator[Any], cancelled_event: Optional[Any] = None):
+        """
+        Args:
+            cancelled_event: Last event of a stream cancelled before it finished; without
+                one, subscribers get a `StreamCancelledError`.
+        """
+        self._events: List[Any] = []
+        self._error: Optional[BaseException] = None
+        self._done = False
+        self._updated = asyncio.Event()
+        self.cancelled_event = cancelled_event
+        self.subscribers = 0
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for event in source:
+                self._events.append(event)
+                self._notify()
+        except asyncio.CancelledError:
+            if self.cancelled_event is not None:
+                self._events.append(self.cancelled_event)
+            else:
+                self._error = StreamCancelledError("The shared stream was cancelled")
+            raise
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done = True
+            self._notify()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _notify(self) -> None:
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    def subscribe(self) -> "Subscription":
+        """Every event of the shared stream, starting from the first one. Counts right away."""
+        return Subscription(self)
+
+    def _unsubscribe(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.task.done():
+            self.task.cancel()
+
+
+class Subscription:
+    """
+    One subscriber's position in a `SharedStream`. It holds the stream open from
+    creation until it is exhausted or closed, even if it is never iterated.
+    """
+
+    def __init__(self, shared: SharedStream):
+        self._shared = shared
+        self._index = 0
+        self._closed = False
+        shared.subscribers += 1
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> Any:
+        shared = self._shared
+        try:
+            while not self._closed:
+                if self._index < len(shared._events):
+                    self._index += 1
+                    return shared._events[self._index - 1]
+                if shared._done:
+                    if shared._error is not None:
+                        raise shared._error
+                    break
+                await shared._updated.wait()
+        except BaseException:
+            await self.aclose()
+            raise
+        await self.aclose()
+        raise StopAsyncIteration
+
+    async def aclose(self) -> None:
+        """Detaches from the stream; the last subscriber to detach cancels it."""
+        if not self._closed:
+            self._closed = True
+            self._shared._unsubscribe()
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key."""
+
+    def __init__(self):
+        self._calls: Dict[str, _SharedCall] = {}
+        self._streams: Dict[str, SharedStream] = {}
+        self.leaders = 0  # calls that actually went upstream
+        self.coalesced = 0  # calls that joined an in-flight one
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Awaits `fn()`, or the already running call with the same key."""
+        call = self._calls.get(key)
+        if call is None:
+            call = _SharedCall(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget_call(key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            # shield() so that cancelling this waiter does not cancel the shared task
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]],
+               cancelled_event: Optional[Any] = None) -> Subscription:
+        """
+        Subscribes to the in-flight stream with the same key, starting `factory()` if there
+        is none. `cancelled_event` ends a stream that is cancelled (see `SharedStream`).
+        """
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = SharedStream(factory(), cancelled_event)
+            self._streams[key] = shared
+            shared.task.add_done_callback(lambda _, key=key, shared=shared: self._forget_stream(key, shared))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        return shared.subscribe()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+    def _forget_call(self, key: str, call: _SharedCall) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _forget_stream(self, key: str, shared: SharedStream) -> None:
+        if self._streams.get(key) is shared:
+            del self._streams[key]
@@ -0,0 +1,235 @@
+"""
+Server-side conversation history for the HTTP chat API.
+
+Clients identify a conversation with a session id and only send the new turn; the
+server keeps the history. Each session is capped by message count and total
+characters (oldest turns are dropped first), and sessions that stay idle for longer
+than `idle_ttl` are evicted. Messages keep their role, content and, in group
+conversations, the speaker's "name".
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from loguru import logger
+
+
+class _Session:
+    __slots__ = ("messages", "chars", "last_access")
+
+    def __init__(self, max_messages: int):
+        self.messages: Deque[Dict[str, str]] = deque(maxlen=max_messages)
+        self.chars = 0
+        self.last_access = time.monotonic()
+
+
+class InMemorySessionStore:
+    """Keeps each session as a ring buffer of messages in process memory."""
+
+    def __init__(self, max_messages: int = 200, max_chars: int = 200_000,
+                 idle_ttl: float = 3600.0, max_sessions: int = 10_000):
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        # least recently used first
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+
+    def get(self, session_id: str) -> List[Dict[str, str]]:
+        self._evict_idle()
+        session = self._sessions.get(session_id)
+        if session is None:
+            return []
+        session.last_access = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return list(session.messages)
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        self._evict_idle()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = _Session(self.max_messages)
+            self._sessions[session_id] = session
+        history = session.messages
+        for message in messages:
+            if len(history) == history.maxlen:
+                session.chars -= len(history[0]["content"])
+            content = message.get("content") or ""
+            entry = {"role": message["role"], "content": content}
+            if message.get("name"):
+                entry["name"] = message["name"]
+            history.append(entry)
+            session.chars += len(content)
+        while session.chars > self.max_chars and len(history) > 1:
+            session.chars -= len(history.popleft()["content"])
+        session.last_access = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def close(self) -> None:
+        self._sessions.clear()
+
+    def _evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access > deadline:
+                break
+            del self._sessions[session_id]
+
+
+class SQLiteSessionStore:
+    """Keeps sessions in a sqlite database (WAL mode), shared across restarts and processes."""
+
+    # Idle sessions are swept at most this often, not on every request
+    _SWEEP_INTERVAL = 60.0
+
+    def __init__(self, path: str, max_messages: int = 200, max_chars: int = 200_000,
+                 idle_ttl: float = 3600.0):
+        self.path = path
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self.idle_ttl = idle_ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_sessions ("
+            "session_id TEXT PRIMARY KEY, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_session_messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, name TEXT)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(chat_session_messages)")]
+        if "name" not in columns:
+            # Databases created before group conversations were stored
+            self._conn.execute("ALTER TABLE chat_session_messages ADD COLUMN name TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS chat_session_messages_session "
+            "ON chat_session_messages (session_id, id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS chat_sessions_last_access ON chat_sessions (last_access)"
+        )
+
+    def get(self, session_id: str) -> List[Dict[str, str]]:
+        with self._lock:
+            self._sweep()
+            updated = self._conn.execute(
+                "UPDATE chat_sessions SET last_access = ? WHERE session_id = ?",
+                (time.time(), session_id),
+            ).rowcount
+            if not updated:
+                return []
+            rows = self._conn.execute(
+                "SELECT role, content, name FROM chat_session_messages WHERE session_id = ? ORDER BY id",
+                (session_id,),
+            ).fetchall()
+        return [{"role": role, "content": content, **({"name": name} if name else {})}
+                for role, content, name in rows]
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        with self._lock:
+            self._sweep()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO chat_sessions (session_id, last_access) VALUES (?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access",
+                    (session_id, time.time()),
+                )
+                self._conn.executemany(
+                    "INSERT INTO chat_session_messages (session_id, role, content, name) VALUES (?, ?, ?, ?)",
+                    [(session_id, m["role"], m.get("content") or "", m.get("name")) for m in messages],
+                )
+                self._trim(session_id)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM chat_session_messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _trim(self, session_id: str) -> None:
+        # Drop everything older than the newest max_messages rows...
+        self._conn.execute(
+            "DELETE FROM chat_session_messages WHERE session_id = ? AND id < ("
+            "SELECT MIN(id) FROM (SELECT id FROM chat_session_messages WHERE session_id = ? "
+            "ORDER BY id DESC LIMIT ?))",
+            (session_id, session_id, self.max_messages),
+        )
+        # ...then the oldest rows until the character cap holds, keeping at least one message
+        rows = self._conn.execute(
+            "SELECT id, LENGTH(content) FROM chat_session_messages WHERE session_id = ? ORDER BY id DESC",
+            (session_id,),
+        ).fetchall()
+        total = 0
+        for index, (row_id, length) in enumerate(rows):
+            total += length
+            if total > self.max_chars and index > 0:
+                self._conn.execute(
+                    "DELETE FROM chat_session_messages WHERE session_id = ? AND id <= ?",
+                    (session_id, row_id),
+                )
+                break
+
+    def _sweep(self) -> None:
+        now = time.time()
+        if now - self._last_sweep < self._SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        deadline = now - self.idle_ttl
+        self._conn.execute(
+            "DELETE FROM chat_session_messages WHERE session_id IN ("
+            "SELECT session_id FROM chat_sessions WHERE last_access < ?)",
+            (deadline,),
+        )
+        self._conn.execute("DELETE FROM chat_sessions WHERE last_access < ?", (deadline,))
+
+
+def create_session_store(config) -> Optional[object]:
+    """Builds the session store described by a `SessionStoreConfig`, or None if it is disabled."""
+    if config is None or not config.enabled:
+        return None
+    logger.info(f"Chat session store enabled ({config.backend})")
+    if config.backend == "sqlite":
+        return SQLiteSessionStore(
+            config.sqlite_path,
+            max_messages=config.max_messages,
+            max_chars=config.max_chars,
+            idle_ttl=config.idle_ttl,
+        )
+    return InMemorySessionStore(
+        max_messages=config.max_messages,
+        max_chars=config.max_chars,
+        idle_ttl=config.idle_ttl,
+        max_sessions=config.max_sessions,
+    )
@@ -0,0 +1,129 @@
+"""
+Startup profiling for `run_server.py --profile-startup`.
+
+Times every module imported for the first time and named initialization phases
+(config loading, LLM clients, providers, server construction), then reports the
+slowest ones. Imports are timed by wrapping `builtins.__import__`, so profiling
+has to start before the modules of interest are imported; `run_server.py` keeps
+its heavy imports inside `run()` for that reason. Besides the standard library
+this module only uses loguru, which `run_server.py` imports before the profiler
+starts, so starting it does not import anything itself.
+"""
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from importlib.util import resolve_name
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+
+class StartupProfiler:
+    """Collects import and initialization timings; a disabled profiler does nothing."""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        # module -> (cumulative seconds, seconds excluding nested first-time imports)
+        self.imports: Dict[str, Tuple[float, float]] = {}
+        self.phases: List[Tuple[str, float]] = []
+        self._local = threading.local()
+        self._original_import: Optional[Callable] = None
+        self._started = time.perf_counter()
+
+    def start(self) -> None:
+        self.enabled = True
+        if self._original_import is not None:
+            return
+        self._started = time.perf_counter()
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def stop(self) -> None:
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original_import or builtins.__import__
+        absolute = name
+        if level:
+            try:
+                absolute = resolve_name("." * level + name, (globals or {}).get("__package__"))
+            except (ImportError, ValueError):
+                pass
+        if absolute in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+
+        # Per thread: time spent in nested first-time imports of each import in progress
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            if absolute in sys.modules and absolute not in self.imports:
+                self.imports[absolute] = (elapsed, elapsed - nested)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Times an initialization step (nested phases are reported separately)."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self, top: int = 25) -> Dict[str, Any]:
+        packages: Dict[str, float] = {}
+        for module, (_, own) in self.imports.items():
+            root = module.split(".")[0]
+            packages[root] = packages.get(root, 0.0) + own
+        modules = sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            "total": time.perf_counter() - self._started,
+            "import_total": sum(own for _, own in self.imports.values()),
+            "max_rss_mb": _max_rss_mb(),
+            "phases": self.phases,
+            "packages": sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top],
+            "modules": [(module, cumulative, own) for module, (cumulative, own) in modules[:top]],
+        }
+
+    def log_report(self, top: int = 25) -> None:
+        report = self.report(top)
+        rss = f", peak RSS {report['max_rss_mb']:.0f} MB" if report["max_rss_mb"] else ""
+        logger.info(f"Startup took {report['total']:.2f}s, {report['import_total']:.2f}s of it importing "
+                    f"{len(self.imports)} modules{rss}")
+        logger.info("Initialization phases:")
+        for name, seconds in report["phases"]:
+            logger.info(f"  {seconds * 1000:9.1f} ms  {name}")
+        logger.info("Import time by top-level package:")
+        for package, seconds in report["packages"]:
+            logger.info(f"  {seconds * 1000:9.1f} ms  {package}")
+        logger.info("Slowest imports (cumulative / own):")
+        for module, cumulative, own in report["modules"]:
+            logger.info(f"  {cumulative * 1000:9.1f} ms  {own * 1000:9.1f} ms  {module}")
+
+
+def _max_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# Enabled by run_server.py --profile-startup
+PROFILER = StartupProfiler()
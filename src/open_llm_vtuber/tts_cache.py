@@ -0,0 +1,252 @@
+"""
+Persistent, content-addressed cache of synthesized speech.
+
+Audio is stored under a hash of (TTS engine, the engine's voice settings from
+`tts_config`, the preprocessed text), so greetings, catchphrases and canned
+responses are synthesized once and then served from disk, also after a restart.
+An in-memory index keeps the files in LRU order and evicts the least recently
+used ones once the cache grows beyond `max_bytes`; a file handed out in the last
+`in_use_seconds` is kept, since its caller may still be reading it. The cache
+directory must not be inside the `cache/` directory that the server wipes on exit.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+# Engine settings that do not change the audio, so rotating a key keeps the cache
+_CREDENTIAL_SETTINGS = re.compile(r"(api_?key|subscription_key|token|secret|password)$", re.IGNORECASE)
+_TEMP_SUFFIX = ".tmp"
+
+
+def tts_settings(tts_config) -> Tuple[str, Dict[str, Any]]:
+    """The selected engine of a `TTSConfig` and its settings, without credentials."""
+    engine = tts_config.tts_model
+    engine_config = getattr(tts_config, engine, None)
+    if hasattr(engine_config, "model_dump"):
+        settings = engine_config.model_dump()
+    else:
+        settings = dict(engine_config or {})
+    return engine, {name: value for name, value in settings.items() if not _CREDENTIAL_SETTINGS.search(name)}
+
+
+def make_audio_key(engine: str, settings: Dict[str, Any], text: str) -> str:
+    payload = json.dumps([engine, settings, text], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSAudioCache:
+    """Audio files on disk, named by content key, with a byte-size cap and LRU eviction."""
+
+    def __init__(self, directory: str = "tts_cache", max_bytes: int = 512 * 1024 * 1024,
+                 in_use_seconds: float = 10.0):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.in_use_seconds = in_use_seconds
+        # key -> (file name, size), least recently used first
+        self._index: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        # key -> when get() last returned its path
+        self._handed_out: Dict[str, float] = {}
+        self.total_bytes = 0
+        # TTS engines synthesize in worker threads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self) -> None:
+        files = []
+        for dirent in os.scandir(self.directory):
+            if not dirent.is_file():
+                continue
+            if dirent.name.endswith(_TEMP_SUFFIX):
+                # Left behind by an interrupted write
+                os.remove(dirent.path)
+                continue
+            stat = dirent.stat()
+            files.append((stat.st_mtime, dirent.name, stat.st_size))
+        # File mtimes are refreshed on every hit, so they carry the LRU order across restarts
+        for _, name, size in sorted(files):
+            self._index[os.path.splitext(name)[0]] = (name, size)
+            self.total_bytes += size
+        with self._lock:
+            self._evict()
+        logger.info(f"TTS audio cache: {len(self._index)} files, {self.total_bytes / 1024 / 1024:.1f} MB "
+                    f"in {self.directory}")
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of the cached audio for `key`, or None. Touches the file, so call it off the event loop."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            path = os.path.join(self.directory, entry[0])
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Deleted behind our back
+                del self._index[key]
+                self.total_bytes -= entry[1]
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self._handed_out[key] = time.monotonic()
+            self.hits += 1
+            return path
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def put(self, key: str, source_path: str) -> str:
+        """Copies an audio file into the cache and returns the cached path."""
+        name = key + os.path.splitext(source_path)[1]
+        path = os.path.join(self.directory, name)
+        temp_path = path + _TEMP_SUFFIX
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            previous = self._index.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous[1]
+                if previous[0] != name:
+                    self._remove(previous[0])
+            self._index[key] = (name, size)
+            self.total_bytes += size
+            self._evict()
+        return path
+
+    def owns(self, path: str) -> bool:
+        """Whether `path` is a file of this cache (callers must not delete those)."""
+        return os.path.dirname(os.path.abspath(path)) == self.directory
+
+    def _evict(self) -> None:
+        # Keeps at least the newest file, even if it alone exceeds the cap, and the files
+        # still in use (the cache may stay above the cap until they are not)
+        now = time.monotonic()
+        self._handed_out = {key: at for key, at in self._handed_out.items() if now - at < self.in_use_seconds}
+        for key in list(self._index)[:-1]:
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self._handed_out:
+                continue
+            name, size = self._index.pop(key)
+            self.total_bytes -= size
+            self.evictions += 1
+            self._remove(name)
+
+    def _remove(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "files": len(self._index),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+class CachedTTSEngine:
+    """
+    Wraps a TTS engine (`generate_audio`, `async_generate_audio`, `remove_file`) so that
+    repeated lines are served from a `TTSAudioCache`. Everything else is passed through.
+    """
+
+    def __init__(self, engine: Any, cache: TTSAudioCache, engine_name: str, settings: Dict[str, Any]):
+        self.engine = engine
+        self.cache = cache
+        self.engine_name = engine_name
+        self.settings = settings
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.engine, name)
+
+    def key(self, text: str) -> str:
+        return make_audio_key(self.engine_name, self.settings, text)
+
+    def is_cached(self, text: str) -> bool:
+        return self.key(text) in self.cache
+
+    def generate_audio(self, text: str, file_name_no_ext: Optional[str] = None) -> str:
+        key = self.key(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        path = self.engine.generate_audio(text, file_name_no_ext)
+        if path and os.path.exists(path):
+            self.cache.put(key, path)
+        return path
+
+    async def async_generate_audio(self, text: str, file_name_no_ext: Optional[str] = None) -> str:
+        key = self.key(text)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached
+        path = await self.engine.async_generate_audio(text, file_name_no_ext)
+        if path and os.path.exists(path):
+            await asyncio.to_thread(self.cache.put, key, path)
+        return path
+
+    def remove_file(self, filepath: str, verbose: bool = True) -> None:
+        # Callers delete audio after sending it; cached files have to survive that
+        if self.cache.owns(filepath):
+            return
+        self.engine.remove_file(filepath, verbose)
+
+
+def create_tts_cache(config) -> Optional[TTSAudioCache]:
+    """Builds the cache from a `TTSCacheConfig`, or returns None if it is disabled."""
+    if config is None or not config.enabled:
+        return None
+    return TTSAudioCache(config.directory, max_bytes=int(config.max_size_mb * 1024 * 1024))
+
+
+def wrap_tts_engine(engine: Any, tts_config, cache: Optional[TTSAudioCache]) -> Any:
+    """Returns `engine` wrapped with the cache (or unchanged without one)."""
+    if cache is None or engine is None or isinstance(engine, CachedTTSEngine):
+        return engine
+    engine_name, settings = tts_settings(tts_config)
+    return CachedTTSEngine(engine, cache, engine_name, settings)
+
+
+def load_phrases(path: str) -> List[str]:
+    """One phrase per line; blank lines and lines starting with # are skipped."""
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+async def prewarm(engine: CachedTTSEngine, phrases: Iterable[str]) -> int:
+    """Synthesizes the phrases that are not cached yet; returns how many were added."""
+    added = 0
+    for index, phrase in enumerate(phrases):
+        if engine.is_cached(phrase):
+            continue
+        try:
+            path = await engine.async_generate_audio(phrase, f"prewarm_{index}")
+            if path:
+                # The engine's own output file; the cached copy stays
+                engine.remove_file(path, verbose=False)
+            added += 1
+        except Exception as e:
+            logger.warning(f"Prewarming TTS audio for {phrase!r} failed: {e}")
+    logger.info(f"Prewarmed the TTS audio cache with {added} new phrases")
+    return added
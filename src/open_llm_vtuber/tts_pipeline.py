@@ -0,0 +1,194 @@
+"""
+Sentence-level pipelining between LLM output and TTS.
+
+The LLM token stream is split into sentences as it arrives, each sentence is run
+through the `tts_preprocessor_config` filters and handed to the TTS engine through
+a bounded queue. Synthesis of sentence N therefore overlaps with generation of
+sentence N+1, and the first audio is available after the first sentence instead of
+after the whole reply.
+"""
+import asyncio
+import re
+import unicodedata
+from typing import Any, AsyncIterator, Awaitable, Callable, List, NamedTuple, Optional
+
+import pysbd
+from loguru import logger
+
+# Characters after which a segment may be a finished sentence. Re-running the
+# segmenter is only worth it when one of these is in the buffer.
+_SENTENCE_END_CHARS = set(".!?;。！？；…\n")
+# Characters that may end the first fragment early when `faster_first_response` is on.
+_FIRST_FRAGMENT_CHARS = ",，、"
+
+
+class SentenceChunk(NamedTuple):
+    """One sentence of the reply, ready for display and playback."""
+
+    text: str  # sentence as produced by the LLM, for display
+    tts_text: str  # sentence after the tts preprocessor filters, "" if nothing is left to speak
+    audio: Any = None  # whatever the synthesize callable returned, None if not synthesized
+
+
+class IncrementalSentenceSplitter:
+    """
+    Splits a stream of text deltas into sentences using pysbd.
+
+    The last segment in the buffer is held back until more text (or `flush`) arrives,
+    since it may still be incomplete. A sentence is released with the first delta
+    after its terminator, not with the next sentence's terminator.
+    """
+
+    def __init__(self, language: str = "en", faster_first_response: bool = True,
+                 first_fragment_min_length: int = 10):
+        """
+        Args:
+            language: pysbd language code.
+            faster_first_response: Emit the first fragment at the first comma, so the
+                character starts speaking before the first sentence is complete.
+            first_fragment_min_length: Minimum length of that early first fragment.
+        """
+        self._segmenter = pysbd.Segmenter(language=language, clean=False)
+        self._buffer = ""
+        # Whether the buffer holds a terminator that pysbd has not split at yet
+        self._end_pending = False
+        self._first_emitted = not faster_first_response
+        self._first_fragment_min_length = first_fragment_min_length
+
+    def feed(self, text: str) -> List[str]:
+        """Adds a delta and returns the sentences completed by it."""
+        self._buffer += text
+        sentences: List[str] = []
+
+        if not self._first_emitted:
+            cut = self._find_first_fragment_end()
+            if cut:
+                sentences.append(self._buffer[:cut])
+                self._buffer = self._buffer[cut:]
+                self._first_emitted = True
+
+        if not self._end_pending and not any(char in _SENTENCE_END_CHARS for char in text):
+            return sentences
+
+        segments = self._segmenter.segment(self._buffer)
+        if len(segments) > 1:
+            sentences.extend(segments[:-1])
+            self._buffer = segments[-1]
+            self._first_emitted = True
+        # "Sure." stays one segment until the text after it shows where the sentence ends
+        self._end_pending = any(char in _SENTENCE_END_CHARS for char in self._buffer)
+        return [s for s in sentences if s.strip()]
+
+    def flush(self) -> List[str]:
+        """Returns whatever is left in the buffer once the stream has ended."""
+        remaining, self._buffer = self._buffer, ""
+        self._end_pending = False
+        if not remaining.strip():
+            return []
+        return [s for s in self._segmenter.segment(remaining) if s.strip()]
+
+    def _find_first_fragment_end(self) -> int:
+        for index, char in enumerate(self._buffer):
+            if char in _FIRST_FRAGMENT_CHARS and index + 1 >= self._first_fragment_min_length:
+                return index + 1
+        return 0
+
+
+def _remove_enclosed(text: str, left: str, right: str) -> str:
+    return re.sub(re.escape(left) + r"[^" + re.escape(right) + r"]*" + re.escape(right), "", text)
+
+
+def tts_filter(text: str, preprocessor_config: Any = None) -> str:
+    """
+    Applies the `tts_preprocessor_config` filters to a single sentence.
+
+    Translation (`translator_config`) is not applied here; it needs a network round
+    trip per sentence and is left to the TTS engine wrapper.
+    """
+    if preprocessor_config is None:
+        return text.strip()
+    if getattr(preprocessor_config, "ignore_brackets", False):
+        text = _remove_enclosed(text, "[", "]")
+    if getattr(preprocessor_config, "ignore_parentheses", False):
+        text = _remove_enclosed(text, "(", ")")
+        text = _remove_enclosed(text, "（", "）")
+    if getattr(preprocessor_config, "ignore_asterisks", False):
+        text = _remove_enclosed(text, "*", "*")
+    if getattr(preprocessor_config, "ignore_angle_brackets", False):
+        text = _remove_enclosed(text, "<", ">")
+    if getattr(preprocessor_config, "remove_special_char", False):
+        # Drop symbols (emoji, dingbats, math signs, ...) but keep letters, digits and punctuation
+        text = "".join(char for char in text if not unicodedata.category(char).startswith("S"))
+    text = re.sub(r"\s+", " ", text)
+    # Removed spans can leave a space in front of punctuation ("Hi (waves)." -> "Hi .")
+    return re.sub(r"\s+([.,!?;:。，！？；：])", r"\1", text).strip()
+
+
+class SentenceTTSPipeline:
+    """
+    Streams an LLM reply into TTS one sentence at a time.
+
+    A producer task splits the incoming deltas and fills a bounded queue, while the
+    consumer synthesizes queued sentences in order. The queue bound applies
+    backpressure to the LLM stream if TTS falls behind.
+    """
+
+    _END = object()
+
+    def __init__(self, synthesize: Optional[Callable[[str], Awaitable[Any]]] = None,
+                 preprocessor_config: Any = None, language: str = "en",
+                 faster_first_response: bool = True, max_queue_size: int = 4):
+        """
+        Args:
+            synthesize: Coroutine function turning text into audio (e.g. a bound
+                `async_generate_audio` of the configured TTS engine). If None, sentences
+                are yielded without audio, for clients that synthesize themselves.
+            preprocessor_config: The character's `tts_preprocessor_config`.
+            language: pysbd language code used for sentence splitting.
+            faster_first_response: See `IncrementalSentenceSplitter`.
+            max_queue_size: Maximum number of sentences waiting for synthesis.
+        """
+        self.synthesize = synthesize
+        self.preprocessor_config = preprocessor_config
+        self.language = language
+        self.faster_first_response = faster_first_response
+        self.max_queue_size = max_queue_size
+
+    async def run(self, deltas: AsyncIterator[str]) -> AsyncIterator[SentenceChunk]:
+        """Consumes text deltas and yields synthesized sentences in order."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue_size)
+        producer = asyncio.create_task(self._produce(deltas, queue))
+        try:
+            while True:
+                item = await queue.get()
+                if item is self._END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                text, tts_text = item
+                audio = None
+                if tts_text and self.synthesize is not None:
+                    audio = await self.synthesize(tts_text)
+                yield SentenceChunk(text=text, tts_text=tts_text, audio=audio)
+        finally:
+            if not producer.done():
+                producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+    async def _produce(self, deltas: AsyncIterator[str], queue: asyncio.Queue) -> None:
+        splitter = IncrementalSentenceSplitter(
+            language=self.language, faster_first_response=self.faster_first_response
+        )
+        try:
+            async for delta in deltas:
+                for sentence in splitter.feed(delta):
+                    await queue.put((sentence.strip(), tts_filter(sentence, self.preprocessor_config)))
+            for sentence in splitter.flush():
+                await queue.put((sentence.strip(), tts_filter(sentence, self.preprocessor_config)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Sentence pipeline stopped on an upstream error: {e}")
+            await queue.put(e)
+            return
+        await queue.put(self._END)
@@ -0,0 +1,410 @@
+"""
+Warm pool for local models.
+
+The first request after boot, or after Ollama unloaded an idle model, waits for the
+model to load. `WarmPool` collects the local models the characters use (Ollama
+and llama.cpp), loads them concurrently at startup, pings idle Ollama models
+before their `keep_alive` runs out and unloads the ones with `unload_at_exit`
+on shutdown. llama.cpp models are loaded once per model file (memory-mapped) and
+shared by every character that uses the file. Load times and whether requests
+found their model warm or cold are recorded in the metrics.
+
+With several worker processes (run_server.py --workers) the workers register in a
+sqlite database. Only one of them, the leader, preloads and pings; the others map
+the llama.cpp files the leader already brought into the page cache on first use.
+Ollama models are unloaded by the last worker to exit, not the first.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import httpx
+from loguru import logger
+
+from .metrics import LLM_MODEL_LOAD_SECONDS, LLM_MODEL_REQUESTS
+from .character_providers import selected_providers
+
+# Loading a large model from disk can take minutes
+_LOAD_TIMEOUT = 600.0
+
+
+def ollama_root(base_url: str) -> str:
+    """Ollama's native API root for an OpenAI-compatible base_url (".../v1")."""
+    url = str(base_url).rstrip("/")
+    return url[:-3] if url.endswith("/v1") else url
+
+
+class OllamaModel:
+    """One model on one Ollama server."""
+
+    __slots__ = ("root", "model", "keep_alive", "unload_at_exit", "last_used", "loaded", "load_seconds")
+
+    def __init__(self, root: str, model: str, keep_alive: float, unload_at_exit: bool):
+        self.root = root
+        self.model = model
+        # Seconds Ollama keeps the model after the last request; negative is forever
+        self.keep_alive = keep_alive
+        self.unload_at_exit = unload_at_exit
+        self.last_used: Optional[float] = None
+        self.loaded = False
+        self.load_seconds: Optional[float] = None
+
+    def is_warm(self, now: float) -> bool:
+        if not self.loaded or self.last_used is None:
+            return False
+        return self.keep_alive < 0 or now - self.last_used < self.keep_alive
+
+
+class SharedLlamaModels:
+    """llama.cpp models by real file path, loaded once and shared by every character."""
+
+    def __init__(self):
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.load_seconds: Dict[str, float] = {}
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, model_path: str, **kwargs) -> Any:
+        """The `llama_cpp.Llama` for `model_path`; the first caller's kwargs load it."""
+        path = os.path.realpath(model_path)
+        model = self._models.get(path)
+        if model is not None:
+            self.hits += 1
+            LLM_MODEL_REQUESTS.inc(model=path, state="warm")
+            return model
+        with self._lock:
+            model = self._models.get(path)
+            if model is None:
+                from llama_cpp import Llama
+
+                LLM_MODEL_REQUESTS.inc(model=path, state="cold")
+                start = time.perf_counter()
+                # mmap lets the OS share the weights' pages instead of copying them
+                model = Llama(model_path=path, use_mmap=True, **{"verbose": False, **kwargs})
+                seconds = time.perf_counter() - start
+                self.load_seconds[path] = seconds
+                self.loads += 1
+                LLM_MODEL_LOAD_SECONDS.observe(seconds, backend="llama_cpp", model=path)
+                logger.info(f"Loaded llama.cpp model {path} in {seconds:.1f}s")
+                self._models[path] = model
+        return model
+
+    def __contains__(self, model_path: str) -> bool:
+        return os.path.realpath(model_path) in self._models
+
+
+# One instance per process, used by the llama.cpp provider and the warm pool
+LLAMA_MODELS = SharedLlamaModels()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedWarmPoolState:
+    """The worker processes running a warm pool, in a sqlite database (WAL mode)."""
+
+    def __init__(self, path: str, pid: Optional[int] = None, alive=_alive):
+        self.path = path
+        self.pid = os.getpid() if pid is None else pid
+        self._alive = alive
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS warm_pool_workers (pid INTEGER PRIMARY KEY)")
+
+    def _live_pids(self) -> List[int]:
+        # Rows of workers that died without leaving are dropped here
+        pids = [row[0] for row in self._conn.execute("SELECT pid FROM warm_pool_workers ORDER BY pid")]
+        dead = [pid for pid in pids if pid != self.pid and not self._alive(pid)]
+        if dead:
+            self._conn.executemany("DELETE FROM warm_pool_workers WHERE pid = ?", [(pid,) for pid in dead])
+        return [pid for pid in pids if pid not in dead]
+
+    def join(self) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO warm_pool_workers (pid) VALUES (?)", (self.pid,))
+
+    def is_leader(self) -> bool:
+        """True for the live worker with the lowest pid."""
+        with self._lock:
+            pids = self._live_pids()
+        return bool(pids) and pids[0] == self.pid
+
+    def leave(self) -> bool:
+        """Unregisters this worker; True if it was the last one."""
+        with self._lock:
+            # One transaction, so of several workers exiting at once exactly one is last
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM warm_pool_workers WHERE pid = ?", (self.pid,))
+                last = not self._live_pids()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return last
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class WarmPool:
+    """Preloads, keeps alive and unloads the local models used by the characters."""
+
+    def __init__(self, config=None, http_client: Optional[httpx.AsyncClient] = None,
+                 llama_models: SharedLlamaModels = LLAMA_MODELS,
+                 shared_state: Optional[SharedWarmPoolState] = None):
+        """
+        Args:
+            config: A `WarmPoolConfig`; the defaults are used if omitted.
+            http_client: Client for Ollama's native API (created if omitted).
+            shared_state: The other worker processes' pools; without it this pool
+                always leads.
+        """
+        self.preload_at_startup = getattr(config, "preload_at_startup", True)
+        self.keep_alive_margin = getattr(config, "keep_alive_margin", 0.8)
+        self.min_ping_interval = getattr(config, "min_ping_interval", 30.0)
+        self._http = http_client
+        self._owns_http = http_client is None
+        self.llama_models = llama_models
+        self.ollama: Dict[Tuple[str, str], OllamaModel] = {}
+        self.llama_cpp: Dict[str, Dict[str, Any]] = {}
+        self.shared_state = shared_state
+        self.leading = False
+        self._task: Optional[asyncio.Task] = None
+        self._loads: Set[asyncio.Task] = set()
+        self.pings = 0
+        self.cold_requests = 0
+        self.warm_requests = 0
+
+    @classmethod
+    def from_config(cls, config, characters: Iterable[Any], workers: int = 1) -> Optional["WarmPool"]:
+        """
+        A pool for the local models the characters select, or None if disabled. The pool
+        may start out empty: characters added later can still bring local models.
+        """
+        if config is not None and not config.enabled:
+            return None
+        shared_state = None
+        if workers > 1:
+            shared_state = SharedWarmPoolState(getattr(config, "shared_state_path", "db/warm_pool_workers.sqlite3"))
+        pool = cls(config, shared_state=shared_state)
+        for character in characters:
+            pool.add_character(character)
+        return pool
+
+    def add_characters(self, characters: Iterable[Any]) -> None:
+        """
+        Adds the local models of new or edited characters (e.g. after a config reload).
+        Once the pool has preloaded, the models that are new to it are loaded in the background.
+        """
+        ollama, llama_cpp = set(self.ollama), set(self.llama_cpp)
+        for character in characters:
+            if character is not None:
+                self.add_character(character)
+        if not self.leading or not self.preload_at_startup:
+            return
+        loads = [self.load_ollama(model) for key, model in self.ollama.items() if key not in ollama]
+        loads += [self.load_llama_cpp(path, settings) for path, settings in self.llama_cpp.items()
+                  if path not in llama_cpp]
+        for load in loads:
+            task = asyncio.create_task(load)
+            self._loads.add(task)
+            task.add_done_callback(self._loads.discard)
+
+    def add_character(self, character) -> None:
+        provider = selected_providers(character)["llm"]
+        llm_configs = getattr(character.agent_config, "llm_configs", None)
+        backend = getattr(llm_configs, provider or "", None)
+        if backend is None:
+            return
+        if provider == "ollama_llm":
+            self.add_ollama(backend)
+        elif provider == "llama_cpp_llm":
+            self.add_llama_cpp(backend)
+
+    def add_ollama(self, config) -> OllamaModel:
+        key = (ollama_root(config.base_url), config.model)
+        model = self.ollama.get(key)
+        if model is None:
+            model = self.ollama[key] = OllamaModel(key[0], config.model, config.keep_alive, config.unload_at_exit)
+        else:
+            # Characters sharing a model: the longest keep_alive wins, forever (-1) above all
+            if model.keep_alive >= 0 and (config.keep_alive < 0 or config.keep_alive > model.keep_alive):
+                model.keep_alive = config.keep_alive
+            model.unload_at_exit = model.unload_at_exit and config.unload_at_exit
+        return model
+
+    def add_llama_cpp(self, config) -> None:
+        settings = config.model_dump(exclude={"model_path", "interrupt_method"}, exclude_none=True) \
+            if hasattr(config, "model_dump") else {}
+        self.llama_cpp.setdefault(os.path.realpath(config.model_path), settings)
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=_LOAD_TIMEOUT)
+        return self._http
+
+    async def _generate(self, model: OllamaModel, keep_alive: float) -> Dict[str, Any]:
+        # An empty prompt only loads the model (or unloads it with keep_alive 0)
+        response = await self.http.post(f"{model.root}/api/generate",
+                                        json={"model": model.model, "keep_alive": keep_alive})
+        response.raise_for_status()
+        return response.json()
+
+    async def load_ollama(self, model: OllamaModel) -> None:
+        start = time.perf_counter()
+        try:
+            result = await self._generate(model, model.keep_alive)
+        except Exception as e:
+            logger.warning(f"Preloading Ollama model {model.model} at {model.root} failed: {e}")
+            return
+        # Ollama's own measurement excludes the HTTP round trip; 0 if it was loaded already
+        load_duration = result.get("load_duration")
+        seconds = load_duration / 1e9 if load_duration else time.perf_counter() - start
+        model.loaded = True
+        model.last_used = time.monotonic()
+        model.load_seconds = seconds
+        LLM_MODEL_LOAD_SECONDS.observe(seconds, backend="ollama", model=model.model)
+        logger.info(f"Ollama model {model.model} ready after {seconds:.1f}s")
+
+    async def load_llama_cpp(self, model_path: str, settings: Dict[str, Any]) -> None:
+        try:
+            await asyncio.to_thread(self.llama_models.get, model_path, **settings)
+        except Exception as e:
+            logger.warning(f"Preloading llama.cpp model {model_path} failed: {e}")
+
+    async def preload(self) -> None:
+        """Loads every model concurrently."""
+        await asyncio.gather(
+            *(self.load_ollama(model) for model in self.ollama.values()),
+            *(self.load_llama_cpp(path, settings) for path, settings in self.llama_cpp.items()),
+        )
+
+    def next_ping_delay(self, now: float) -> Optional[float]:
+        """Seconds until the next model needs a keep-alive ping, or None if none ever does."""
+        delays = [
+            max(self.min_ping_interval, model.keep_alive * self.keep_alive_margin) - (now - model.last_used)
+            for model in self.ollama.values()
+            if model.loaded and model.keep_alive > 0 and model.last_used is not None
+        ]
+        return max(0.0, min(delays)) if delays else None
+
+    async def keep_alive(self) -> None:
+        """Pings Ollama models that would otherwise be unloaded; runs until cancelled."""
+        while True:
+            delay = self.next_ping_delay(time.monotonic())
+            # Characters added by a config reload may bring a model with a timed keep_alive
+            await asyncio.sleep(self.min_ping_interval if delay is None else max(delay, 1.0))
+            now = time.monotonic()
+            for model in self.ollama.values():
+                if not model.loaded or model.keep_alive <= 0 or model.last_used is None:
+                    continue
+                if now - model.last_used < max(self.min_ping_interval, model.keep_alive * self.keep_alive_margin):
+                    continue
+                try:
+                    await self._generate(model, model.keep_alive)
+                    model.last_used = time.monotonic()
+                    self.pings += 1
+                except Exception as e:
+                    logger.warning(f"Keep-alive ping for Ollama model {model.model} failed: {e}")
+
+    async def _lead(self) -> None:
+        # Another worker leads until it exits
+        while self.shared_state is not None and not await asyncio.to_thread(self.shared_state.is_leader):
+            await asyncio.sleep(self.min_ping_interval)
+        self.leading = True
+
+    async def _run(self) -> None:
+        await self._lead()
+        if self.preload_at_startup:
+            await self.preload()
+        await self.keep_alive()
+
+    def start(self) -> asyncio.Task:
+        """Preloads (in the background, so startup does not wait) and starts the keep-alive pings."""
+        if self._task is None or self._task.done():
+            if self.shared_state is not None:
+                self.shared_state.join()
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def note_request(self, base_url: Any, model_name: str) -> Optional[str]:
+        """Records an upstream call; returns "warm" or "cold" for managed models, else None."""
+        model = self.ollama.get((ollama_root(base_url), model_name))
+        if model is None:
+            return None
+        now = time.monotonic()
+        state = "warm" if model.is_warm(now) else "cold"
+        if state == "warm":
+            self.warm_requests += 1
+        else:
+            self.cold_requests += 1
+        LLM_MODEL_REQUESTS.inc(model=model_name, state=state)
+        model.loaded = True
+        model.last_used = now
+        return state
+
+    async def close(self) -> None:
+        """
+        Stops the pings and unloads the Ollama models marked `unload_at_exit`, unless
+        other workers are still running and using them.
+        """
+        tasks = [task for task in (self._task, *self._loads) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self.leading = False
+        last = True
+        if self.shared_state is not None:
+            last = await asyncio.to_thread(self.shared_state.leave)
+            self.shared_state.close()
+        for model in self.ollama.values():
+            if not model.unload_at_exit or not last:
+                continue
+            try:
+                await self._generate(model, 0)
+                model.loaded = False
+            except Exception as e:
+                logger.warning(f"Unloading Ollama model {model.model} failed: {e}")
+        if self._owns_http and self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        models: List[Dict[str, Any]] = [
+            {"backend": "ollama", "model": model.model, "host": model.root, "warm": model.is_warm(now),
+             "load_seconds": model.load_seconds}
+            for model in self.ollama.values()
+        ]
+        models.extend(
+            {"backend": "llama_cpp", "model": path, "warm": path in self.llama_models,
+             "load_seconds": self.llama_models.load_seconds.get(path)}
+            for path in self.llama_cpp
+        )
+        return {
+            "models": models,
+            "warm_requests": self.warm_requests + self.llama_models.hits,
+            "cold_requests": self.cold_requests + self.llama_models.loads,
+            "keep_alive_pings": self.pings,
+            "leading": self.leading,
+        }
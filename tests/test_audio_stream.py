@@ -0,0 +1,117 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.open_llm_vtuber.audio_stream import (
+    VAD_WINDOW,
+    AudioRingBuffer,
+    AudioStreamSession,
+    StreamingVAD,
+    register_audio_stream_route,
+)
+
+
+class LoudnessProb:
+    """Speech probability 1 for loud windows; counts resets like the silero wrapper."""
+
+    def __init__(self, vad_engine=None):
+        self.resets = 0
+
+    def __call__(self, window):
+        return 1.0 if np.abs(window).max() > 0.1 else 0.0
+
+    def reset(self):
+        self.resets += 1
+
+
+def windows(count, amplitude):
+    return np.full(count * VAD_WINDOW, amplitude, dtype=np.float32)
+
+
+def make_vad(prob=None):
+    return StreamingVAD(prob or LoudnessProb(), required_hits=2, required_misses=3, smoothing_window=1)
+
+
+def test_ring_buffer_reads_are_views_until_they_wrap():
+    ring = AudioRingBuffer(8)
+    ring.write(np.arange(6, dtype=np.float32))
+    view = ring.read(1, 4)
+    assert view.base is not None
+    assert view.tolist() == [1, 2, 3]
+
+    ring.write(np.arange(6, 11, dtype=np.float32))
+    assert (ring.oldest, ring.written) == (3, 11)
+    out = np.empty(8, dtype=np.float32)
+    assert ring.read(3, 11, out=out).tolist() == [3, 4, 5, 6, 7, 8, 9, 10]
+
+
+def test_ring_buffer_rejects_overwritten_samples():
+    ring = AudioRingBuffer(4)
+    ring.write(np.arange(10, dtype=np.float32))
+    assert ring.oldest == 6
+    assert ring.read(6, 10).tolist() == [6, 7, 8, 9]
+    with pytest.raises(ValueError):
+        ring.read(5, 10)
+    with pytest.raises(ValueError):
+        ring.read(6, 11)
+
+
+def test_ring_buffer_scales_int16():
+    ring = AudioRingBuffer(4)
+    ring.write(np.array([16384, -32768], dtype="<i2"), scale=1.0 / 32768.0)
+    assert ring.read(0, 2).tolist() == [0.5, -1.0]
+
+
+def test_vad_reset_resets_the_model_state():
+    prob = LoudnessProb()
+    vad = make_vad(prob)
+    vad.process(windows(1, 0.5))
+    vad.reset()
+    assert prob.resets == 1
+    assert not vad.speaking
+
+
+def test_session_returns_the_utterance_at_the_end_of_speech():
+    session = AudioStreamSession(make_vad(), pre_roll_windows=0)
+    frames = np.concatenate([windows(2, 0.0), windows(4, 0.5), windows(3, 0.0)])
+    events = session.feed(frames.astype("<f4").tobytes())
+    assert [event["type"] for event in events] == ["speech-start", "speech-end"]
+    audio = events[1]["audio"]
+    # From the first speech window (pre-roll covers the required hits) to the last silent one
+    assert len(audio) == 7 * VAD_WINDOW
+    assert audio[:4 * VAD_WINDOW].min() == 0.5
+
+
+def test_session_finish_ends_the_utterance():
+    session = AudioStreamSession(make_vad(), pre_roll_windows=0)
+    assert [e["type"] for e in session.feed(windows(3, 0.5).tobytes())] == ["speech-start"]
+    assert [e["type"] for e in session.finish()] == ["speech-end"]
+    assert session.finish() == []
+
+
+def test_route_handles_text_frames_and_gives_each_connection_its_own_vad():
+    created = []
+
+    def speech_prob(vad_engine):
+        prob = LoudnessProb(vad_engine)
+        created.append(prob)
+        return prob
+
+    asr = SimpleNamespace(transcribe_np=lambda audio: f"{len(audio)} samples")
+    app = FastAPI()
+    register_audio_stream_route(app, lambda: object(), lambda: asr, speech_prob=speech_prob,
+                                vad_config=SimpleNamespace(required_hits=2, required_misses=3, smoothing_window=1))
+    client = TestClient(app)
+    with client.websocket_connect("/client-ws/audio-stream") as first, \
+            client.websocket_connect("/client-ws/audio-stream") as second:
+        first.send_text("not json")
+        first.send_bytes(windows(3, 0.5).tobytes())
+        second.send_bytes(windows(1, 0.0).tobytes())
+        first.send_text(json.dumps({"type": "mic-audio-end"}))
+        assert json.loads(first.receive_text()) == {"type": "control", "text": "mic-audio-end"}
+        assert json.loads(first.receive_text())["type"] == "user-input-transcription"
+    assert len(created) == 2 and created[0] is not created[1]
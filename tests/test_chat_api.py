@@ -0,0 +1,164 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.open_llm_vtuber.chat_api import register_chat_routes
+from src.open_llm_vtuber.group_conversation import GroupTurnScheduler
+from src.open_llm_vtuber.prompt_compiler import PromptCompiler
+from src.open_llm_vtuber.session_store import InMemorySessionStore
+
+
+class FakeLLM:
+    """Stands in for `LLMClientManager`; replies with the number of messages it was sent."""
+
+    def __init__(self, stall_after=None):
+        self.default_config = None
+        self.context_window = SimpleNamespace(forget=lambda session_id: None)
+        self.requests = []
+        # With a number, the stream stops after that many deltas until it is cancelled
+        self.stall_after = stall_after
+        self.stalled = asyncio.Event()
+
+    async def generate_response_stream(self, messages, **kwargs):
+        self.requests.append(messages)
+        for index, word in enumerate(["reply", f" {len(messages)}"]):
+            if index == self.stall_after:
+                self.stalled.set()
+                await asyncio.Event().wait()
+            yield {"type": "delta", "content": word}
+        yield {"type": "done"}
+
+    async def generate_response(self, messages, **kwargs):
+        self.requests.append(messages)
+        return f"{messages[0]['content'].split()[-1].rstrip('.')} {len(messages)}"
+
+
+def make_app(session_store=None, llm=None, **kwargs):
+    app = FastAPI()
+    llm = llm or FakeLLM()
+    register_chat_routes(app, llm, session_store=session_store, **kwargs)
+    return app, llm
+
+
+def make_client(session_store=None, **kwargs):
+    app, llm = make_app(session_store, **kwargs)
+    return TestClient(app), llm
+
+
+def test_empty_session_store_starts_a_session():
+    store = InMemorySessionStore()
+    client, llm = make_client(store)
+    first = client.post("/api/chat", json={"message": "hi", "session_id": ""}).json()
+    session_id = first["session_id"]
+    assert session_id
+    assert store.get(session_id) == [{"role": "user", "content": "hi"},
+                                     {"role": "assistant", "content": "reply 1"}]
+
+    second = client.post("/api/chat", json={"message": "again", "session_id": session_id}).json()
+    assert second == {"response": "reply 3", "session_id": session_id}
+    assert [m["content"] for m in llm.requests[-1]] == ["hi", "reply 1", "again"]
+
+
+def test_without_store_history_comes_from_the_request():
+    client, llm = make_client()
+    body = client.post("/api/chat", json={"message": "hi", "session_id": "",
+                                          "history": [{"role": "user", "content": "earlier"}]}).json()
+    assert body == {"response": "reply 2"}
+
+
+def test_persona_prompt_is_only_added_without_a_client_system_message():
+    persona = SimpleNamespace(conf_name="mao", persona_prompt="You are Mao.", response_cache_ttl=None, tts_preprocessor_config=None)
+    client, llm = make_client(character=lambda key: persona,
+                              prompt_compiler=PromptCompiler(load_prompt=lambda name: ""))
+    client.post("/api/chat", json={"message": "hi"})
+    assert llm.requests[-1][0] == {"role": "system", "content": "You are Mao."}
+
+    history = [{"role": "user", "content": "earlier"}, {"role": "system", "content": "Be brief."}]
+    client.post("/api/chat", json={"message": "hi", "history": history})
+    assert llm.requests[-1] == history + [{"role": "user", "content": "hi"}]
+
+
+def test_request_switches_the_character():
+    characters = {
+        name: SimpleNamespace(conf_name=name, persona_prompt=f"You are {name}.", response_cache_ttl=None,
+                              tts_preprocessor_config=None)
+        for name in ("mao", "shizuku")
+    }
+    client, llm = make_client(character=lambda key: characters.get(key or "mao"),
+                              prompt_compiler=PromptCompiler(load_prompt=lambda name: ""))
+    client.post("/api/chat", json={"message": "hi", "character": "shizuku"})
+    assert llm.requests[-1][0]["content"] == "You are shizuku."
+    client.post("/api/chat", json={"message": "hi"})
+    assert llm.requests[-1][0]["content"] == "You are mao."
+
+    response = client.post("/api/chat/stream", json={"message": "hi", "character": "nobody"})
+    assert response.status_code == 404
+    assert len(llm.requests) == 2
+
+
+def test_interrupted_reply_keeps_the_generated_part():
+    store = InMemorySessionStore()
+    app, llm = make_app(store, FakeLLM(stall_after=1))
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            chat = asyncio.ensure_future(client.post("/api/chat", json={"message": "hi", "session_id": "s"}))
+            await llm.stalled.wait()
+            interrupt = await client.post("/api/chat/session/s/interrupt")
+            assert interrupt.json() == {"interrupted": True}
+            return (await chat).json()
+
+    assert asyncio.run(run()) == {"response": "reply", "interrupted": True, "session_id": "s"}
+    assert store.get("s") == [
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "reply..."},
+        {"role": "user", "content": "[Interrupted by user]"},
+    ]
+
+
+def test_sentence_mode_sends_the_synthesized_audio():
+    synthesized = []
+
+    async def synthesize(text, file_name_no_ext):
+        synthesized.append(file_name_no_ext)
+        return f"cache/{file_name_no_ext}.wav"
+
+    client, _ = make_client(synthesize=synthesize)
+    with client.stream("POST", "/api/chat/stream", json={"message": "hi", "segment_sentences": True}) as response:
+        events = [json.loads(line[len("data: "):]) for line in response.iter_lines() if line.startswith("data: ")]
+    sentences = [event for event in events if event["type"] == "sentence"]
+    assert [event["text"] for event in sentences] == ["reply 1"]
+    assert sentences[0]["audio_path"] == f"cache/{synthesized[0]}.wav"
+    assert events[-1]["type"] == "done"
+
+
+def sse_events(response):
+    return [json.loads(line[len("data: "):]) for line in response.iter_lines() if line.startswith("data: ")]
+
+
+def test_group_round_streams_each_participants_turn():
+    characters = {
+        name: SimpleNamespace(conf_uid=name.lower(), character_name=name, human_name="Alice",
+                              persona_prompt=f"You are {name}.", tts_preprocessor_config=None)
+        for name in ("Ann", "Bob")
+    }
+    store = InMemorySessionStore()
+    app, llm = make_app(store, character=characters.get,
+                        group_scheduler=GroupTurnScheduler(FakeLLM(), "speculative", llm_config_for=lambda c: None))
+    client = TestClient(app)
+    assert client.post("/api/chat/group", json={"message": "hi", "characters": ["Ann", "Eve"]}).status_code == 404
+
+    with client.stream("POST", "/api/chat/group",
+                       json={"message": "hi", "characters": ["Ann", "Bob"], "session_id": ""}) as response:
+        events = sse_events(response)
+    session_id = events[0]["session_id"]
+    assert [(event["name"], event["text"]) for event in events if event["type"] == "turn"] == \
+        [("Ann", "Ann 2"), ("Bob", "Bob 3")]
+    assert events[-1] == {"type": "done", "turns": 2, "discarded": 0}
+    assert store.get(session_id) == [{"role": "user", "content": "hi"},
+                                     {"role": "assistant", "name": "Ann", "content": "Ann 2"},
+                                     {"role": "assistant", "name": "Bob", "content": "Bob 3"}]
@@ -0,0 +1,142 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.open_llm_vtuber.group_conversation import GroupTurnScheduler, participant_messages
+from src.open_llm_vtuber.llm_config_manager import LLMClientManager, OllamaConfig, OpenAICompatibleConfig
+
+
+def character(name, provider=None, llm_configs=None):
+    return SimpleNamespace(
+        conf_uid=name.lower(), character_name=name, human_name="Alice", persona_prompt=f"You are {name}.",
+        asr_config=None, tts_config=None, vad_config=None,
+        agent_config=SimpleNamespace(
+            conversation_agent_choice="basic_memory_agent",
+            agent_settings=SimpleNamespace(basic_memory_agent=SimpleNamespace(llm_provider=provider)),
+            llm_configs=llm_configs,
+        ),
+    )
+
+
+class FakeLLM:
+    """Replies "<speaker> #<number of messages>"; speakers listed in `blocked` never answer."""
+
+    def __init__(self, blocked=()):
+        self.blocked = set(blocked)
+        self.requests = []
+
+    async def generate_response(self, messages, **kwargs):
+        speaker = messages[0]["content"].split()[2].rstrip(".")
+        self.requests.append((speaker, messages))
+        if speaker in self.blocked:
+            await asyncio.Event().wait()
+        await asyncio.sleep(0)
+        return f"{speaker} #{len(messages)}"
+
+
+PARTICIPANTS = [character("Ann"), character("Bob"), character("Cid")]
+HISTORY = [{"role": "user", "content": "Hi all"}]
+
+
+def run_round(llm, mode, deliver=None, stop=None):
+    scheduler = GroupTurnScheduler(llm, mode, llm_config_for=lambda c: None)
+    return asyncio.run(scheduler.run_round(HISTORY, PARTICIPANTS, deliver, stop))
+
+
+def test_participant_sees_own_turns_as_assistant():
+    history = HISTORY + [{"role": "assistant", "name": "Ann", "content": "yo"},
+                         {"role": "assistant", "name": "Bob", "content": "hey"}]
+    assert participant_messages(history, PARTICIPANTS[1], "SYS") == [
+        {"role": "system", "content": "SYS"},
+        {"role": "user", "content": "Alice: Hi all"},
+        {"role": "user", "content": "Ann: yo"},
+        {"role": "assistant", "content": "hey"},
+    ]
+
+
+@pytest.mark.parametrize("mode", ["sequential", "speculative"])
+def test_later_speakers_see_the_round_so_far(mode):
+    result = run_round(FakeLLM(), mode)
+    assert [turn.text for turn in result.turns] == ["Ann #2", "Bob #3", "Cid #4"]
+    assert not result.interrupted and result.discarded == 0
+
+
+def test_parallel_reactions_share_the_starting_history():
+    result = run_round(FakeLLM(), "parallel")
+    assert [turn.text for turn in result.turns] == ["Ann #2", "Bob #2", "Cid #2"]
+    assert result.discarded == 0
+
+
+@pytest.mark.parametrize("mode, discarded", [
+    # The reply being spoken is thrown away...
+    ("sequential", 1),
+    # ...plus the next one, generated while it was spoken...
+    ("speculative", 2),
+    # ...or every reply of the round
+    ("parallel", 3),
+])
+def test_interrupt_discards_unspoken_replies(mode, discarded):
+    stop = asyncio.Event()
+
+    async def deliver(turn):
+        stop.set()
+        await asyncio.Event().wait()
+
+    llm = FakeLLM(blocked={"Cid"})
+    result = run_round(llm, mode, deliver, stop)
+    assert result.turns == []
+    assert result.interrupted
+    assert result.discarded == discarded
+
+
+def test_interrupt_cancels_pending_generations():
+    stop = asyncio.Event()
+    spoken = []
+
+    async def deliver(turn):
+        spoken.append(turn.name)
+        if turn.name == "Bob":
+            stop.set()
+
+    llm = FakeLLM(blocked={"Cid"})
+    result = run_round(llm, "speculative", deliver, stop)
+    # Bob finished speaking, but the stop came before Cid's reply
+    assert [turn.name for turn in result.turns] == ["Ann", "Bob"]
+    assert result.interrupted and result.discarded == 1
+
+
+def test_participants_use_their_own_backends():
+    ollama = OllamaConfig(base_url="http://localhost:11434/v1", model="qwen2.5", temperature=0.3)
+    remote = OpenAICompatibleConfig(base_url="https://api.example.com/v1", llm_api_key="key",
+                                    model="big-model", temperature=1.2)
+    participants = [
+        character("Ann", "ollama_llm", SimpleNamespace(ollama_llm=ollama, openai_compatible_llm=remote)),
+        character("Bob", "openai_compatible_llm", SimpleNamespace(ollama_llm=ollama, openai_compatible_llm=remote)),
+        character("Cid"),
+    ]
+    manager = LLMClientManager(OpenAICompatibleConfig(base_url="https://default.example.com/v1",
+                                                      llm_api_key="key", model="default-model",
+                                                      temperature=0.7))
+    calls = []
+
+    async def request_completion(client, model, messages, temperature, priority="chat"):
+        calls.append((str(client.base_url), model, temperature))
+        return f"reply from {model}"
+
+    manager._request_completion = request_completion
+    result = asyncio.run(GroupTurnScheduler(manager, "parallel").run_round(HISTORY, participants))
+    assert [turn.text for turn in result.turns] == [
+        "reply from qwen2.5", "reply from big-model", "reply from default-model"]
+    assert calls == [
+        ("http://localhost:11434/v1/", "qwen2.5", 0.3),
+        ("https://api.example.com/v1/", "big-model", 1.2),
+        ("https://default.example.com/v1/", "default-model", 0.7),
+    ]
+
+
+def test_mode_comes_from_the_system_setting():
+    assert GroupTurnScheduler.from_config(FakeLLM()).mode == "speculative"
+    assert GroupTurnScheduler.from_config(FakeLLM(), "parallel").mode == "parallel"
+    with pytest.raises(ValueError):
+        GroupTurnScheduler.from_config(FakeLLM(), "round_robin")
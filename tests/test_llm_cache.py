@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.open_llm_vtuber.llm_cache import InMemoryCacheBackend, ResponseCache, SQLiteCacheBackend, make_cache_key
+
+
+class ThreadRecording:
+    """Wraps a backend and records the thread each call ran on."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.blocking = backend.blocking
+        self.threads = []
+
+    def get(self, key):
+        self.threads.append(threading.get_ident())
+        return self.backend.get(key)
+
+    def set(self, key, value, ttl):
+        self.threads.append(threading.get_ident())
+        self.backend.set(key, value, ttl)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        backend = InMemoryCacheBackend()
+    else:
+        backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"))
+    yield ThreadRecording(backend)
+    backend.close()
+
+
+def test_lookups_and_stores_keep_sqlite_off_the_event_loop(backend):
+    cache = ResponseCache(backend)
+    key = make_cache_key("model", 0.2, [{"role": "user", "content": "Hi  there"}])
+
+    async def run():
+        assert await cache.get(key) is None
+        await cache.set(key, "hello")
+        assert await cache.get(make_cache_key("model", 0.2, [{"role": "user", "content": "hi there"}])) == "hello"
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert len(backend.threads) == 3
+    assert all((thread != loop_thread) == backend.blocking for thread in backend.threads)
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from src.open_llm_vtuber.llm_config_manager import (
+    LLMClientManager,
+    LLMRouterConfig,
+    OpenAICompatibleConfig,
+    ResponseCacheConfig,
+)
+
+
+def backend(name, temperature):
+    return OpenAICompatibleConfig(base_url=f"https://{name}.example.com/v1", llm_api_key="key",
+                                  model=f"{name}-model", temperature=temperature)
+
+
+def routed_manager(*temperatures, default_temperature=1.0):
+    manager = LLMClientManager(
+        backend("default", default_temperature),
+        cache_config=ResponseCacheConfig(enabled=True, max_temperature=0.5),
+        router_config=LLMRouterConfig(enabled=True),
+        router_backends={f"b{i}": backend(f"b{i}", t) for i, t in enumerate(temperatures)},
+    )
+    calls = []
+
+    async def request_completion(client, model, messages, temperature, priority="chat"):
+        calls.append((model, temperature))
+        return f"reply {len(calls)}"
+
+    manager._request_completion = request_completion
+    return manager, calls
+
+
+def ask(manager, temperature=None):
+    return asyncio.run(manager.generate_response([{"role": "user", "content": "hi"}], temperature=temperature))
+
+
+@pytest.mark.parametrize("default_temperature, temperatures, cached", [
+    # The default config's temperature is never sent, so it does not matter
+    (1.0, (0.2, 0.2), True),
+    (1.0, (0.2, 0.4), True),
+    # Any backend may answer, so all of them have to be cacheable
+    (0.3, (0.2, 0.9), False),
+])
+def test_routed_requests_are_cached_by_the_backends_temperatures(default_temperature, temperatures, cached):
+    manager, calls = routed_manager(*temperatures, default_temperature=default_temperature)
+    assert ask(manager) == "reply 1"
+    assert ask(manager) == ("reply 1" if cached else "reply 2")
+    assert calls[0][1] in temperatures
+
+
+def test_explicit_temperature_decides_for_routed_requests():
+    manager, calls = routed_manager(0.2, 0.9)
+    assert ask(manager, temperature=0.1) == ask(manager, temperature=0.1) == "reply 1"
+    assert calls == [(calls[0][0], 0.1)]
+    manager, calls = routed_manager(0.2, 0.2)
+    assert ask(manager, temperature=0.8) != ask(manager, temperature=0.8)
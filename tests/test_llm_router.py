@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from src.open_llm_vtuber.llm_router import LLMBackend, LLMRouter
+
+
+def backends(*names):
+    return [LLMBackend(name, client=None, model=name) for name in names]
+
+
+def test_abandoned_attempt_never_lowers_the_average():
+    backend = LLMBackend("a", client=None, model="a")
+    backend.ewma_latency = 5.0
+    backend.record_abandoned(0.2, streaming=False)
+    assert backend.ewma_latency == 5.0
+    backend.record_abandoned(7.0, streaming=False)
+    assert 5.0 < backend.ewma_latency < 7.0
+
+
+def test_hedge_loser_is_recorded_as_abandoned():
+    slow, fast = backends("slow", "fast")
+    router = LLMRouter([slow, fast], hedge=True, hedge_min_delay=0.01, hedge_max_delay=0.01)
+
+    async def attempt(backend):
+        await asyncio.sleep(1.0 if backend is slow else 0.0)
+        return backend.name
+
+    assert asyncio.run(router.run(attempt)) == "fast"
+    assert slow.ewma_latency is not None and slow.ewma_latency >= 0.01
+    assert fast.ewma_latency is not None
+
+
+def test_caller_cancellation_is_not_recorded():
+    (backend,) = backends("a")
+    router = LLMRouter([backend])
+
+    async def run():
+        task = asyncio.ensure_future(router.run(lambda b: asyncio.sleep(1.0)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert backend.ewma_latency is None and backend.in_flight == 0
+
+
+def test_stream_records_one_success():
+    (backend,) = backends("a")
+    backend.error_rate = 0.5
+    router = LLMRouter([backend])
+
+    async def open_stream(b):
+        for word in ("a", "b"):
+            yield {"type": "delta", "content": word}
+
+    async def run():
+        return [event["content"] async for event in router.stream(open_stream)]
+
+    assert asyncio.run(run()) == ["a", "b"]
+    assert backend.error_rate == pytest.approx(0.5 * (1 - backend.ewma_alpha))
+    assert backend.ewma_ttft is not None and backend.ewma_latency is not None
+    assert len(backend.ttft_samples) == len(backend.latency_samples) == 1
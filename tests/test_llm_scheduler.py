@@ -0,0 +1,47 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src.open_llm_vtuber.llm_scheduler import LLMScheduler, UpstreamLimiter, parse_duration, parse_milliseconds
+
+
+def test_header_durations():
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_milliseconds("20") == pytest.approx(0.02)
+    assert parse_milliseconds("soon") is None
+
+
+@pytest.mark.parametrize("headers, pause", [
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"retry-after-ms": "1500", "retry-after": "9"}, 1.5),
+    ({"retry-after": "2"}, 2.0),
+])
+def test_429_pauses_the_upstream(headers, pause):
+    scheduler = LLMScheduler()
+    request = httpx.Request("POST", "http://localhost:11434/v1/chat/completions")
+    asyncio.run(scheduler.observe_response(httpx.Response(429, headers=headers, request=request)))
+    assert scheduler.stats()["localhost:11434"]["paused_for"] == pytest.approx(pause, abs=0.1)
+
+
+class CountingRateLimits:
+    def __init__(self):
+        self.reads = 0
+
+    def paused_until(self, upstream):
+        self.reads += 1
+        return 0.0
+
+
+def test_shared_pauses_are_read_at_most_once_a_second():
+    shared = CountingRateLimits()
+    limiter = UpstreamLimiter("host", max_concurrency=4, max_queue=4, shared=shared)
+
+    async def run():
+        for _ in range(3):
+            await limiter.acquire(1)
+            limiter.release()
+
+    asyncio.run(run())
+    assert shared.reads == 1
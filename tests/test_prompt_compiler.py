@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+from src.open_llm_vtuber.prompt_compiler import PromptCompiler
+
+PROMPTS = {"live2d_expression_prompt": "Emotions: [<insert_emomap_keys>]."}
+
+
+def character(persona, model):
+    return SimpleNamespace(conf_name=model, persona_prompt=persona, live2d_model_name=model)
+
+
+def test_substitutions_are_filled_in_per_character():
+    loads = []
+
+    def load_prompt(name):
+        loads.append(name)
+        return PROMPTS[name]
+
+    emotions = {"mao": "joy, anger", "shizuku": "fear"}
+    compiler = PromptCompiler(
+        tool_prompts={"live2d_expression_prompt": "live2d_expression_prompt"},
+        load_prompt=load_prompt,
+        substitutions=lambda c: {"[<insert_emomap_keys>]": emotions[c.live2d_model_name]},
+    )
+    assert compiler.compile(character("Hi.", "mao")).text == "Hi.\n\nEmotions: joy, anger."
+    assert compiler.compile(character("Hi.", "shizuku")).text == "Hi.\n\nEmotions: fear."
+    assert compiler.compile(character("Hi.", "mao")) is compiler.compile(character("Hi.", "mao"))
+    assert loads == ["live2d_expression_prompt"]
+
+
+def test_fixed_substitutions_and_dynamic_prompts():
+    compiler = PromptCompiler(
+        tool_prompts={"live2d_expression_prompt": "live2d_expression_prompt", "group_conversation_prompt": "x"},
+        load_prompt=PROMPTS.__getitem__,
+        substitutions={"[<insert_emomap_keys>]": "joy"},
+    )
+    assert compiler.compile(character("", "mao")).text == "Emotions: joy."
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from src.open_llm_vtuber.request_coalescer import SingleFlight, StreamCancelledError
+
+
+class Source:
+    """An async iterator that yields 0, 1, 2, ... each time `step` is set; records aclose()."""
+
+    def __init__(self, count):
+        self.count = count
+        self.step = asyncio.Event()
+        self.closed = False
+
+    async def __aiter__(self):
+        try:
+            for i in range(self.count):
+                await self.step.wait()
+                self.step.clear()
+                yield i
+        finally:
+            self.closed = True
+
+    async def advance(self, times=1):
+        for _ in range(times):
+            self.step.set()
+            for _ in range(5):
+                await asyncio.sleep(0)
+
+
+async def collect(events):
+    return [event async for event in events]
+
+
+def test_joiner_keeps_the_stream_when_the_leader_leaves_first():
+    async def run():
+        flight = SingleFlight()
+        source = Source(3)
+        leader = flight.stream("k", source.__aiter__)
+        joiner = flight.stream("k", lambda: pytest.fail("second upstream call"))
+        await source.advance()
+        assert await leader.__anext__() == 0
+        # The leader detaches before the joiner ever iterated
+        await leader.aclose()
+        await source.advance(2)
+        assert await collect(joiner) == [0, 1, 2]
+        assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 1}
+
+    asyncio.run(run())
+
+
+def test_last_subscriber_leaving_cancels_upstream():
+    async def run():
+        flight = SingleFlight()
+        source = Source(3)
+        first, second = flight.stream("k", source.__aiter__), flight.stream("k", source.__aiter__)
+        await first.aclose()
+        await asyncio.sleep(0)
+        assert not source.closed
+        # Never iterated, but closing it still detaches
+        await second.aclose()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert source.closed
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("cancelled_event", [None, {"type": "error"}])
+def test_cancelled_stream_ends_with_a_terminal_frame(cancelled_event):
+    async def run():
+        flight = SingleFlight()
+        source = Source(3)
+        events = flight.stream("k", source.__aiter__, cancelled_event=cancelled_event)
+        await source.advance()
+        flight._streams["k"].task.cancel()
+        if cancelled_event is None:
+            assert await events.__anext__() == 0
+            with pytest.raises(StreamCancelledError):
+                await events.__anext__()
+        else:
+            assert await collect(events) == [0, cancelled_event]
+
+    asyncio.run(run())
+
+
+def test_do_shares_one_call_and_survives_a_waiter_leaving():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            return "result"
+
+        first = asyncio.ensure_future(flight.do("k", fn))
+        second = asyncio.ensure_future(flight.do("k", fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == "result"
+        assert calls == [1]
+        assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 1}
+
+    asyncio.run(run())
@@ -0,0 +1,98 @@
+import sqlite3
+import time
+
+import pytest
+
+from src.open_llm_vtuber.session_store import InMemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    stores = []
+
+    def make(**kwargs):
+        if request.param == "memory":
+            store = InMemorySessionStore(**kwargs)
+        else:
+            kwargs.pop("max_sessions", None)
+            store = SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def turn(role, content):
+    return {"role": role, "content": content}
+
+
+def test_empty_store_is_usable(make_store):
+    store = make_store()
+    assert len(store) == 0
+    assert store.get("s1") == []
+    store.append("s1", [turn("user", "hi"), turn("assistant", "hello")])
+    assert store.get("s1") == [turn("user", "hi"), turn("assistant", "hello")]
+    assert len(store) == 1
+
+
+def test_sessions_are_separate_and_deletable(make_store):
+    store = make_store()
+    store.append("a", [turn("user", "one")])
+    store.append("b", [turn("user", "two")])
+    store.delete("a")
+    assert store.get("a") == []
+    assert store.get("b") == [turn("user", "two")]
+
+
+def test_message_cap_drops_oldest(make_store):
+    store = make_store(max_messages=3)
+    for index in range(5):
+        store.append("s", [turn("user", str(index))])
+    assert [m["content"] for m in store.get("s")] == ["2", "3", "4"]
+
+
+def test_char_cap_keeps_the_newest_message(make_store):
+    store = make_store(max_chars=10)
+    store.append("s", [turn("user", "aaaaaa"), turn("assistant", "bbbbbb")])
+    assert store.get("s") == [turn("assistant", "bbbbbb")]
+    store.append("s", [turn("user", "c" * 50)])
+    assert store.get("s") == [turn("user", "c" * 50)]
+
+
+def test_speaker_names_are_kept(make_store):
+    store = make_store()
+    group_turn = {"role": "assistant", "name": "Ann", "content": "hey"}
+    store.append("s", [turn("user", "hi"), group_turn])
+    assert store.get("s") == [turn("user", "hi"), group_turn]
+
+
+def test_sqlite_store_adds_the_name_column(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE chat_session_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                 "session_id TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL)")
+    conn.close()
+    store = SQLiteSessionStore(path)
+    store.append("s", [{"role": "assistant", "name": "Ann", "content": "hey"}])
+    assert store.get("s") == [{"role": "assistant", "name": "Ann", "content": "hey"}]
+    store.close()
+
+
+def test_idle_sessions_expire():
+    store = InMemorySessionStore(idle_ttl=0.05)
+    store.append("s", [turn("user", "hi")])
+    time.sleep(0.1)
+    assert store.get("s") == []
+    assert len(store) == 0
+
+
+def test_least_recently_used_session_is_evicted():
+    store = InMemorySessionStore(max_sessions=2)
+    store.append("a", [turn("user", "a")])
+    store.append("b", [turn("user", "b")])
+    store.get("a")
+    store.append("c", [turn("user", "c")])
+    assert store.get("b") == []
+    assert store.get("a") == [turn("user", "a")]
@@ -0,0 +1,35 @@
+import os
+
+from src.open_llm_vtuber.tts_cache import TTSAudioCache
+
+
+def write_audio(directory, name, size):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    return path
+
+
+def test_least_recently_used_audio_is_evicted(tmp_path):
+    cache = TTSAudioCache(str(tmp_path / "cache"), max_bytes=250, in_use_seconds=0)
+    cache.put("a", write_audio(tmp_path, "a.wav", 100))
+    cache.put("b", write_audio(tmp_path, "b.wav", 100))
+    assert cache.get("a") is not None
+    cache.put("c", write_audio(tmp_path, "c.wav", 100))
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+    assert cache.total_bytes == 200
+
+
+def test_audio_handed_out_recently_is_not_evicted(tmp_path):
+    cache = TTSAudioCache(str(tmp_path / "cache"), max_bytes=150)
+    cache.put("a", write_audio(tmp_path, "a.wav", 100))
+    path = cache.get("a")
+    cache.put("b", write_audio(tmp_path, "b.wav", 100))
+    # The caller of get() may still be reading the file
+    assert os.path.exists(path)
+    assert "a" in cache and "b" in cache
+    cache.in_use_seconds = 0
+    cache.put("c", write_audio(tmp_path, "c.wav", 100))
+    assert not os.path.exists(path)
+    assert cache.total_bytes <= 150
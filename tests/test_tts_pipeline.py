@@ -0,0 +1,49 @@
+from src.open_llm_vtuber.tts_pipeline import IncrementalSentenceSplitter
+
+
+def feed_all(splitter, deltas):
+    """Feeds the deltas one at a time; returns (delta index, sentence) for every release."""
+    released = []
+    for index, delta in enumerate(deltas):
+        released.extend((index, sentence) for sentence in splitter.feed(delta))
+    released.extend((len(deltas), sentence) for sentence in splitter.flush())
+    return released
+
+
+def test_sentence_is_released_with_the_next_token():
+    splitter = IncrementalSentenceSplitter(faster_first_response=False)
+    deltas = ["Sure", ".", " The", " weather", " is", " nice", ".", " Bye", "!"]
+    assert feed_all(splitter, deltas) == [
+        (2, "Sure. "),
+        (7, "The weather is nice. "),
+        (9, "Bye!"),
+    ]
+
+
+def test_whitespace_after_terminator_does_not_split_early():
+    splitter = IncrementalSentenceSplitter(faster_first_response=False)
+    # pysbd keeps "Mr. Smith" together, so nothing is released at the space
+    assert feed_all(splitter, ["Ask", " Mr", ".", " ", "Smith", ".", " Ok"]) == [
+        (6, "Ask Mr. Smith. "),
+        (7, "Ok"),
+    ]
+
+
+def test_decimal_numbers_are_not_split():
+    splitter = IncrementalSentenceSplitter(faster_first_response=False)
+    assert feed_all(splitter, ["It", " costs", " 3", ".", "14", " dollars", "."]) == [
+        (7, "It costs 3.14 dollars."),
+    ]
+
+
+def test_first_fragment_is_cut_at_a_comma():
+    splitter = IncrementalSentenceSplitter(faster_first_response=True, first_fragment_min_length=5)
+    released = feed_all(splitter, ["Well", " then", ",", " let", " me", " see", ".", " Ok"])
+    assert released == [(2, "Well then,"), (7, "let me see. "), (8, "Ok")]
+
+
+def test_flush_returns_the_rest():
+    splitter = IncrementalSentenceSplitter(faster_first_response=False)
+    assert splitter.feed("No terminator yet") == []
+    assert splitter.flush() == ["No terminator yet"]
+    assert splitter.flush() == []
@@ -0,0 +1,93 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+
+from src.open_llm_vtuber.warm_pool import SharedWarmPoolState, WarmPool
+
+
+def ollama_character(model):
+    backend = SimpleNamespace(base_url="http://localhost:11434/v1", model=model, keep_alive=300.0,
+                              unload_at_exit=True)
+    return SimpleNamespace(
+        conf_uid=model, character_name=model, asr_config=None, tts_config=None, vad_config=None,
+        agent_config=SimpleNamespace(
+            conversation_agent_choice="basic_memory_agent",
+            agent_settings=SimpleNamespace(basic_memory_agent=SimpleNamespace(llm_provider="ollama_llm")),
+            llm_configs=SimpleNamespace(ollama_llm=backend),
+        ),
+    )
+
+
+def ollama_calls():
+    """An httpx client for a fake Ollama; the list collects (model, keep_alive) of each call."""
+    calls = []
+
+    def handler(request):
+        body = json.loads(request.content)
+        calls.append((body["model"], body["keep_alive"]))
+        return httpx.Response(200, json={"load_duration": 1_000_000})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler)), calls
+
+
+def test_lowest_live_pid_leads_and_the_last_one_out_is_reported(tmp_path):
+    path = str(tmp_path / "workers.sqlite3")
+    alive = {1, 2, 3}
+    states = {pid: SharedWarmPoolState(path, pid=pid, alive=alive.__contains__) for pid in (1, 2, 3)}
+    for state in states.values():
+        state.join()
+    assert [pid for pid, state in states.items() if state.is_leader()] == [1]
+
+    # Worker 1 died without leaving
+    alive.discard(1)
+    assert states[2].is_leader()
+    assert not states[3].leave()
+    assert states[2].leave()
+
+
+def test_only_the_last_worker_unloads(tmp_path):
+    path = str(tmp_path / "workers.sqlite3")
+
+    async def run():
+        pools, calls = [], []
+        for pid in (1, 2):
+            http, pool_calls = ollama_calls()
+            calls.append(pool_calls)
+            pool = WarmPool(SimpleNamespace(preload_at_startup=True, keep_alive_margin=0.8, min_ping_interval=0.01),
+                            http_client=http,
+                            shared_state=SharedWarmPoolState(path, pid=pid, alive=lambda pid: True))
+            pool.add_character(ollama_character("qwen2.5"))
+            pool.start()
+            pools.append(pool)
+        await asyncio.sleep(0.1)
+        assert [pool.leading for pool in pools] == [True, False]
+        assert calls == [[("qwen2.5", 300.0)], []]
+
+        await pools[0].close()
+        assert calls[0] == [("qwen2.5", 300.0)]
+        # The remaining worker takes over, then unloads as the last one
+        await asyncio.sleep(0.1)
+        assert pools[1].leading
+        await pools[1].close()
+        assert calls[1] == [("qwen2.5", 300.0), ("qwen2.5", 0)]
+
+    asyncio.run(run())
+
+
+def test_characters_added_later_are_loaded():
+    async def run():
+        http, calls = ollama_calls()
+        pool = WarmPool.from_config(None, [])
+        pool._http = http
+        pool.start()
+        await asyncio.sleep(0)
+        pool.add_characters([ollama_character("llama3"), None])
+        await asyncio.sleep(0.05)
+        assert calls == [("llama3", 300.0)]
+        assert pool.stats()["models"][0]["warm"]
+        await pool.close()
+        await http.aclose()
+
+    asyncio.run(run())